@@ -0,0 +1,375 @@
+from frc_apriltags import USBCamera, AprilTagDetector, DetectionPacketPublisher, UNDISTORT_IMAGE, UNDISTORT_CORNERS, recorded_frames, draw_frustums
+from threading import Semaphore
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import numpy as np
+import cv2 as cv
+import ntcore
+
+
+# Stages reported by the benchmark, in the order they happen
+STAGES = ('resize', 'remap', 'detect', 'pose', 'draw', 'encode', 'publish')
+
+# A metric is a regression when it gets worse than the baseline by more than this ratio
+REGRESSION_THRESHOLD = 0.1
+
+# Port of the local NetworkTables server, away from the robot default so it can run next to it
+BENCHMARK_NT_PORT = 5815
+
+# Synthetic tags: id, size as a fraction of the frame height, center as a fraction of the frame, motion amplitude in pixels
+SYNTHETIC_TAGS = (
+    (10, 0.45, (0.3, 0.5), 40),
+    (21, 0.15, (0.7, 0.35), 20),
+    (3, 0.05, (0.8, 0.75), 10),
+)
+
+
+def video_frames(path: str):
+    cap = cv.VideoCapture(path)
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+
+            yield frame
+    finally:
+        cap.release()
+
+
+def image_frames(directory: str):
+    names = sorted(n for n in os.listdir(directory) if n.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp')))
+    for name in names:
+        frame = cv.imread(os.path.join(directory, name), cv.IMREAD_COLOR)
+        if frame is not None:
+            yield frame
+
+
+def synthetic_frames(resolution, count: int = 120, seed: int = 3117):
+    # Tags of every distance moving around, used when there is no recording
+    width, height = resolution
+    dictionary = cv.aruco.getPredefinedDictionary(cv.aruco.DICT_APRILTAG_36h11)
+
+    rng = np.random.default_rng(seed)
+    background = rng.integers(90, 140, (height, width, 1), dtype=np.uint8).repeat(3, axis=2)
+
+    tags = []
+    for tag_id, size, center, amplitude in SYNTHETIC_TAGS:
+        pixels = max(16, int(size * height))
+
+        # White border around the tag like a printed one
+        tag = cv.aruco.generateImageMarker(dictionary, tag_id, pixels)
+        tag = np.pad(tag, pixels // 8, constant_values=255)
+        tags.append((tag[..., None].repeat(3, axis=2), center, amplitude))
+
+    for i in range(count):
+        frame = background.copy()
+        for tag, (cx, cy), amplitude in tags:
+            x = int(cx * width + amplitude * math.sin(i * 0.2) - tag.shape[1] / 2)
+            y = int(cy * height + amplitude * math.cos(i * 0.15) - tag.shape[0] / 2)
+
+            # Clip the tag to the frame
+            x0, y0 = max(0, x), max(0, y)
+            x1, y1 = min(width, x + tag.shape[1]), min(height, y + tag.shape[0])
+            if x1 > x0 and y1 > y0:
+                frame[y0:y1, x0:x1] = tag[y0 - y:y1 - y, x0 - x:x1 - x]
+
+        yield frame
+
+
+class ReplayCapture:
+    # Stands in for cv.VideoCapture so the recorded frames go through the real USBCamera thread
+    # In lockstep mode a frame is only read once the previous one was processed, otherwise it is paced at the camera rate
+    def __init__(self, make_frames, count: int, fps: float = 0.):
+        self.__make_frames = make_frames
+        self.__frames = make_frames()
+        self.__remaining = count
+        self.__period = 1. / fps if fps > 0 else 0.
+        self.__next_time = time.monotonic()
+        self.__ready = Semaphore(1) if fps <= 0 else None
+
+    def set(self, prop, value):
+        return True
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
+
+    def consume(self):
+        if self.__ready is not None:
+            self.__ready.release()
+
+    def read(self, image=None):
+        if self.__ready is not None:
+            self.__ready.acquire()
+        elif self.__period > 0:
+            self.__next_time += self.__period
+            remaining = self.__next_time - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+
+        if self.__remaining <= 0:
+            return False, None
+
+        # Loop over the corpus until enough frames were given
+        frame = next(self.__frames, None)
+        if frame is None:
+            self.__frames = self.__make_frames()
+            frame = next(self.__frames, None)
+            if frame is None:
+                return False, None
+
+        self.__remaining -= 1
+
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            return True, image
+
+        return True, frame
+
+
+def percentile_ms(values, q: float) -> float:
+    return float(np.percentile(values, q) * 1000) if len(values) > 0 else 0.
+
+
+def create_local_nt():
+    server = ntcore.NetworkTableInstance.create()
+    server.startServer('', '127.0.0.1', 0, BENCHMARK_NT_PORT)
+
+    client = ntcore.NetworkTableInstance.create()
+    client.startClient4('apriltags-benchmark')
+    client.setServer('127.0.0.1', BENCHMARK_NT_PORT)
+
+    # Give the client some time to connect so the first frames are really sent
+    deadline = time.monotonic() + 2.
+    while not client.isConnected() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    return server, client
+
+
+def load_calibration_matrix(calibration_file: str):
+    with open(calibration_file, 'r') as f:
+        mtx_json = json.load(f)['matrix']
+
+    return np.array([
+        [mtx_json['fx'], 0, mtx_json['cx']],
+        [0, mtx_json['fy'], mtx_json['cy']],
+        [0, 0, 1]
+    ], dtype=np.float32)
+
+
+def run(args) -> dict:
+    resolution = tuple(args.resolution)
+    processing_resolution = tuple(args.processing_resolution) if args.processing_resolution is not None else resolution
+    stream_resolution = tuple(args.stream_resolution) if args.stream_resolution is not None else processing_resolution
+
+    if args.source is None:
+        make_frames = lambda: synthetic_frames(resolution)
+    elif args.source.endswith('.atrec'):
+        make_frames = lambda: recorded_frames(args.source)
+    elif os.path.isdir(args.source):
+        make_frames = lambda: image_frames(args.source)
+    else:
+        make_frames = lambda: video_frames(args.source)
+
+    capture = ReplayCapture(make_frames, args.frames, args.fps)
+    # The end of the corpus ends the benchmark, it must not be taken for a lost camera
+    camera = USBCamera(0, resolution, int(args.fps), capture_factory=lambda _: capture, reconnect=False)
+
+    detector = AprilTagDetector(None, None, processing_resolution, stream_resolution, args.calibration,
+                                nthreads=args.threads,
+                                tracking=args.tracking,
+                                undistort_mode=args.undistort_mode,
+                                adaptive_decimation=args.adaptive_decimation)
+
+    server, client = create_local_nt()
+    publisher = DetectionPacketPublisher(client, (0,))
+
+    camera_matrix = load_calibration_matrix(args.calibration)
+
+    camera.start()
+    camera.wait_for_init()
+
+    stage_times = {stage: [] for stage in STAGES}
+    latencies = []
+    processed = 0
+    last_index = -1
+
+    start_time = time.monotonic()
+    while True:
+        if not camera.wait_for_frame(last_index, timeout=1.):
+            if not camera.is_running():
+                break
+            continue
+
+        frame, frame_index = camera.get_frame()
+        if frame_index <= last_index:
+            continue
+
+        last_index = frame_index
+        frame_time = camera.get_frame_timestamp()
+
+        detection_list = detector.detect(frame, args.undistort, frame_time)
+        laps = detector.get_stage_times()
+
+        # Same work as the detection stream of the renderer, done inline so it can be timed
+        lap_start = time.perf_counter()
+        if args.streams:
+            drawn = cv.resize(frame, processing_resolution)
+            draw_frustums(drawn, detection_list, camera_matrix, detector.get_tag_size(), (0, 255, 0))
+            laps['draw'] = time.perf_counter() - lap_start
+
+            lap_start = time.perf_counter()
+            cv.imencode('.jpg', cv.resize(drawn, stream_resolution))
+            laps['encode'] = time.perf_counter() - lap_start
+
+            lap_start = time.perf_counter()
+
+        publisher.publish(0, frame_index, detection_list)
+        laps['publish'] = time.perf_counter() - lap_start
+
+        # From the moment the frame was captured to the moment its detections left
+        latencies.append(time.monotonic() - frame_time)
+        for stage, elapsed in laps.items():
+            stage_times.setdefault(stage, []).append(elapsed)
+
+        processed += 1
+        capture.consume()
+
+    elapsed = time.monotonic() - start_time
+
+    detector.stop()
+    camera.stop()
+    client.stopClient()
+    server.stopServer()
+
+    return {
+        'config': {
+            'source': args.source or 'synthetic',
+            'resolution': list(resolution),
+            'processing_resolution': list(processing_resolution),
+            'undistort': args.undistort,
+            'undistort_mode': args.undistort_mode,
+            'tracking': args.tracking,
+            'adaptive_decimation': args.adaptive_decimation,
+            'threads': args.threads,
+            'fps': args.fps,
+        },
+        'frames': processed,
+        # Frames the camera gave but that were overwritten before being processed
+        'dropped': max(0, last_index + 1 - processed),
+        'fps': processed / elapsed if elapsed > 0 else 0.,
+        'latency_p50_ms': percentile_ms(latencies, 50),
+        'latency_p99_ms': percentile_ms(latencies, 99),
+        'stages': {
+            stage: {
+                'mean_ms': float(np.mean(times) * 1000),
+                'p50_ms': percentile_ms(times, 50),
+                'p99_ms': percentile_ms(times, 99),
+            } for stage, times in stage_times.items() if len(times) > 0
+        },
+    }
+
+
+def flatten_metrics(result: dict) -> dict:
+    metrics = {
+        'fps': result['fps'],
+        'latency_p50_ms': result['latency_p50_ms'],
+        'latency_p99_ms': result['latency_p99_ms'],
+    }
+    for stage, times in result['stages'].items():
+        metrics[f'{stage}_p50_ms'] = times['p50_ms']
+        metrics[f'{stage}_p99_ms'] = times['p99_ms']
+
+    return metrics
+
+
+def compare(result: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD):
+    # Returns the metrics that got worse than the baseline by more than the threshold
+    current = flatten_metrics(result)
+    reference = flatten_metrics(baseline)
+
+    regressions = []
+    print(f'{"metric":<22}{"baseline":>12}{"current":>12}{"change":>10}')
+    for name, value in current.items():
+        base = reference.get(name)
+        if base is None or base == 0:
+            continue
+
+        change = (value - base) / base
+
+        # The frame rate is the only metric where higher is better
+        worse = -change if name == 'fps' else change
+        flag = '  <-- regression' if worse > threshold else ''
+        if worse > threshold:
+            regressions.append(name)
+
+        print(f'{name:<22}{base:>12.3f}{value:>12.3f}{change * 100:>9.1f}%{flag}')
+
+    return regressions
+
+
+def print_result(result: dict):
+    print(f'frames: {result["frames"]}  dropped: {result["dropped"]}  fps: {result["fps"]:.1f}')
+    print(f'latency p50: {result["latency_p50_ms"]:.2f} ms  p99: {result["latency_p99_ms"]:.2f} ms')
+
+    print(f'{"stage":<10}{"mean":>10}{"p50":>10}{"p99":>10}')
+    for stage in STAGES:
+        times = result['stages'].get(stage)
+        if times is not None:
+            print(f'{stage:<10}{times["mean_ms"]:>10.3f}{times["p50_ms"]:>10.3f}{times["p99_ms"]:>10.3f}')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Replay recorded frames through the camera, detection and publishing path and time every stage')
+    parser.add_argument('source', nargs='?', default=None, help='video file, directory of images or recording, synthetic tags when omitted')
+    parser.add_argument('--calibration', default='calibration_0.json')
+    parser.add_argument('--resolution', type=int, nargs=2, default=(1600, 1304))
+    parser.add_argument('--processing-resolution', type=int, nargs=2, default=None)
+    parser.add_argument('--stream-resolution', type=int, nargs=2, default=None)
+    parser.add_argument('--frames', type=int, default=300, help='number of frames to process, the corpus is looped if needed')
+    parser.add_argument('--fps', type=float, default=0., help='camera rate to replay at, 0 processes every frame one after the other')
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--undistort', action='store_true')
+    parser.add_argument('--undistort-mode', default=UNDISTORT_IMAGE, choices=(UNDISTORT_IMAGE, UNDISTORT_CORNERS))
+    parser.add_argument('--tracking', action='store_true')
+    parser.add_argument('--adaptive-decimation', action='store_true')
+    parser.add_argument('--no-streams', dest='streams', action='store_false', help='skip the draw and encode stages')
+    parser.add_argument('--save-baseline', default=None, help='write the result to this file')
+    parser.add_argument('--baseline', default=None, help='compare the result against this file')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    result = run(args)
+    print_result(result)
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+        print()
+        regressions = compare(result, baseline, args.threshold)
+        if len(regressions) > 0:
+            print(f'{len(regressions)} regression(s): {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+from frc_apriltags import IncrementalCalibration, find_chessboard, save_calibration, CHESSBOARD_SIZE
+from collections import deque
+from functools import partial
+from multiprocessing import Pool
+
+import argparse
+import os
+import sys
+import time
+import cv2 as cv
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def image_paths(directory: str):
+    # Only the paths go to the workers, they load the images themselves
+    names = sorted(n for n in os.listdir(directory) if n.lower().endswith(IMAGE_EXTENSIONS))
+    return [os.path.join(directory, name) for name in names]
+
+
+def video_frames(path: str, step: int = 1):
+    # The frames are sent to the workers, only the channel the corners are searched in is kept
+    cap = cv.VideoCapture(path)
+    try:
+        index = 0
+        while True:
+            # Skipped frames are only grabbed, not decoded
+            if index % step != 0:
+                if not cap.grab():
+                    break
+                index += 1
+                continue
+
+            ret, frame = cap.read()
+            if not ret:
+                break
+
+            index += 1
+            yield frame[..., 2].copy()
+    finally:
+        cap.release()
+
+
+def source_resolution(source: str):
+    if os.path.isdir(source):
+        for path in image_paths(source):
+            frame = cv.imread(path, cv.IMREAD_COLOR)
+            if frame is not None:
+                return frame.shape[1], frame.shape[0]
+
+        return None
+
+    cap = cv.VideoCapture(source)
+    try:
+        ret, frame = cap.read()
+        return (frame.shape[1], frame.shape[0]) if ret else None
+    finally:
+        cap.release()
+
+
+def run(args):
+    resolution = tuple(args.resolution) if args.resolution is not None else source_resolution(args.source)
+    if resolution is None:
+        print(f'No frame found in {args.source}')
+        return None
+
+    if os.path.isdir(args.source):
+        frames = image_paths(args.source)[::args.step]
+    else:
+        frames = video_frames(args.source, args.step)
+
+    calibration = IncrementalCalibration(resolution, tuple(args.board), args.square_size)
+    find = partial(find_chessboard, board_size=tuple(args.board), resolution=resolution)
+
+    start_time = time.monotonic()
+    processed = 0
+    last_solve_views = 0
+
+    def add_view(corners):
+        nonlocal processed, last_solve_views
+        processed += 1
+        if corners is None:
+            return
+
+        calibration.add(corners)
+
+        # Refine the estimate while the workers keep searching the next frames
+        if calibration.views >= args.min_views and calibration.views - last_solve_views >= args.update_interval:
+            last_solve_views = calibration.views
+            result = calibration.calibrate()
+            print(f'{processed} frames, {calibration.views} views: rms {result.rms:.3f} px, worst view {result.view_errors.max():.3f} px, '
+                  f'fx {result.camera_matrix[0, 0]:.1f} fy {result.camera_matrix[1, 1]:.1f}')
+
+    # Only a few frames are in flight at once so a long video is never loaded in memory
+    with Pool(args.workers) as pool:
+        pending = deque()
+        for frame in frames:
+            pending.append(pool.apply_async(find, (frame,)))
+            if len(pending) >= args.workers * 2:
+                add_view(pending.popleft().get())
+
+        while len(pending) > 0:
+            add_view(pending.popleft().get())
+
+    if calibration.views < args.min_views:
+        print(f'Only {calibration.views} views of the board in {processed} frames, at least {args.min_views} are needed')
+        return None
+
+    # The progress estimates are warm started, the saved one is solved from scratch
+    result = calibration.calibrate(warm_start=False)
+    if args.max_view_error is not None:
+        # Keep every view if too few of them would be left
+        if (result.view_errors <= args.max_view_error).sum() < args.min_views:
+            print(f'Too few views under {args.max_view_error} px, keeping them all')
+        else:
+            removed = calibration.remove_outliers(args.max_view_error)
+            if removed > 0:
+                print(f'Removed {removed} views above {args.max_view_error} px')
+                result = calibration.calibrate(warm_start=False)
+
+    print(f'{processed} frames, {calibration.views} views in {time.monotonic() - start_time:.1f} s')
+    print(f'rms {result.rms:.3f} px, worst view {result.view_errors.max():.3f} px')
+    print(result.dist)
+    print(result.camera_matrix)
+
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Calibrate a camera from a video or a directory of chessboard images, without a display')
+    parser.add_argument('source', help='video file or directory of images')
+    parser.add_argument('--output', default='calibration.json')
+    parser.add_argument('--resolution', type=int, nargs=2, default=None, help='resolution the detector processes the frames at, the source resolution when omitted')
+    parser.add_argument('--board', type=int, nargs=2, default=CHESSBOARD_SIZE, help='inner corners of the chessboard')
+    parser.add_argument('--square-size', type=float, default=1.)
+    parser.add_argument('--step', type=int, default=1, help='only use one frame out of this many')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--min-views', type=int, default=5, help='views needed before the first estimate')
+    parser.add_argument('--update-interval', type=int, default=10, help='new views between two estimates')
+    parser.add_argument('--max-view-error', type=float, default=None, help='drop the views above this reprojection error before the final estimate')
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    result = run(args)
+    if result is None:
+        sys.exit(1)
+
+    save_calibration(args.output, result.camera_matrix, result.dist)
+    print(f'Saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
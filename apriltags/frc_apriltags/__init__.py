@@ -1,8 +1,56 @@
-from .usbcamera import USBCamera
-from .detector import AprilTagDetector
+from .frame_ring import FrameRing
+from .mjpeg import MjpegStreamer, MjpegStream
+from .usbcamera import USBCamera, DETECTOR_READER, STREAM_READER, FOURCC_MJPG, FOURCC_YUYV, FOURCC_GREY
+from .decimation import AdaptiveDecimation, DECIMATION_LEVELS
+from .detector import AprilTagDetector, UNDISTORT_IMAGE, UNDISTORT_CORNERS
+from .renderer import StreamRenderer, draw_frustums
+from .pipeline import CameraSettings, CameraPipeline
+from .timesync import ServerClock
+from .perf import StageTimer, RollingStats, PerfMonitor, PerfPublisher
+from .packet import DetectionPacketPublisher, PacketDetection, encode_detections, decode_detections
+from .recording import RecordingSettings, Recorder, create_recorder, read_recording, recorded_frames, replay_detections
+from .calibration import IncrementalCalibration, CalibrationResult, find_chessboard, chessboard_points, calibration_json, save_calibration, CHESSBOARD_SIZE
 
 
 __all__ = [
+    'FrameRing',
+    'MjpegStreamer',
+    'MjpegStream',
     'USBCamera',
+    'DETECTOR_READER',
+    'STREAM_READER',
+    'FOURCC_MJPG',
+    'FOURCC_YUYV',
+    'FOURCC_GREY',
+    'AdaptiveDecimation',
+    'DECIMATION_LEVELS',
     'AprilTagDetector',
+    'UNDISTORT_IMAGE',
+    'UNDISTORT_CORNERS',
+    'StreamRenderer',
+    'draw_frustums',
+    'CameraSettings',
+    'CameraPipeline',
+    'ServerClock',
+    'StageTimer',
+    'RollingStats',
+    'PerfMonitor',
+    'PerfPublisher',
+    'DetectionPacketPublisher',
+    'PacketDetection',
+    'encode_detections',
+    'decode_detections',
+    'RecordingSettings',
+    'Recorder',
+    'create_recorder',
+    'read_recording',
+    'recorded_frames',
+    'replay_detections',
+    'IncrementalCalibration',
+    'CalibrationResult',
+    'find_chessboard',
+    'chessboard_points',
+    'calibration_json',
+    'save_calibration',
+    'CHESSBOARD_SIZE',
 ]
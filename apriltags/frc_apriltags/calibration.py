@@ -0,0 +1,135 @@
+from typing import NamedTuple, Optional, Tuple
+
+import json
+import numpy as np
+import cv2 as cv
+
+from .detector import detection_channel
+
+
+# Inner corners of the chessboard, columns then rows
+CHESSBOARD_SIZE = (7, 10)
+
+# Frames without a board are rejected by a quick check before the full corner search
+CHESSBOARD_FLAGS = cv.CALIB_CB_ADAPTIVE_THRESH + cv.CALIB_CB_NORMALIZE_IMAGE + cv.CALIB_CB_FAST_CHECK
+SUBPIX_CRITERIA = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+CALIBRATION_CRITERIA = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 30, 1e-6)
+
+
+class CalibrationResult(NamedTuple):
+    # Root mean square reprojection error over every view, in pixels
+    rms: float
+    camera_matrix: np.ndarray
+    dist: np.ndarray
+    # Root mean square reprojection error of every view, in pixels
+    view_errors: np.ndarray
+
+
+def chessboard_points(board_size: Tuple[int, int] = CHESSBOARD_SIZE, square_size: float = 1.) -> np.ndarray:
+    # Corners of the board on its own plane, (0,0,0), (1,0,0), (2,0,0) ....,(6,9,0)
+    points = np.zeros((board_size[0] * board_size[1], 3), np.float32)
+    points[:, :2] = np.mgrid[0:board_size[0], 0:board_size[1]].T.reshape(-1, 2) * square_size
+
+    return points
+
+
+def find_chessboard(frame, board_size: Tuple[int, int] = CHESSBOARD_SIZE, resolution: Tuple[int, int] = None) -> Optional[np.ndarray]:
+    # Corners of the board in the frame at the calibration resolution, None if the board is not fully visible
+    # The frame can be a path so a worker process loads it itself instead of receiving the pixels
+    if isinstance(frame, str):
+        frame = cv.imread(frame, cv.IMREAD_COLOR)
+        if frame is None:
+            return None
+
+    gray = detection_channel(frame)
+    if resolution is not None and (gray.shape[1], gray.shape[0]) != tuple(resolution):
+        gray = cv.resize(gray, resolution, interpolation=cv.INTER_AREA)
+
+    ret, corners = cv.findChessboardCorners(gray, board_size, None, CHESSBOARD_FLAGS)
+    if not ret:
+        return None
+
+    return cv.cornerSubPix(gray, corners, (11, 11), (-1, -1), SUBPIX_CRITERIA)
+
+
+class IncrementalCalibration:
+    # Accumulates the views of a chessboard and refines the calibration as they arrive
+    # The intermediate solves start from the previous estimate, so adding a few views only costs a few iterations
+    def __init__(self, resolution: Tuple[int, int], board_size: Tuple[int, int] = CHESSBOARD_SIZE, square_size: float = 1.):
+        self.__resolution = tuple(resolution)
+        self.__board_points = chessboard_points(board_size, square_size)
+
+        self.__object_points = []
+        self.__image_points = []
+
+        self.__result: CalibrationResult = None
+
+    @property
+    def views(self) -> int:
+        return len(self.__image_points)
+
+    def get_result(self) -> CalibrationResult:
+        return self.__result
+
+    def add(self, corners: np.ndarray):
+        self.__object_points.append(self.__board_points)
+        self.__image_points.append(corners)
+
+    def calibrate(self, warm_start: bool = True) -> CalibrationResult:
+        # The final solve should be cold, the iterations of a warm start can stop in the minimum of the previous views
+        flags = 0
+        camera_matrix = None
+        dist = None
+        if warm_start and self.__result is not None:
+            flags = cv.CALIB_USE_INTRINSIC_GUESS
+            camera_matrix = self.__result.camera_matrix.copy()
+            dist = self.__result.dist.copy()
+
+        rms, camera_matrix, dist, rvecs, tvecs = cv.calibrateCamera(self.__object_points, self.__image_points, self.__resolution, camera_matrix, dist,
+                                                                    flags=flags, criteria=CALIBRATION_CRITERIA)
+
+        view_errors = np.empty(len(self.__image_points))
+        for i, (object_points, image_points, rvec, tvec) in enumerate(zip(self.__object_points, self.__image_points, rvecs, tvecs)):
+            projected, _ = cv.projectPoints(object_points, rvec, tvec, camera_matrix, dist)
+            view_errors[i] = np.sqrt(np.mean(np.sum((projected.reshape(-1, 2) - image_points.reshape(-1, 2)) ** 2, axis=1)))
+
+        self.__result = CalibrationResult(rms, camera_matrix, dist, view_errors)
+        return self.__result
+
+    def remove_outliers(self, max_view_error: float) -> int:
+        # Drops the views the last calibration could not fit, usually a blurred frame or a wrong corner order
+        if self.__result is None:
+            return 0
+
+        keep = self.__result.view_errors <= max_view_error
+        self.__object_points = [p for p, k in zip(self.__object_points, keep) if k]
+        self.__image_points = [p for p, k in zip(self.__image_points, keep) if k]
+        self.__result = self.__result._replace(view_errors=self.__result.view_errors[keep])
+
+        return int(len(keep) - keep.sum())
+
+
+def calibration_json(camera_matrix: np.ndarray, dist: np.ndarray) -> dict:
+    # Same layout as the files AprilTagDetector loads
+    dist = np.asarray(dist).ravel()
+
+    return {
+        'distortion': {
+            'k1': float(dist[0]),
+            'k2': float(dist[1]),
+            'p1': float(dist[2]),
+            'p2': float(dist[3]),
+            'k3': float(dist[4])
+        },
+        'matrix': {
+            'fx': float(camera_matrix[0, 0]),
+            'fy': float(camera_matrix[1, 1]),
+            'cx': float(camera_matrix[0, 2]),
+            'cy': float(camera_matrix[1, 2])
+        }
+    }
+
+
+def save_calibration(path: str, camera_matrix: np.ndarray, dist: np.ndarray):
+    with open(path, 'w') as f:
+        json.dump(calibration_json(camera_matrix, dist), f, indent=2)
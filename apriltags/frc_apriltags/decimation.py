@@ -0,0 +1,71 @@
+import numpy as np
+
+
+# Quad decimations the adaptive mode can pick from
+DECIMATION_LEVELS = (1., 1.5, 2., 3., 4.)
+
+# Weight of the last measure in the detection time average
+TIME_SMOOTHING = 0.2
+
+
+class AdaptiveDecimation:
+    # Picks the quad decimation of every frame from the apparent size of the tags in the previous one
+    # Near tags are large so they survive an aggressive decimation, far tags need the full resolution
+    # Without a budget, the frames without any tag are scanned at the configured search decimation
+    def __init__(self, max_decimation: float = 4., min_tag_pixels: float = 24., budget: float = None, search_decimation: float = 2.):
+        self.__levels = tuple(level for level in DECIMATION_LEVELS if level <= max_decimation) or (1.,)
+        self.__min_tag_pixels = min_tag_pixels
+        self.__budget = budget
+        self.__search_decimation = min(search_decimation, self.__levels[-1])
+
+        # Average time of a full scan at every decimation, in seconds
+        self.__times = {}
+        self.__decimation = self.__search_level__()
+
+    @property
+    def levels(self):
+        return self.__levels
+
+    def get_decimation(self) -> float:
+        return self.__decimation
+
+    def record_time(self, decimation: float, elapsed: float):
+        last = self.__times.get(decimation)
+        self.__times[decimation] = elapsed if last is None else last + (elapsed - last) * TIME_SMOOTHING
+
+    def update(self, detection_list):
+        if len(detection_list) == 0:
+            self.__decimation = self.__search_level__()
+            return
+
+        # The smallest tag must keep enough pixels once decimated to still be found
+        corners = np.array([d.corners for d in detection_list], dtype=np.float64)
+        tag_pixels = np.linalg.norm(corners - np.roll(corners, 1, axis=1), axis=2).min()
+
+        decimation = self.__levels[0]
+        for level in self.__levels:
+            if tag_pixels / level >= self.__min_tag_pixels:
+                decimation = level
+
+        self.__decimation = decimation
+
+    def __estimate_time__(self, decimation: float):
+        time = self.__times.get(decimation)
+        if time is not None or len(self.__times) == 0:
+            return time
+
+        # The detection time mostly follows the number of decimated pixels
+        level, level_time = min(self.__times.items(), key=lambda item: abs(item[0] - decimation))
+        return level_time * (level / decimation) ** 2
+
+    def __search_level__(self) -> float:
+        # Without any tag, look as far as possible while staying in the latency budget
+        if self.__budget is None:
+            return self.__search_decimation
+
+        for level in self.__levels:
+            time = self.__estimate_time__(level)
+            if time is None or time <= self.__budget:
+                return level
+
+        return self.__levels[-1]
@@ -1,57 +1,41 @@
 import json
+import time
 import numpy as np
 import cv2 as cv
 import pupil_apriltags as april_tags
 
+from .tracking import TagTracker
+from .decimation import AdaptiveDecimation
+from .perf import StageTimer
+from .renderer import StreamRenderer
 
-def __draw_frustum__(img, translation, rotation, camera_params, tag_size, outline_color):
-    camera_params = np.array(camera_params)
-    dist_coeffs = np.zeros((4, 1))
 
-    # 3D points of the bottom of the frustum
-    bottom = np.array([
-        [-tag_size / 2, tag_size / 2, 0],
-        [tag_size / 2, tag_size / 2, 0],
-        [tag_size / 2, -tag_size / 2, 0],
-        [-tag_size / 2, -tag_size / 2, 0]
-    ], dtype=np.float32)
+# Undistort the whole image before the detection
+UNDISTORT_IMAGE = 'image'
+# Detect on the distorted image then undistort the corners of every detection
+UNDISTORT_CORNERS = 'corners'
 
-    # 3D points of the top of the frustum
-    top = np.array([
-        [-tag_size / 2, tag_size / 2, -tag_size],
-        [tag_size / 2, tag_size / 2, -tag_size],
-        [tag_size / 2, -tag_size / 2, -tag_size],
-        [-tag_size / 2, -tag_size / 2, -tag_size]
-    ], dtype=np.float32)
 
-    rotation = np.array(rotation)
-    translation = np.array(translation)
+def detection_channel(frame):
+    # Gray frames are used as is, YUYV frames give their Y plane and BGR frames their red channel
+    if frame.ndim == 2:
+        return frame
+    if frame.shape[2] == 2:
+        return frame[..., 0]
 
-    image_points_bottom, _ = cv.projectPoints(bottom, rotation, translation, camera_params, dist_coeffs)
-    image_points_top, _ = cv.projectPoints(top, rotation, translation, camera_params, dist_coeffs)
-
-    top_corner_points = []
-
-    # Draw pillars from bottom points to top points
-    for i in range(4):
-        x1, y1 = image_points_bottom[i][0]
-        x2, y2 = image_points_top[i][0]
-
-        top_corner_points.append((x2, y2))
-
-        cv.line(img, (int(x1), int(y1)), (int(x2), int(y2)), outline_color, 2)
-
-    # Create a polyline for the top corners
-    top_corners_temp = np.array(top_corner_points, dtype=np.int32)
-    return cv.polylines(img, [top_corners_temp], isClosed=True, color=outline_color, thickness=2)
+    return frame[..., 2]
 
 
 class AprilTagDetector:
-    def __init__(self, raw_stream, detection_stream, resolution, stream_resolution, calibration_file: str, tag_size: float = 0.165, tag_family: str = 'tag36h11'):
-        self.__raw_stream = raw_stream
-        self.__detection_stream = detection_stream
+    def __init__(self, raw_stream, detection_stream, resolution, stream_resolution, calibration_file: str, tag_size: float = 0.165, tag_family: str = 'tag36h11', nthreads: int = 16,
+                 tracking: bool = False, tracking_full_scan_interval: int = 10, tracking_padding: float = 0.5,
+                 undistort_mode: str = UNDISTORT_IMAGE, stream_fps: int = 30, frame_source=None,
+                 quad_decimate: float = 2., quad_sigma: float = 0., adaptive_decimation: bool = False, max_quad_decimate: float = 4.,
+                 min_tag_pixels: float = 24., detection_budget: float = None):
+        if undistort_mode not in (UNDISTORT_IMAGE, UNDISTORT_CORNERS):
+            raise ValueError(f'Unknown undistort mode: {undistort_mode}')
+
         self.__resolution = resolution
-        self.__stream_resolution = stream_resolution
 
         with open(calibration_file, 'r') as f:
             json_calibration = json.load(f)
@@ -86,52 +70,197 @@ class AprilTagDetector:
         ], dtype=np.float32)
 
         self.__new_camera_matrix, roi = cv.getOptimalNewCameraMatrix(self.__camera_matrix, self.__dist, resolution, 0, resolution)
-        self.__mapx, self.__mapy = cv.initUndistortRectifyMap(self.__camera_matrix, self.__dist, None, self.__new_camera_matrix, resolution, 5)
+        self.__mapx, self.__mapy = cv.initUndistortRectifyMap(self.__camera_matrix, self.__dist, None, self.__new_camera_matrix, resolution, cv.CV_32FC1)
+
+        # Fixed-point maps going straight from the camera resolution to the undistorted processing resolution
+        # They are built on the first frame since the camera resolution is only known then
+        self.__fused_maps = None
+        self.__fused_source_size = None
+
+        # Time spent in every stage of the last detection
+        self.__stage_timer = StageTimer()
 
-        self.__detector = april_tags.Detector(families=tag_family, nthreads=16)
         self.__tag_size = tag_size
 
-    def detect(self, frame, undistort=False):
-        frame = cv.resize(frame, self.__resolution)
-        if undistort:
-            frame = cv.remap(frame, self.__mapx, self.__mapy, cv.INTER_LINEAR)
+        # A single detector, and its thread pool, whatever the decimation of the frame
+        self.__decimation = AdaptiveDecimation(max_quad_decimate, min_tag_pixels, detection_budget, quad_decimate) if adaptive_decimation else None
+        self.__quad_decimate = quad_decimate if self.__decimation is None else self.__decimation.get_decimation()
+        self.__detector = april_tags.Detector(families=tag_family, nthreads=nthreads, quad_decimate=self.__quad_decimate, quad_sigma=quad_sigma)
+
+        # The pose is solved by the detector unless the corners need to be undistorted first
+        self.__undistort_corners = undistort_mode == UNDISTORT_CORNERS
+        self.__tag_points = np.array([
+            [-tag_size / 2, tag_size / 2, 0],
+            [tag_size / 2, tag_size / 2, 0],
+            [tag_size / 2, -tag_size / 2, 0],
+            [-tag_size / 2, -tag_size / 2, 0]
+        ], dtype=np.float64)
+
+        # Only scan around the previously detected tags, with a full scan from time to time
+        self.__tracker = TagTracker(resolution, tracking_full_scan_interval, tracking_padding) if tracking else None
+
+        # The streams are rendered off the detection thread, from their own reader of the camera frames
+        if raw_stream is not None or detection_stream is not None:
+            self.__renderer = StreamRenderer(raw_stream, detection_stream, stream_resolution, stream_fps, self.__preprocess__,
+                                             self.__camera_matrix, tag_size, frame_source)
+            self.__renderer.start()
+        else:
+            self.__renderer = None
+
+    def __set_quad_decimate__(self, quad_decimate: float):
+        if quad_decimate == self.__quad_decimate:
+            return
+
+        # The detector reads its settings on every detection, so the decimation can change between two frames
+        self.__detector.params['quad_decimate'] = quad_decimate
+        self.__detector.tag_detector_ptr.contents.quad_decimate = float(quad_decimate)
+        self.__quad_decimate = quad_decimate
+
+    def get_quad_decimate(self) -> float:
+        return self.__quad_decimate
+
+    def get_tag_size(self) -> float:
+        return self.__tag_size
+
+    def get_stage_times(self) -> dict:
+        return self.__stage_timer.get_laps()
+
+    def __get_fused_maps__(self, source_size):
+        if self.__fused_source_size != source_size:
+            scale_x = source_size[0] / self.__resolution[0]
+            scale_y = source_size[1] / self.__resolution[1]
+
+            # Scale the undistortion maps to the camera resolution using the same pixel centers as cv.resize
+            mapx = (self.__mapx + 0.5) * scale_x - 0.5
+            mapy = (self.__mapy + 0.5) * scale_y - 0.5
+
+            self.__fused_maps = cv.convertMaps(mapx, mapy, cv.CV_16SC2)
+            self.__fused_source_size = source_size
+
+        return self.__fused_maps
+
+    def __preprocess__(self, frame, undistort: bool):
+        if not undistort:
+            return cv.resize(frame, self.__resolution)
+
+        # Resize and undistort in a single pass
+        map1, map2 = self.__get_fused_maps__((frame.shape[1], frame.shape[0]))
+        return cv.remap(frame, map1, map2, cv.INTER_LINEAR)
+
+    def detect(self, frame, undistort=False, timestamp: float = -1.):
+        # In corners mode the image is left distorted and only the detections get undistorted
+        undistort_corners = undistort and self.__undistort_corners
+        undistort_image = undistort and not self.__undistort_corners
 
-        detection_frame = frame.copy()
-        gray_frame = frame[..., 2]
+        timer = self.__stage_timer
+        timer.start()
+
+        # Only the channel used for the detection goes through the preprocessing
+        gray_frame = self.__preprocess__(detection_channel(frame), undistort_image)
+        timer.lap('remap' if undistort_image else 'resize')
 
         # Detect tags
-        detection_list = self.__detector.detect(gray_frame, estimate_tag_pose=True, camera_params=self.__apriltags_camera_params, tag_size=self.__tag_size)
+        if self.__decimation is not None:
+            self.__set_quad_decimate__(self.__decimation.get_decimation())
+
+        detection_list = self.__detect_tags__(gray_frame, not undistort_corners)
+        if self.__decimation is not None:
+            self.__decimation.update(detection_list)
+        timer.lap('detect')
+
+        if undistort_corners:
+            self.__undistort_detections__(detection_list)
+            timer.lap('pose')
+
+        # Keep the capture time of the frame with every detection
+        for detection in detection_list:
+            detection.timestamp = timestamp
+
+        # Hand the results to the stream renderer, it does all the drawing on its own thread
+        if self.__renderer is not None and self.__renderer.has_demand():
+            self.__renderer.submit(detection_list, frame, undistort_image, self.__dist if undistort_corners else None)
+            timer.lap('submit')
+
+        return detection_list
+
+    def __detect_full__(self, gray_frame, estimate_pose: bool = True):
+        start_time = time.perf_counter()
+        detection_list = self.__detector.detect(gray_frame, estimate_tag_pose=estimate_pose, camera_params=self.__apriltags_camera_params, tag_size=self.__tag_size)
+
+        # Only the full scans are timed, they are the ones that need to fit in the latency budget
+        if self.__decimation is not None:
+            self.__decimation.record_time(self.__quad_decimate, time.perf_counter() - start_time)
 
-        if self.__detection_stream is not None and self.__detection_stream.has_demand():
-            tags_outline = []
-            tags_center = []
-            for detection in detection_list:
-                # Get vertices for the outline of the tag
-                points = np.array([[int(corners[0]), int(corners[1])] for corners in detection.corners],
-                                  np.int32)
-                points = points.reshape((-1, 1, 2))
-                tags_outline.append(points)
+        return detection_list
 
-                # Get center point of the tag
-                center = np.array([[int(detection.center[0]), int(detection.center[1])]], np.int32)
-                center = center.reshape((-1, 1, 2))
-                tags_center.append(center)
+    def __detect_rois__(self, gray_frame, rois, estimate_pose: bool = True):
+        fx, fy, cx, cy = self.__apriltags_camera_params
 
-                # Get the pose of the tag
-                position = (detection.pose_t[0][0], detection.pose_t[1][0], detection.pose_t[2][0])
-                rotation = detection.pose_R
+        detection_list = []
+        for x0, y0, x1, y1 in rois:
+            # The principal point moves with the crop so the pose stays in the camera frame
+            crop = gray_frame[y0:y1, x0:x1]
+            crop_detection_list = self.__detector.detect(crop, estimate_tag_pose=estimate_pose, camera_params=(fx, fy, cx - x0, cy - y0), tag_size=self.__tag_size)
 
-                # Draw the bounding box of the tag
-                detection_frame = __draw_frustum__(frame, position, rotation, self.__camera_matrix, self.__tag_size,
-                                                 (0, 255, 0))
+            # Bring the detections back to the full frame coordinates
+            offset = np.array([x0, y0], dtype=np.float64)
+            to_frame = np.array([
+                [1, 0, x0],
+                [0, 1, y0],
+                [0, 0, 1]
+            ], dtype=np.float64)
 
-        detection_frame = cv.resize(detection_frame, self.__stream_resolution)
-        self.__detection_stream.set_frame(detection_frame)
+            for detection in crop_detection_list:
+                detection.corners = detection.corners + offset
+                detection.center = detection.center + offset
+                detection.homography = to_frame @ detection.homography
 
-        frame = cv.resize(frame, self.__stream_resolution)
-        self.__raw_stream.set_frame(frame)
+                detection_list.append(detection)
 
         return detection_list
 
-    def __call__(self, frame, undistort: bool = False):
-        self.detect(frame, undistort)
\ No newline at end of file
+    def __detect_tags__(self, gray_frame, estimate_pose: bool = True):
+        if self.__tracker is None:
+            return self.__detect_full__(gray_frame, estimate_pose)
+
+        if not self.__tracker.should_full_scan():
+            detection_list = self.__detect_rois__(gray_frame, self.__tracker.predict_rois(), estimate_pose)
+            self.__tracker.update(detection_list, False)
+
+            # Fallback on a full scan right away when a tag is lost so it does not flicker out
+            if not self.__tracker.is_lost():
+                return detection_list
+
+        detection_list = self.__detect_full__(gray_frame, estimate_pose)
+        self.__tracker.update(detection_list, True)
+
+        return detection_list
+
+    def __undistort_detections__(self, detection_list):
+        if len(detection_list) == 0:
+            return
+
+        # Undistort the corners and the center of every detection at once
+        points = np.array([np.vstack((d.corners, d.center)) for d in detection_list], dtype=np.float64).reshape((-1, 1, 2))
+        points = cv.undistortPoints(points, self.__camera_matrix, self.__dist, P=self.__new_camera_matrix).reshape((-1, 5, 2))
+
+        for detection, detection_points in zip(detection_list, points):
+            # New arrays are assigned so the tracker keeps the distorted corners
+            detection.corners = detection_points[:4]
+            detection.center = detection_points[4]
+
+            _, rvec, tvec = cv.solvePnP(self.__tag_points, detection.corners, self.__new_camera_matrix, None, flags=cv.SOLVEPNP_IPPE_SQUARE)
+
+            # Same format as the pose estimated by the detector
+            detection.pose_R, _ = cv.Rodrigues(rvec)
+            detection.pose_t = tvec
+
+            projected, _ = cv.projectPoints(self.__tag_points, rvec, tvec, self.__new_camera_matrix, None)
+            detection.pose_err = float(np.mean(np.sum((projected.reshape((-1, 2)) - detection.corners) ** 2, axis=1)))
+
+    def stop(self):
+        if self.__renderer is not None:
+            self.__renderer.stop()
+
+    def __call__(self, frame, undistort: bool = False, timestamp: float = -1.):
+        self.detect(frame, undistort, timestamp)
\ No newline at end of file
@@ -0,0 +1,172 @@
+from multiprocessing import shared_memory, resource_tracker
+from typing import Tuple
+
+import numpy as np
+
+
+# Header layout (int64): slots, height, width, channels (0 for single plane frames), latest slot, readers count,
+# then the slot pinned by every reader, one sequence per slot and one capture time (ns) per slot
+HEADER_SLOTS = 0
+HEADER_HEIGHT = 1
+HEADER_WIDTH = 2
+HEADER_CHANNELS = 3
+HEADER_LATEST = 4
+HEADER_READERS = 5
+HEADER_PINS = 6
+
+# Sequence value of a slot that is being written
+SEQ_WRITING = -1
+
+
+class FrameRing:
+    # Preallocated ring of frames backed by shared memory
+    # There is a single writer (the camera thread) and a fixed number of readers, each with its own index.
+    # The writer never touches the latest complete slot nor the slots pinned by the readers,
+    # so a frame returned by acquire() stays valid until the next call to acquire() with the same reader.
+    def __init__(self, shape: Tuple[int, ...], slots: int = 4, name: str = None, create: bool = True, readers: int = 2):
+        if slots < readers + 2:
+            raise ValueError('A frame ring needs at least 2 more slots than readers')
+
+        self.__slots = slots
+        self.__readers = readers
+        self.__seq_offset = HEADER_PINS + readers
+        self.__time_offset = self.__seq_offset + slots
+        self.__shape = tuple(shape)
+        self.__frame_size = int(np.prod(self.__shape))
+        self.__header_size = (self.__time_offset + slots) * 8
+
+        if create:
+            self.__shm = shared_memory.SharedMemory(name=name, create=True, size=self.__header_size + self.__frame_size * slots)
+        else:
+            self.__shm = shared_memory.SharedMemory(name=name, create=False)
+
+            # Only the creator of the ring is responsible of unlinking it
+            resource_tracker.unregister(self.__shm._name, 'shared_memory')
+
+        self.__owner = create
+
+        self.__header = np.ndarray((self.__time_offset + slots,), dtype=np.int64, buffer=self.__shm.buf)
+        self.__frames = [
+            np.ndarray(self.__shape, dtype=np.uint8, buffer=self.__shm.buf, offset=self.__header_size + i * self.__frame_size)
+            for i in range(slots)
+        ]
+
+        if create:
+            self.__header[HEADER_SLOTS] = slots
+            self.__header[HEADER_HEIGHT:HEADER_CHANNELS + 1] = self.__shape if len(self.__shape) == 3 else self.__shape + (0,)
+            self.__header[HEADER_LATEST] = -1
+            self.__header[HEADER_READERS] = readers
+            self.__header[HEADER_PINS:self.__seq_offset] = -1
+            self.__header[self.__seq_offset:self.__time_offset] = SEQ_WRITING
+            self.__header[self.__time_offset:] = 0
+
+        self.__write_slot = -1
+
+    @staticmethod
+    def attach(name: str) -> 'FrameRing':
+        # Read the header first to know the layout of the ring
+        shm = shared_memory.SharedMemory(name=name, create=False)
+
+        header = np.ndarray((HEADER_PINS,), dtype=np.int64, buffer=shm.buf)
+        slots = int(header[HEADER_SLOTS])
+        readers = int(header[HEADER_READERS])
+        shape = (int(header[HEADER_HEIGHT]), int(header[HEADER_WIDTH]), int(header[HEADER_CHANNELS]))
+        if shape[2] == 0:
+            shape = shape[:2]
+
+        del header
+        shm.close()
+
+        return FrameRing(shape, slots, name, create=False, readers=readers)
+
+    @property
+    def name(self) -> str:
+        return self.__shm.name
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.__shape
+
+    @property
+    def slots(self) -> int:
+        return self.__slots
+
+    @property
+    def readers(self) -> int:
+        return self.__readers
+
+    def begin_write(self) -> np.ndarray:
+        # Select a slot that is neither the latest complete frame nor pinned by a reader
+        latest = self.__header[HEADER_LATEST]
+        pins = self.__header[HEADER_PINS:self.__seq_offset].tolist()
+
+        slot = (self.__write_slot + 1) % self.__slots
+        while slot == latest or slot in pins:
+            slot = (slot + 1) % self.__slots
+
+        self.__write_slot = slot
+        self.__header[self.__seq_offset + slot] = SEQ_WRITING
+
+        return self.__frames[slot]
+
+    def end_write(self, seq: int, timestamp_ns: int = 0):
+        # Publish the sequence and capture time before making the slot the latest one
+        self.__header[self.__time_offset + self.__write_slot] = timestamp_ns
+        self.__header[self.__seq_offset + self.__write_slot] = seq
+        self.__header[HEADER_LATEST] = self.__write_slot
+
+    def latest_seq(self) -> int:
+        latest = self.__header[HEADER_LATEST]
+        if latest < 0:
+            return -1
+
+        return int(self.__header[self.__seq_offset + latest])
+
+    def acquire(self, reader: int = 0):
+        while True:
+            latest = self.__header[HEADER_LATEST]
+            if latest < 0:
+                return None, -1
+
+            # Pin the slot then make sure the writer did not move on in the meantime
+            self.__header[HEADER_PINS + reader] = latest
+            if self.__header[HEADER_LATEST] == latest:
+                return self.__frames[latest], int(self.__header[self.__seq_offset + latest])
+
+    @property
+    def write_slot(self) -> int:
+        # Slot returned by the last begin_write
+        return self.__write_slot
+
+    def pinned_slot(self, reader: int = 0) -> int:
+        # Slot of the frame currently pinned by the reader, -1 when it holds none
+        return int(self.__header[HEADER_PINS + reader])
+
+    def pinned_timestamp(self, reader: int = 0) -> float:
+        # Capture time in seconds of the frame currently pinned by the reader
+        slot = self.__header[HEADER_PINS + reader]
+        if slot < 0:
+            return -1.
+
+        return int(self.__header[self.__time_offset + slot]) / 1e9
+
+    def release(self, reader: int = 0):
+        self.__header[HEADER_PINS + reader] = -1
+
+    def reset(self):
+        self.__header[HEADER_LATEST] = -1
+        self.__header[self.__seq_offset:self.__time_offset] = SEQ_WRITING
+
+    def close(self):
+        self.__header = None
+        self.__frames = []
+
+        try:
+            self.__shm.close()
+        except BufferError:
+            # A frame is still referenced somewhere, the mapping will be released with it
+            pass
+
+        if self.__owner:
+            self.__shm.unlink()
+            self.__owner = False
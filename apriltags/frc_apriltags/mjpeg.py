@@ -0,0 +1,217 @@
+from concurrent.futures import ThreadPoolExecutor, Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Condition, get_native_id
+from urllib.parse import urlparse, parse_qs
+
+import os
+import time
+import cv2 as cv
+
+from .renderer import RENDER_NICENESS
+
+
+# Bounds of the quality and frame rate a client can ask for
+MIN_QUALITY = 10
+MAX_QUALITY = 95
+MIN_FPS = 1.
+
+BOUNDARY = 'frame'
+
+
+def __lower_priority__():
+    # The encoders always yield to the capture and detection threads
+    try:
+        os.setpriority(os.PRIO_PROCESS, get_native_id(), RENDER_NICENESS)
+    except (AttributeError, OSError):
+        pass
+
+
+class MjpegStream:
+    # Latest frame of a stream, encoded at most once per quality no matter how many clients watch it
+    def __init__(self, name: str, fps: float, resolution, quality: int, encoder: ThreadPoolExecutor):
+        self.__name = name
+        self.__fps = fps
+        self.__resolution = resolution
+        self.__quality = quality
+        self.__encoder = encoder
+
+        self.__condition = Condition()
+        self.__frame = None
+        self.__sequence = 0
+        self.__clients = 0
+
+        # Encoded frame (or the encoding in progress) of the current sequence for every quality
+        self.__encoded = {}
+
+    @property
+    def name(self) -> str:
+        return self.__name
+
+    @property
+    def fps(self) -> float:
+        return self.__fps
+
+    @property
+    def resolution(self):
+        return self.__resolution
+
+    @property
+    def quality(self) -> int:
+        return self.__quality
+
+    def has_demand(self) -> bool:
+        return self.__clients > 0
+
+    def set_frame(self, frame):
+        # The frame is kept as is, the caller must not draw on it afterward
+        with self.__condition:
+            self.__frame = frame
+            self.__sequence += 1
+            self.__encoded = {}
+            self.__condition.notify_all()
+
+    def add_client(self):
+        with self.__condition:
+            self.__clients += 1
+
+    def remove_client(self):
+        with self.__condition:
+            self.__clients -= 1
+
+    def wait_for_frame(self, last_sequence: int, timeout: float = None) -> int:
+        # Sequence of the latest frame once it is newer than last_sequence, slow clients skip the frames in between
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__sequence > last_sequence, timeout)
+            return self.__sequence
+
+    def get_jpeg(self, quality: int):
+        with self.__condition:
+            if self.__frame is None:
+                return self.__sequence, None
+
+            sequence = self.__sequence
+            encoded = self.__encoded.get(quality)
+            if encoded is None:
+                encoded = self.__encoder.submit(self.__encode__, self.__frame, quality)
+                self.__encoded[quality] = encoded
+
+        # Every client of the same quality waits on the same encoding
+        if isinstance(encoded, Future):
+            encoded = encoded.result()
+
+        return sequence, encoded
+
+    @staticmethod
+    def __encode__(frame, quality: int):
+        ret, jpeg = cv.imencode('.jpg', frame, [cv.IMWRITE_JPEG_QUALITY, quality])
+        return jpeg.tobytes() if ret else None
+
+
+class MjpegStreamer:
+    # HTTP server of the MJPEG streams, every stream is at /<name>
+    # A client can lower its frame rate and quality with /<name>?fps=15&quality=50
+    def __init__(self, port: int = 5800, host: str = '0.0.0.0', encoder_threads: int = 2):
+        self.__host = host
+        self.__port = port
+
+        self.__encoder = ThreadPoolExecutor(max_workers=encoder_threads, thread_name_prefix='mjpeg_encoder', initializer=__lower_priority__)
+        self.__streams = {}
+
+        self.__server: ThreadingHTTPServer = None
+        self.__thread: Thread = None
+
+    def create_stream(self, name: str, fps: float, resolution, quality: int = 80) -> MjpegStream:
+        stream = MjpegStream(name, fps, resolution, quality, self.__encoder)
+        self.__streams[name] = stream
+
+        return stream
+
+    def get_stream(self, name: str) -> MjpegStream:
+        return self.__streams.get(name)
+
+    def get_stream_names(self):
+        return list(self.__streams)
+
+    def start(self):
+        if self.__server is None:
+            self.__server = ThreadingHTTPServer((self.__host, self.__port), self.__create_handler__())
+            self.__server.daemon_threads = True
+
+            self.__thread = Thread(target=self.__server.serve_forever, daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__thread.join()
+
+            self.__server = None
+            self.__thread = None
+
+        self.__encoder.shutdown(wait=False)
+
+    def __create_handler__(self):
+        streamer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                stream = streamer.get_stream(url.path.strip('/'))
+                if stream is None:
+                    self.__send_index__()
+                    return
+
+                query = parse_qs(url.query)
+                try:
+                    fps = min(stream.fps, max(MIN_FPS, float(query.get('fps', [stream.fps])[0])))
+                    quality = min(MAX_QUALITY, max(MIN_QUALITY, int(query.get('quality', [stream.quality])[0])))
+                except ValueError:
+                    self.send_error(400)
+                    return
+
+                self.__send_stream__(stream, fps, quality)
+
+            def __send_index__(self):
+                body = ''.join(f'<a href="/{name}">{name}</a><br>' for name in streamer.get_stream_names()).encode()
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def __send_stream__(self, stream: MjpegStream, fps: float, quality: int):
+                self.send_response(200)
+                self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={BOUNDARY}')
+                self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+
+                period = 1. / fps
+                last_sequence = 0
+
+                stream.add_client()
+                try:
+                    while True:
+                        start_time = time.monotonic()
+
+                        last_sequence = stream.wait_for_frame(last_sequence, timeout=1.)
+                        last_sequence, jpeg = stream.get_jpeg(quality)
+                        if jpeg is not None:
+                            self.wfile.write(f'--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\n\r\n'.encode())
+                            self.wfile.write(jpeg)
+                            self.wfile.write(b'\r\n')
+
+                        # Never go faster than what the client asked for
+                        remaining = period - (time.monotonic() - start_time)
+                        if remaining > 0:
+                            time.sleep(remaining)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    stream.remove_client()
+
+        return Handler
@@ -0,0 +1,97 @@
+from typing import NamedTuple
+
+import struct
+import numpy as np
+import ntcore
+
+from .timesync import ServerClock
+
+
+# Layout of a detection packet, every field is little endian:
+#   header: magic, camera sequence (u32), tag count (u16), cam id (u8), padded to 16 bytes
+#   then one array per field, widest first so every array stays aligned:
+#   timestamp (f64, robot FPGA time), corners (f32 x 8), pose_t (f32 x 3), pose_R (f32 x 9), tag id (u16)
+# This layout must match robot/robot2025/vision_packet.py
+PACKET_MAGIC = b'ATP2'
+PACKET_HEADER = struct.Struct('<4sIHB5x')
+# dtype and shape of every field array, in the order they follow the header
+PACKET_FIELDS = (
+    ('<f8', ()),
+    ('<f4', (4, 2)),
+    ('<f4', (3,)),
+    ('<f4', (3, 3)),
+    ('<u2', ()),
+)
+PACKET_TOPIC = '/vision/cam{}/detections'
+
+
+class PacketDetection(NamedTuple):
+    # Decoded detection, it has the fields of a pupil_apriltags detection used by the publishers and the renderer
+    tag_id: int
+    corners: np.ndarray
+    center: np.ndarray
+    pose_R: np.ndarray
+    pose_t: np.ndarray
+    timestamp: float
+
+
+def encode_detections(cam_id: int, sequence: int, detection_list, time_offset: float = None) -> bytes:
+    # detection_list only holds the detections of the camera
+    # The timestamps are left invalid (-1) without an offset to the robot time
+    count = len(detection_list)
+
+    # The poses stay NaN for the detections without one
+    arrays = [np.full((count,) + shape, np.nan if dtype[1] == 'f' else 0, dtype=dtype) for dtype, shape in PACKET_FIELDS]
+    timestamps, corners, pose_t, pose_R, tag_ids = arrays
+
+    for i, detection in enumerate(detection_list):
+        timestamp = getattr(detection, 'timestamp', -1.)
+        timestamps[i] = timestamp + time_offset if time_offset is not None and timestamp >= 0 else -1.
+
+        corners[i] = detection.corners
+        if detection.pose_t is not None:
+            pose_t[i] = detection.pose_t.reshape(3)
+            pose_R[i] = detection.pose_R
+
+        tag_ids[i] = detection.tag_id
+
+    header = PACKET_HEADER.pack(PACKET_MAGIC, sequence & 0xFFFFFFFF, count, cam_id)
+    return b''.join([header] + [array.tobytes() for array in arrays])
+
+
+def decode_detections(packet: bytes):
+    # Returns (cam_id, sequence, detection_list), the opposite of encode_detections
+    magic, sequence, count, cam_id = PACKET_HEADER.unpack_from(packet)
+    if magic != PACKET_MAGIC:
+        raise ValueError('Not a detection packet')
+
+    offset = PACKET_HEADER.size
+    arrays = []
+    for dtype, shape in PACKET_FIELDS:
+        size = int(np.prod(shape, dtype=np.int64))
+        array = np.frombuffer(packet, dtype=dtype, count=count * size, offset=offset).reshape((count,) + shape)
+        offset += array.nbytes
+        arrays.append(array.astype(np.float64) if dtype != '<u2' else array)
+
+    timestamps, corners, pose_t, pose_R, tag_ids = arrays
+
+    # Same pose_t shape as a pupil_apriltags detection
+    pose_t = pose_t.reshape(count, 3, 1)
+
+    detection_list = [PacketDetection(int(tag_ids[i]), corners[i], corners[i].mean(axis=0), pose_R[i], pose_t[i], float(timestamps[i])) for i in range(count)]
+    return cam_id, sequence, detection_list
+
+
+class DetectionPacketPublisher:
+    # Publishes the detections of a camera as a single raw value as soon as they are ready, so the robot always reads a whole frame
+    def __init__(self, nt: ntcore.NetworkTableInstance, cam_ids):
+        self.__nt = nt
+        self.__clock = ServerClock(nt)
+        self.__publishers = {cam_id: nt.getRawTopic(PACKET_TOPIC.format(cam_id)).publish('apriltags') for cam_id in cam_ids}
+
+    def publish(self, cam_id: int, sequence: int, detection_list):
+        # Timestamps are sent in robot time once the clock is synchronized
+        self.__publishers[cam_id].set(encode_detections(cam_id, sequence, detection_list, self.__clock.get_offset()))
+
+        # Send it now instead of waiting for the next periodic update
+        self.__nt.flush()
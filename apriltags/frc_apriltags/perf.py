@@ -0,0 +1,138 @@
+import time
+import numpy as np
+import ntcore
+
+
+class StageTimer:
+    # Lap timer of the stages of a frame, every lap is the time spent since the previous one
+    # It only costs a clock read per stage so it is always on
+    def __init__(self):
+        self.__last = 0
+        self.__laps = {}
+
+    def start(self):
+        self.__laps = {}
+        self.__last = time.perf_counter_ns()
+
+    def lap(self, stage: str):
+        now = time.perf_counter_ns()
+
+        # A stage can run multiple times in a frame, like the detection of every region
+        self.__laps[stage] = self.__laps.get(stage, 0) + now - self.__last
+        self.__last = now
+
+    def get_laps(self) -> dict:
+        # Time spent in every stage of the last frame, in seconds
+        return {stage: elapsed / 1e9 for stage, elapsed in self.__laps.items()}
+
+
+# Upper bound of every histogram bucket, in milliseconds, the last one takes everything above
+HISTOGRAM_EDGES_MS = (1., 2., 4., 8., 16., 32., 64., 128.)
+
+
+class RollingStats:
+    # The last samples of a measure in a fixed ring, only summarized when someone asks for it
+    def __init__(self, capacity: int = 256):
+        self.__samples = np.zeros(capacity, dtype=np.float64)
+        self.__index = 0
+        self.__count = 0
+
+    def add(self, value: float):
+        self.__samples[self.__index] = value
+        self.__index = (self.__index + 1) % len(self.__samples)
+        self.__count = min(self.__count + 1, len(self.__samples))
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def summary(self) -> dict:
+        # Summary of the samples in milliseconds, the samples are in seconds
+        samples = self.__samples[:self.__count] * 1000
+        if len(samples) == 0:
+            return {}
+
+        p50, p99 = np.percentile(samples, (50, 99))
+        return {
+            'mean_ms': float(samples.mean()),
+            'p50_ms': float(p50),
+            'p99_ms': float(p99),
+            'max_ms': float(samples.max()),
+            'histogram': np.bincount(np.searchsorted(HISTOGRAM_EDGES_MS, samples), minlength=len(HISTOGRAM_EDGES_MS) + 1).tolist(),
+        }
+
+
+class PerfMonitor:
+    # Rolling stats of the stages of a camera, reported at a low rate so publishing them costs nothing
+    def __init__(self, period: float = 1., capacity: int = 256):
+        self.__period = period
+        self.__capacity = capacity
+
+        self.__stages = {}
+        self.__last_report = time.monotonic()
+        self.__last_index = -1
+        self.__processed = 0
+        self.__dropped = 0
+
+    def record(self, laps: dict):
+        for stage, elapsed in laps.items():
+            stats = self.__stages.get(stage)
+            if stats is None:
+                stats = self.__stages[stage] = RollingStats(self.__capacity)
+
+            stats.add(elapsed)
+
+    def record_frame(self, frame_index: int):
+        # A gap in the frame indices means the camera gave frames that were never processed
+        if 0 <= self.__last_index < frame_index:
+            self.__dropped += frame_index - self.__last_index - 1
+
+        self.__last_index = frame_index
+        self.__processed += 1
+
+    def report(self, capture_intervals: RollingStats = None):
+        # The report of the last period, None until the period is elapsed
+        now = time.monotonic()
+        elapsed = now - self.__last_report
+        if elapsed < self.__period:
+            return None
+
+        report = {
+            'fps': self.__processed / elapsed,
+            'dropped': self.__dropped,
+            'stages': {stage: stats.summary() for stage, stats in self.__stages.items()},
+        }
+        if capture_intervals is not None and len(capture_intervals) > 0:
+            report['capture_interval'] = capture_intervals.summary()
+
+        self.__last_report = now
+        self.__processed = 0
+        self.__dropped = 0
+
+        return report
+
+
+class PerfPublisher:
+    # Publishes the reports of every camera under /vision/cam<n>/perf
+    def __init__(self, nt: ntcore.NetworkTableInstance, cam_ids):
+        self.__tables = {cam_id: nt.getTable(f'/vision/cam{cam_id}/perf') for cam_id in cam_ids}
+
+        for table in self.__tables.values():
+            table.putNumberArray('histogram_edges_ms', HISTOGRAM_EDGES_MS)
+
+    def publish(self, cam_id: int, report: dict):
+        table = self.__tables[cam_id]
+
+        table.putNumber('fps', report['fps'])
+        table.putNumber('dropped', report['dropped'])
+
+        summaries = dict(report['stages'])
+        if 'capture_interval' in report:
+            summaries['capture_interval'] = report['capture_interval']
+
+        for name, summary in summaries.items():
+            subtable = table.getSubTable(name)
+            for key, value in summary.items():
+                if key == 'histogram':
+                    subtable.putNumberArray(key, value)
+                else:
+                    subtable.putNumber(key, value)
@@ -0,0 +1,129 @@
+from multiprocessing import Process, Queue, Event
+from typing import NamedTuple, Tuple, Optional
+
+from .mjpeg import MjpegStreamer
+from .usbcamera import USBCamera, STREAM_READER
+from .detector import AprilTagDetector
+from .perf import PerfMonitor
+from .recording import RecordingSettings, create_recorder
+
+
+class CameraSettings(NamedTuple):
+    cam_id: int
+    device_id: int
+    name: str
+    resolution: Tuple[int, int]
+    processing_resolution: Tuple[int, int]
+    stream_resolution: Tuple[int, int]
+    stream_fps: int
+    fps: int
+    flip: Optional[int]
+    calibration_file: str
+    stream_port: int
+    stream_quality: int = 80
+    stream_encoder_threads: int = 2
+    fourcc: Optional[str] = None
+    init_timeout: float = 5.
+
+
+def __camera_worker__(settings: CameraSettings, undistort: bool, detector_kwargs: dict, results: Queue, stop_event: Event, recording: Optional[RecordingSettings]):
+    camera = USBCamera(settings.device_id, settings.resolution, settings.fps, settings.flip, fourcc=settings.fourcc)
+    camera.start()
+    if not camera.wait_for_init(settings.init_timeout):
+        print(f'Camera {settings.cam_id} is not connected, starting without it')
+
+    # Each worker owns its own streamer since the frames never leave the process
+    streamer = MjpegStreamer(port=settings.stream_port, encoder_threads=settings.stream_encoder_threads)
+
+    stream_raw = streamer.create_stream(f'{settings.name}/raw', settings.stream_fps, settings.stream_resolution, settings.stream_quality)
+    stream_detection = streamer.create_stream(f'{settings.name}/detection', settings.stream_fps, settings.stream_resolution, settings.stream_quality)
+
+    streamer.start()
+
+    detector = AprilTagDetector(stream_raw,
+                                stream_detection,
+                                settings.processing_resolution,
+                                settings.stream_resolution,
+                                settings.calibration_file,
+                                stream_fps=settings.stream_fps,
+                                frame_source=lambda: camera.get_color_frame(STREAM_READER),
+                                **detector_kwargs)
+
+    # The frames never leave the worker so it records them itself
+    recorder = create_recorder(recording, settings.cam_id) if recording is not None else None
+    if recorder is not None:
+        recorder.start()
+
+    # Stage timings are summarized here and only sent to the main process once in a while
+    perf = PerfMonitor()
+
+    last_index = -1
+    while not stop_event.is_set():
+        if not camera.is_running():
+            break
+
+        # Block until the camera gives a new frame, the timeout only keeps the stop event responsive
+        if not camera.wait_for_frame(last_index, timeout=0.1):
+            continue
+
+        frame, frame_index = camera.get_frame()
+        if frame_index <= last_index:
+            continue
+
+        last_index = frame_index
+        frame_time = camera.get_frame_timestamp()
+
+        # Detections are plain python objects so they can be pickled back to the main process
+        detection = detector.detect(frame, undistort, frame_time)
+
+        perf.record(detector.get_stage_times())
+        perf.record_frame(frame_index)
+
+        if recorder is not None:
+            recorder.record(settings.cam_id, frame_index, frame_time, frame, detection)
+
+        results.put((settings.cam_id, frame_index, frame_time, detection, perf.report(camera.get_capture_intervals())))
+
+    if recorder is not None:
+        recorder.stop()
+
+    detector.stop()
+    camera.stop()
+
+
+class CameraPipeline:
+    def __init__(self, settings: CameraSettings, results: Queue, undistort: bool = False, recording: RecordingSettings = None, **detector_kwargs):
+        self.__settings = settings
+        self.__results = results
+        self.__undistort = undistort
+        self.__recording = recording
+        self.__detector_kwargs = detector_kwargs
+
+        self.__stop_event = Event()
+        self.__process: Process = None
+
+    @property
+    def settings(self) -> CameraSettings:
+        return self.__settings
+
+    def start(self):
+        if self.__process is None:
+            self.__stop_event.clear()
+            self.__process = Process(target=__camera_worker__,
+                                     args=(self.__settings, self.__undistort, self.__detector_kwargs, self.__results, self.__stop_event, self.__recording),
+                                     name=f'frc_apriltags_{self.__settings.name}',
+                                     daemon=True)
+            self.__process.start()
+
+    def stop(self, timeout: float = 2.):
+        if self.__process is not None:
+            self.__stop_event.set()
+            self.__process.join(timeout)
+
+            if self.__process.is_alive():
+                self.__process.terminate()
+
+            self.__process = None
+
+    def is_running(self) -> bool:
+        return self.__process is not None and self.__process.is_alive()
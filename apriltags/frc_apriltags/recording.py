@@ -0,0 +1,262 @@
+from queue import Queue, Full
+from threading import Thread
+from typing import NamedTuple, Optional, Tuple
+
+import heapq
+import mmap
+import os
+import struct
+import time
+import numpy as np
+import cv2 as cv
+
+from .packet import encode_detections, decode_detections
+
+
+# Layout of a recording, every field is little endian:
+#   header: magic, version (u32)
+#   then records one after the other: kind (u8), cam id (u8), frame index (u32), timestamp (f64, time.monotonic), payload size (u32), payload
+# The file grows by whole chunks so the unused tail is zeros, which reads as the end of the recording even after a crash
+RECORDING_MAGIC = b'ATRC'
+RECORDING_VERSION = 1
+RECORDING_HEADER = struct.Struct('<4sI')
+RECORD_HEADER = struct.Struct('<BB2xIdI')
+RECORDING_EXTENSION = '.atrec'
+
+# Record kinds, 0 marks the end of the recording
+RECORD_END = 0
+RECORD_FRAME = 1
+RECORD_DETECTIONS = 2
+
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# The written records are flushed to the disk at least this often, in seconds, so a power cut only loses the last ones
+FLUSH_INTERVAL = 1.
+
+
+class RecordingSettings(NamedTuple):
+    directory: str
+    # Frames are shrunk to this resolution before being compressed, full resolution when None
+    thumbnail_resolution: Optional[Tuple[int, int]] = None
+    # Only one frame out of this many is recorded, the detections are always recorded
+    frame_interval: int = 1
+    jpeg_quality: int = 80
+    queue_size: int = 32
+
+
+class Recorded(NamedTuple):
+    kind: int
+    cam_id: int
+    frame_index: int
+    timestamp: float
+    # Decoded image for a frame, the detection list for the detections
+    data: object
+
+
+class MappedLog:
+    # Append-only file mapped in memory, grown by whole chunks
+    def __init__(self, path: str, flush_interval: float = FLUSH_INTERVAL):
+        self.__file = open(path, 'w+b')
+        self.__size = 0
+        self.__offset = 0
+        self.__map: mmap.mmap = None
+
+        self.__flush_interval = flush_interval
+        self.__flushed = 0
+        self.__last_flush = time.monotonic()
+
+        self.append(RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION))
+
+    def __grow__(self, needed: int):
+        if self.__map is not None:
+            self.flush()
+            self.__map.close()
+
+        self.__size += max(CHUNK_SIZE, needed)
+        self.__file.truncate(self.__size)
+        self.__map = mmap.mmap(self.__file.fileno(), self.__size)
+
+    def append(self, *parts):
+        length = sum(len(part) for part in parts)
+        if self.__offset + length > self.__size:
+            self.__grow__(self.__offset + length - self.__size)
+
+        for part in parts:
+            self.__map[self.__offset:self.__offset + len(part)] = part
+            self.__offset += len(part)
+
+        if time.monotonic() - self.__last_flush >= self.__flush_interval:
+            self.flush()
+
+    def flush(self):
+        # Only the pages written since the last flush, the start of a flush must be on a page boundary
+        start = self.__flushed - self.__flushed % mmap.PAGESIZE
+        if self.__map is not None and self.__offset > start:
+            self.__map.flush(start, self.__offset - start)
+
+        self.__flushed = self.__offset
+        self.__last_flush = time.monotonic()
+
+    def close(self):
+        if self.__map is not None:
+            self.flush()
+            self.__map.close()
+            self.__map = None
+
+        # Drop the unused part of the last chunk
+        self.__file.truncate(self.__offset)
+        self.__file.close()
+
+
+class Recorder:
+    # Writes the frames and detections of a camera to a recording on a background thread
+    # The queue is bounded and never waited on, so the recording drops data rather than slowing down the detection
+    def __init__(self, path: str, settings: RecordingSettings):
+        self.__path = path
+        self.__settings = settings
+
+        self.__queue = Queue(settings.queue_size)
+        self.__thread: Thread = None
+        self.__dropped = 0
+
+    @property
+    def path(self) -> str:
+        return self.__path
+
+    @property
+    def dropped(self) -> int:
+        return self.__dropped
+
+    def start(self):
+        if self.__thread is None:
+            self.__thread = Thread(target=self.__thread__, daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        if self.__thread is not None:
+            # Let the thread write everything that is queued
+            self.__queue.put(None)
+            self.__thread.join()
+            self.__thread = None
+
+    def record(self, cam_id: int, frame_index: int, timestamp: float, frame, detection_list):
+        if self.__thread is None:
+            return
+
+        # A full queue costs only the drop, nothing is copied for a frame that cannot be queued
+        # The detection thread is the only one adding to the queue, so it cannot fill up before the put
+        if self.__queue.full():
+            self.__dropped += 1
+            return
+
+        # The camera frame is reused for the next captures, only a copy or a thumbnail can be queued
+        image = None
+        if frame is not None and frame_index % self.__settings.frame_interval == 0:
+            # YUYV frames are recorded as their Y plane
+            if frame.ndim == 3 and frame.shape[2] == 2:
+                frame = frame[..., 0]
+
+            if self.__settings.thumbnail_resolution is not None:
+                image = cv.resize(frame, self.__settings.thumbnail_resolution, interpolation=cv.INTER_AREA)
+            else:
+                image = frame.copy()
+
+        try:
+            self.__queue.put_nowait((cam_id, frame_index, timestamp, image, detection_list))
+        except Full:
+            self.__dropped += 1
+
+    def __thread__(self):
+        log = MappedLog(self.__path)
+        encode_params = [cv.IMWRITE_JPEG_QUALITY, self.__settings.jpeg_quality]
+
+        try:
+            while True:
+                item = self.__queue.get()
+                if item is None:
+                    break
+
+                cam_id, frame_index, timestamp, image, detection_list = item
+
+                if image is not None:
+                    ret, jpeg = cv.imencode('.jpg', image, encode_params)
+                    if ret:
+                        log.append(RECORD_HEADER.pack(RECORD_FRAME, cam_id, frame_index, timestamp, len(jpeg)), jpeg.tobytes())
+
+                # The detections keep their time.monotonic timestamps
+                packet = encode_detections(cam_id, frame_index, detection_list, 0.)
+                log.append(RECORD_HEADER.pack(RECORD_DETECTIONS, cam_id, frame_index, timestamp, len(packet)), packet)
+        finally:
+            log.close()
+
+
+def create_recorder(settings: RecordingSettings, cam_id: int) -> Recorder:
+    os.makedirs(settings.directory, exist_ok=True)
+
+    name = time.strftime('%Y%m%d_%H%M%S') + f'_cam{cam_id}' + RECORDING_EXTENSION
+    return Recorder(os.path.join(settings.directory, name), settings)
+
+
+def read_recording(path: str, kinds=(RECORD_FRAME, RECORD_DETECTIONS), cam_id: int = None):
+    # Yields the records of a recording in the order they were written
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < RECORDING_HEADER.size:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, version = RECORDING_HEADER.unpack_from(data)
+            if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+                raise ValueError(f'{path} is not a recording')
+
+            offset = RECORDING_HEADER.size
+            while offset + RECORD_HEADER.size <= size:
+                kind, record_cam_id, frame_index, timestamp, length = RECORD_HEADER.unpack_from(data, offset)
+                offset += RECORD_HEADER.size
+
+                # A record cut by a crash is the end of the recording
+                if kind == RECORD_END or offset + length > size:
+                    break
+
+                payload = data[offset:offset + length]
+                offset += length
+
+                if kind not in kinds or (cam_id is not None and record_cam_id != cam_id):
+                    continue
+
+                if kind == RECORD_FRAME:
+                    record_data = cv.imdecode(np.frombuffer(payload, dtype=np.uint8), cv.IMREAD_COLOR)
+                else:
+                    _, _, record_data = decode_detections(payload)
+
+                yield Recorded(kind, record_cam_id, frame_index, timestamp, record_data)
+
+
+def recorded_frames(path: str, cam_id: int = None):
+    # Only the images of a recording, to feed them back through a camera and AprilTagDetector
+    for record in read_recording(path, (RECORD_FRAME,), cam_id):
+        yield record.data
+
+
+def replay_detections(paths, publish, realtime: bool = True, cam_id: int = None):
+    # Feeds the recorded detections to publish(cam_id, frame_index, detection_list), like the live detections
+    # The recordings of every camera are merged by timestamp so they are published interleaved, like during the session
+    # The capture times are moved to now so the receiver sees fresh detections
+    if isinstance(paths, str):
+        paths = [paths]
+
+    records = heapq.merge(*(read_recording(path, (RECORD_DETECTIONS,), cam_id) for path in paths), key=lambda record: record.timestamp)
+
+    offset = None
+    for record in records:
+        if offset is None:
+            offset = time.monotonic() - record.timestamp
+
+        frame_time = record.timestamp + offset
+        if realtime:
+            remaining = frame_time - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+
+        detection_list = [d._replace(timestamp=frame_time) for d in record.data]
+        publish(record.cam_id, record.frame_index, detection_list)
@@ -0,0 +1,175 @@
+from threading import Thread, get_native_id
+from typing import NamedTuple
+
+import os
+import time
+import numpy as np
+import cv2 as cv
+
+
+# Niceness of the render thread, so it always yields to the capture and detection threads
+RENDER_NICENESS = 10
+
+
+class DetectionRecord(NamedTuple):
+    tag_id: int
+    corners: np.ndarray
+    center: np.ndarray
+    pose_R: np.ndarray
+    pose_t: np.ndarray
+
+
+# 3D frustum points of a tag per tag size, the bottom corners followed by the top corners
+__FRUSTUM_POINTS__ = {}
+
+
+def __get_frustum_points__(tag_size: float) -> np.ndarray:
+    points = __FRUSTUM_POINTS__.get(tag_size)
+    if points is None:
+        half = tag_size / 2
+        points = np.array([
+            [-half, half, 0],
+            [half, half, 0],
+            [half, -half, 0],
+            [-half, -half, 0],
+            [-half, half, -tag_size],
+            [half, half, -tag_size],
+            [half, -half, -tag_size],
+            [-half, -half, -tag_size]
+        ], dtype=np.float64)
+        __FRUSTUM_POINTS__[tag_size] = points
+
+    return points
+
+
+def draw_frustums(img, records, camera_matrix, tag_size, outline_color, dist_coeffs=None):
+    # records are detections or DetectionRecord, only their pose is used
+    if len(records) == 0:
+        return img
+
+    # Move the frustum points of every tag in the camera frame at once
+    rotations = np.array([r.pose_R for r in records], dtype=np.float64)
+    translations = np.array([r.pose_t for r in records], dtype=np.float64).reshape((-1, 1, 3))
+    points = __get_frustum_points__(tag_size) @ rotations.transpose((0, 2, 1)) + translations
+
+    # Skip the tags that are partly behind the camera
+    points = points[(points[..., 2] > 0).all(axis=1)]
+    if len(points) == 0:
+        return img
+
+    if dist_coeffs is None:
+        projected = points @ np.asarray(camera_matrix, dtype=np.float64).T
+        image_points = projected[..., :2] / projected[..., 2:]
+    else:
+        image_points, _ = cv.projectPoints(points.reshape((-1, 3)), np.zeros(3), np.zeros(3), np.asarray(camera_matrix, dtype=np.float64), dist_coeffs)
+        image_points = image_points.reshape((-1, 8, 2))
+
+    image_points = np.round(image_points).astype(np.int32)
+
+    # Outline of the top of every tag and the pillars from the bottom to the top corners
+    tops = np.ascontiguousarray(image_points[:, 4:])
+    pillars = np.stack((image_points[:, :4], image_points[:, 4:]), axis=2).reshape((-1, 2, 2))
+
+    return cv.polylines(img, list(tops) + list(pillars), isClosed=True, color=outline_color, thickness=2)
+
+
+class StreamRenderer:
+    # Produces the raw and detection streams on its own thread, only while someone is watching them
+    def __init__(self, raw_stream, detection_stream, stream_resolution, fps: int, preprocess, camera_matrix, tag_size: float, frame_source=None):
+        self.__raw_stream = raw_stream
+        self.__detection_stream = detection_stream
+        self.__stream_resolution = stream_resolution
+        self.__period = 1. / fps
+        self.__preprocess = preprocess
+        self.__camera_matrix = camera_matrix
+        self.__tag_size = tag_size
+        self.__frame_source = frame_source
+
+        # Swapped as a whole so the render thread never sees a partial update
+        self.__latest = ((), None, False, None)
+        self.__rendered = None
+
+        self.__thread: Thread = None
+        self.__should_run = False
+
+    def start(self):
+        if self.__thread is None:
+            self.__should_run = True
+            self.__thread = Thread(target=self.__thread__, daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        if self.__thread is not None:
+            self.__should_run = False
+            self.__thread.join()
+            self.__thread = None
+
+    def is_running(self) -> bool:
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def has_demand(self) -> bool:
+        return (self.__raw_stream is not None and self.__raw_stream.has_demand()) or \
+               (self.__detection_stream is not None and self.__detection_stream.has_demand())
+
+    def submit(self, detection_list, frame=None, undistort: bool = False, dist_coeffs=None):
+        # The detections are always drawn on the frame they were found in, the frame source only feeds the raw stream
+        # With a frame source the camera reuses the detected frame, so it is copied, only while the detection stream is watched
+        # Without one the detected frame is rendered as is, it may be overwritten while being drawn
+        records = tuple(DetectionRecord(d.tag_id, d.corners, d.center, d.pose_R, d.pose_t) for d in detection_list)
+        if frame is not None and self.__frame_source is not None:
+            frame = frame.copy() if self.__detection_stream is not None and self.__detection_stream.has_demand() else None
+
+        self.__latest = (records, frame, undistort, dist_coeffs)
+
+    def __prepare__(self, frame, undistort: bool):
+        # Native camera frames are only turned into color for drawing, before the remap mixes the YUYV pixel pairs
+        if frame.ndim == 2:
+            frame = cv.cvtColor(frame, cv.COLOR_GRAY2BGR)
+        elif frame.shape[2] == 2:
+            frame = cv.cvtColor(frame, cv.COLOR_YUV2BGR_YUYV)
+
+        # The preprocessing gives a new frame that can be drawn on
+        return self.__preprocess(frame, undistort)
+
+    def __render__(self):
+        latest = self.__latest
+        records, detected_frame, undistort, dist_coeffs = latest
+
+        frame = None
+        if self.__raw_stream is not None and self.__raw_stream.has_demand():
+            raw_frame = detected_frame if self.__frame_source is None else self.__frame_source()[0]
+            if raw_frame is not None:
+                frame = self.__prepare__(raw_frame, undistort)
+                self.__raw_stream.set_frame(cv.resize(frame, self.__stream_resolution))
+
+        # A frame with its detections is only drawn once
+        if self.__detection_stream is not None and self.__detection_stream.has_demand() and detected_frame is not None and latest is not self.__rendered:
+            if frame is None or self.__frame_source is not None:
+                frame = self.__prepare__(detected_frame, undistort)
+
+            draw_frustums(frame, records, self.__camera_matrix, self.__tag_size, (0, 255, 0), dist_coeffs)
+            self.__detection_stream.set_frame(cv.resize(frame, self.__stream_resolution))
+            self.__rendered = latest
+
+    def __thread__(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, get_native_id(), RENDER_NICENESS)
+        except (AttributeError, OSError):
+            pass
+
+        while self.__should_run:
+            if not self.has_demand():
+                time.sleep(0.1)
+                continue
+
+            start_time = time.monotonic()
+
+            try:
+                self.__render__()
+            except Exception as e:
+                print(e)
+
+            # Limit the rendering to the stream frame rate
+            remaining = self.__period - (time.monotonic() - start_time)
+            if remaining > 0:
+                time.sleep(remaining)
@@ -0,0 +1,24 @@
+import time
+import ntcore
+
+
+class ServerClock:
+    # Converts time.monotonic timestamps to the NetworkTables server time, which is the robot FPGA time
+    def __init__(self, nt: ntcore.NetworkTableInstance):
+        self.__nt = nt
+
+    def get_offset(self):
+        # Seconds to add to a time.monotonic timestamp to get the server time, None until the clock is synchronized
+        offset = self.__nt.getServerTimeOffset()
+        if offset is None:
+            return None
+
+        # Both clocks are sampled back to back so their bases do not need to match
+        return (ntcore._now() + offset) / 1e6 - time.monotonic()
+
+    def to_server_time(self, timestamp: float) -> float:
+        offset = self.get_offset()
+        if offset is None or timestamp < 0:
+            return -1.
+
+        return timestamp + offset
@@ -0,0 +1,107 @@
+from typing import List, Tuple
+
+import numpy as np
+
+
+class TagTrack:
+    def __init__(self, tag_id: int, corners: np.ndarray):
+        self.tag_id = tag_id
+        self.corners = corners
+        self.velocity = np.zeros_like(corners)
+
+    def update(self, corners: np.ndarray):
+        self.velocity = corners - self.corners
+        self.corners = corners
+
+    def predict(self) -> np.ndarray:
+        return self.corners + self.velocity
+
+
+class TagTracker:
+    # Predicts where the tags from the previous frame will be so only those regions need to be scanned
+    def __init__(self, resolution: Tuple[int, int], full_scan_interval: int = 10, padding: float = 0.5, min_padding: int = 16):
+        self.__width, self.__height = resolution
+        self.__full_scan_interval = full_scan_interval
+        self.__padding = padding
+        self.__min_padding = min_padding
+
+        self.__tracks = {}
+        self.__frames_since_full_scan = 0
+        self.__lost = True
+
+    def reset(self):
+        self.__tracks = {}
+        self.__lost = True
+
+    def is_lost(self) -> bool:
+        return self.__lost
+
+    def should_full_scan(self) -> bool:
+        return self.__lost or len(self.__tracks) == 0 or self.__frames_since_full_scan >= self.__full_scan_interval
+
+    def predict_rois(self) -> List[Tuple[int, int, int, int]]:
+        rois = []
+        for track in self.__tracks.values():
+            corners = track.predict()
+
+            x0, y0 = corners.min(axis=0)
+            x1, y1 = corners.max(axis=0)
+
+            # Pad proportionally to the tag size plus the distance it moved since last frame
+            speed = np.abs(track.velocity).max()
+            pad_x = max(self.__min_padding, (x1 - x0) * self.__padding + speed)
+            pad_y = max(self.__min_padding, (y1 - y0) * self.__padding + speed)
+
+            rois.append((
+                max(0, int(x0 - pad_x)),
+                max(0, int(y0 - pad_y)),
+                min(self.__width, int(x1 + pad_x) + 1),
+                min(self.__height, int(y1 + pad_y) + 1)
+            ))
+
+        return self.__merge_rois__(rois)
+
+    def update(self, detection_list, full_scan: bool):
+        found_ids = set()
+        for detection in detection_list:
+            found_ids.add(detection.tag_id)
+
+            track = self.__tracks.get(detection.tag_id)
+            if track is None:
+                self.__tracks[detection.tag_id] = TagTrack(detection.tag_id, detection.corners)
+            else:
+                track.update(detection.corners)
+
+        if full_scan:
+            self.__frames_since_full_scan = 0
+            self.__lost = False
+        else:
+            self.__frames_since_full_scan += 1
+
+            # A tracked tag went missing in its region, look for it in the whole frame next time
+            self.__lost = any(tag_id not in found_ids for tag_id in self.__tracks)
+
+        # Forget about the tags that are not visible anymore
+        for tag_id in [tag_id for tag_id in self.__tracks if tag_id not in found_ids]:
+            del self.__tracks[tag_id]
+
+    @staticmethod
+    def __merge_rois__(rois):
+        # Merge the overlapping regions so a tag is never detected twice
+        merged = []
+        for roi in sorted(rois):
+            x0, y0, x1, y1 = roi
+
+            i = 0
+            while i < len(merged):
+                mx0, my0, mx1, my1 = merged[i]
+                if x0 < mx1 and mx0 < x1 and y0 < my1 and my0 < y1:
+                    x0, y0, x1, y1 = min(x0, mx0), min(y0, my0), max(x1, mx1), max(y1, my1)
+                    merged.pop(i)
+                    i = 0
+                else:
+                    i += 1
+
+            merged.append((x0, y0, x1, y1))
+
+        return merged
@@ -1,25 +1,70 @@
-from threading import Thread
+from threading import Thread, Condition
 from typing import Tuple
 
 import time
+import numpy as np
 import cv2 as cv
 
+from .frame_ring import FrameRing
+from .perf import RollingStats
+
+
+# Reader indices of the frame ring
+DETECTOR_READER = 0
+STREAM_READER = 1
+
+# Pixel formats the camera can be asked for, the frames are kept in their native format:
+# YUYV frames as (h, w, 2) and GREY or MJPG frames as gray (h, w), MJPG is only decoded to gray
+FOURCC_MJPG = 'MJPG'
+FOURCC_YUYV = 'YUYV'
+FOURCC_GREY = 'GREY'
+
+# Delay before opening a lost camera again, doubled after every failed attempt up to the max
+RECONNECT_DELAY = 0.5
+MAX_RECONNECT_DELAY = 5.
+
 
 class USBCamera:
-    def __init__(self, id: int = 0, resolution: Tuple[int, int] = (1600, 1304), fps: int = 60, flip: int = None):
+    def __init__(self, id: int = 0, resolution: Tuple[int, int] = (1600, 1304), fps: int = 60, flip: int = None, ring_slots: int = 4, frame_condition: Condition = None,
+                 capture_factory=None, fourcc: str = None, reconnect: bool = True):
+        if fourcc not in (None, FOURCC_MJPG, FOURCC_YUYV, FOURCC_GREY):
+            raise ValueError(f'Unsupported pixel format: {fourcc}')
+
         self.__id = id
         self.__resolution = resolution
         self.__fps = fps
         self.__flip = flip
+        self.__ring_slots = ring_slots
+        self.__fourcc = fourcc
+        self.__reconnect = reconnect
+
+        # Compressed MJPG frame of every ring slot with its frame index, only decoded in color for the streams
+        # A slot pinned by a reader is never written, so its compressed frame stays the one of the pinned frame
+        self.__jpegs = [(-1, None)] * ring_slots
+        self.__read_jpeg = None
+        self.__raw_buffer = None
+
+        # Creates the capture from the camera id, anything that behaves like a cv.VideoCapture can replace the camera
+        self.__capture_factory = cv.VideoCapture if capture_factory is None else capture_factory
 
-        self.__current_frame = None
+        # Notified on every new frame, it can be shared by multiple cameras to wait on any of them
+        self.__frame_condition = Condition() if frame_condition is None else frame_condition
+
+        self.__ring: FrameRing = None
+
+        # Time between two frames given by the driver, in seconds
+        self.__capture_intervals = RollingStats()
+        self.__last_timestamp_ns = -1
         self.__current_frame_index = -1
         self.__thread: Thread = None
         self.__should_run = False
+        self.__capturing = False
+        self.__connected = False
 
     def start(self):
         if self.__thread is None:
             self.__should_run = True
+            self.__capturing = True
             self.__thread = Thread(target=self.__thread__, daemon=True)
             self.__thread.start()
 
@@ -28,40 +73,220 @@ class USBCamera:
             self.__should_run = False
             self.__thread.join()
 
+        if self.__ring is not None:
+            self.__ring.close()
+            self.__ring = None
+
     def is_running(self) -> bool:
         return self.__thread is not None and self.__thread.is_alive()
 
-    def wait_for_init(self):
-        while self.__current_frame is None:
+    def is_connected(self) -> bool:
+        return self.__connected
+
+    def wait_for_init(self, timeout: float = None) -> bool:
+        # False if the camera gave no frame before the timeout, it keeps trying to connect in the background
+        end_time = None if timeout is None else time.monotonic() + timeout
+        while self.__current_frame_index < 0:
             time.sleep(0.05)
             if not self.__thread.is_alive():
                 raise Exception("USB camera is not running")
 
-    def get_frame(self):
-        return self.__current_frame, self.__current_frame_index
+            if end_time is not None and time.monotonic() >= end_time:
+                return False
 
-    def __thread__(self):
+        return True
+
+    @property
+    def frame_ring(self) -> FrameRing:
+        return self.__ring
+
+    @property
+    def frame_condition(self) -> Condition:
+        return self.__frame_condition
+
+    @property
+    def frame_index(self) -> int:
+        return self.__current_frame_index
+
+    def wait_for_frame(self, last_index: int, timeout: float = None) -> bool:
+        # Blocks until a frame newer than last_index is available, false on timeout or if the camera stopped
+        with self.__frame_condition:
+            self.__frame_condition.wait_for(lambda: self.__current_frame_index > last_index or not self.__capturing, timeout)
+            return self.__current_frame_index > last_index
+
+    def get_frame(self, reader: int = DETECTOR_READER):
+        # The returned frame is owned by the caller until its next call to get_frame with the same reader
+        if self.__ring is None or self.__current_frame_index < 0:
+            return None, -1
+
+        return self.__ring.acquire(reader)
+
+    def get_color_frame(self, reader: int = STREAM_READER):
+        # BGR frame for the streams, the conversion is only done when someone asks for it
+        frame, frame_index = self.get_frame(reader)
+        if frame is None or self.__fourcc is None:
+            return frame, frame_index
+
+        # A horizontal flip swaps the chroma of the pixel pairs, only the colors of the stream are off
+        if self.__fourcc == FOURCC_YUYV:
+            return cv.cvtColor(frame, cv.COLOR_YUV2BGR_YUYV), frame_index
+
+        if self.__fourcc == FOURCC_MJPG:
+            jpeg_index, jpeg = self.__jpegs[self.__ring.pinned_slot(reader)]
+            if jpeg_index == frame_index:
+                color = cv.imdecode(jpeg, cv.IMREAD_COLOR)
+                if self.__flip is not None:
+                    color = cv.flip(color, self.__flip)
+
+                return color, frame_index
+
+        return cv.cvtColor(frame, cv.COLOR_GRAY2BGR), frame_index
+
+    def get_frame_timestamp(self, reader: int = DETECTOR_READER) -> float:
+        # Capture time on the time.monotonic clock of the frame last returned to the reader
+        if self.__ring is None:
+            return -1.
+
+        return self.__ring.pinned_timestamp(reader)
+
+    def get_capture_intervals(self) -> RollingStats:
+        return self.__capture_intervals
+
+    def __store_frame__(self, slot, frame, timestamp_ns: int):
+        if self.__last_timestamp_ns >= 0:
+            self.__capture_intervals.add((timestamp_ns - self.__last_timestamp_ns) / 1e9)
+        self.__last_timestamp_ns = timestamp_ns
+
+        if self.__flip is not None:
+            cv.flip(frame, self.__flip, dst=slot)
+        elif frame is not slot:
+            np.copyto(slot, frame)
+
+        # The compressed frame goes with the slot before the slot can be read
+        if self.__read_jpeg is not None:
+            self.__jpegs[self.__ring.write_slot] = (self.__current_frame_index + 1, self.__read_jpeg)
+            self.__read_jpeg = None
+
+        self.__ring.end_write(self.__current_frame_index + 1, timestamp_ns)
+
+        with self.__frame_condition:
+            self.__current_frame_index += 1
+            self.__frame_condition.notify_all()
+
+    def __read__(self, cap, image, size):
+        if self.__fourcc is None:
+            return cap.read(image=image) if image is not None else cap.read()
+
+        # The driver gives its raw buffer, it is turned into a frame without going through BGR
+        ret, self.__raw_buffer = cap.read(image=self.__raw_buffer)
+        if not ret:
+            return False, None
+
+        width, height = size
+        if self.__fourcc == FOURCC_MJPG:
+            # Keep the compressed frame for the streams, the driver buffer is reused by the next read
+            self.__read_jpeg = self.__raw_buffer.copy()
+            return True, cv.imdecode(self.__raw_buffer, cv.IMREAD_GRAYSCALE)
+
+        channels = 2 if self.__fourcc == FOURCC_YUYV else 1
+        if self.__raw_buffer.size != width * height * channels:
+            raise ValueError(f'The camera did not give {self.__fourcc} frames of {width}x{height}')
+
+        return True, self.__raw_buffer.reshape((height, width, 2) if channels == 2 else (height, width))
+
+    def __capture__(self) -> bool:
+        # Opens the camera and captures until it fails, true if it gave at least one frame
+        cap = self.__capture_factory(self.__id)
         try:
-            cap = cv.VideoCapture(self.__id)
+            if not cap.isOpened():
+                return False
+
             cap.set(cv.CAP_PROP_FRAME_WIDTH, self.__resolution[0])
             cap.set(cv.CAP_PROP_FRAME_HEIGHT, self.__resolution[1])
             cap.set(cv.CAP_PROP_FPS, self.__fps)
 
+            # Ask for the native format and get the raw buffers instead of BGR frames
+            size = None
+            if self.__fourcc is not None:
+                cap.set(cv.CAP_PROP_FOURCC, cv.VideoWriter_fourcc(*self.__fourcc))
+                cap.set(cv.CAP_PROP_CONVERT_RGB, 0)
+                size = (int(cap.get(cv.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv.CAP_PROP_FRAME_HEIGHT)))
+
+            # The time spent disconnected is not a capture interval
+            self.__raw_buffer = None
+            self.__last_timestamp_ns = -1
+
+            ret, frame = self.__read__(cap, None, size)
+            if not ret:
+                return False
+
+            # The first frame gives the real resolution of the camera to size the ring
+            # The ring outlives the connection, so the readers keep the same buffers after a reconnection
+            if self.__ring is None:
+                self.__ring = FrameRing(frame.shape, self.__ring_slots)
+            elif frame.shape != self.__ring.shape:
+                raise ValueError(f'Camera {self.__id} came back with frames of {frame.shape} instead of {self.__ring.shape}')
+            else:
+                print(f'Camera {self.__id} reconnected')
+
+            self.__connected = True
+            self.__store_frame__(self.__ring.begin_write(), frame, time.monotonic_ns())
+
+            # The flip can not be done in place, so the first frame is kept as the capture buffer
+            capture_buffer = frame
+
             while self.__should_run:
-                ret, frame = cap.read()
-                if not ret:
-                    break
+                slot = self.__ring.begin_write()
 
+                # Read the frame straight into the ring when it does not need to be flipped
                 if self.__flip is not None:
-                    frame = cv.flip(frame, self.__flip)
+                    ret, frame = self.__read__(cap, capture_buffer, size)
+                else:
+                    ret, frame = self.__read__(cap, slot, size)
 
-                self.__current_frame = frame
-                self.__current_frame_index += 1
+                if not ret:
+                    break
+
+                # The frame is stamped as soon as the driver hands it over
+                self.__store_frame__(slot, frame, time.monotonic_ns())
 
+            return True
+        finally:
+            self.__connected = False
             if cap.isOpened():
                 cap.release()
 
-            self.__current_frame = None
+    def __backoff__(self, delay: float):
+        # Sleeps in small steps so a stop is not delayed by the backoff
+        end_time = time.monotonic() + delay
+        while self.__should_run and time.monotonic() < end_time:
+            time.sleep(0.05)
+
+    def __thread__(self):
+        delay = RECONNECT_DELAY
+        while self.__should_run:
+            try:
+                captured = self.__capture__()
+            except Exception as e:
+                print(e)
+                captured = False
+
+            if not self.__should_run or not self.__reconnect:
+                break
+
+            # The frame index keeps going and the last frame stays in the ring while the camera is away
+            if captured:
+                print(f'Camera {self.__id} lost, reconnecting')
+                delay = RECONNECT_DELAY
+
+            self.__backoff__(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+        if self.__ring is not None:
+            self.__ring.reset()
+
+        # Wake up the waiters so they see the camera stopped
+        with self.__frame_condition:
+            self.__capturing = False
             self.__current_frame_index = -1
-        except Exception as e:
-            print(e)
\ No newline at end of file
+            self.__frame_condition.notify_all()
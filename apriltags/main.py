@@ -1,7 +1,9 @@
-from frctools.vision import MjpegStreamer
 from frctools.vision.apriltags import AprilTagsNetworkTable
-from frc_apriltags import USBCamera, AprilTagDetector
+from frc_apriltags import MjpegStreamer, USBCamera, AprilTagDetector, CameraSettings, CameraPipeline, DetectionPacketPublisher, PerfMonitor, PerfPublisher, RollingStats, RecordingSettings, create_recorder, STREAM_READER
 from dotenv import load_dotenv
+from multiprocessing import Queue
+from queue import Empty
+from threading import Condition
 
 import time
 import os
@@ -14,6 +16,8 @@ def parse_bool(val: str) -> bool:
     return val.lower() == 'true'
 def parse_int(val: str) -> int:
     return int(val)
+def parse_float(val: str) -> float:
+    return float(val)
 def parse_tuple(val: str):
     val_split = val.split(',')
     return int(val_split[0]), int(val_split[1])
@@ -33,6 +37,19 @@ load_dotenv(override=True)
 
 # General settings
 UNDISTORT_IMAGE = environment_or_default('FRC_UNDISTORT_IMAGE', True, parse_bool)
+UNDISTORT_MODE = environment_or_default('FRC_UNDISTORT_MODE', 'image', parse_str)
+PIPELINED = environment_or_default('FRC_PIPELINED', False, parse_bool)
+DETECTOR_THREADS = environment_or_default('FRC_DETECTOR_THREADS', None, parse_int)
+TRACKING = environment_or_default('FRC_TRACKING', False, parse_bool)
+TRACKING_FULL_SCAN_INTERVAL = environment_or_default('FRC_TRACKING_FULL_SCAN_INTERVAL', 10, parse_int)
+STREAM_ENCODER_THREADS = environment_or_default('FRC_STREAM_ENCODER_THREADS', 2, parse_int)
+CAMERA_INIT_TIMEOUT = environment_or_default('FRC_CAMERA_INIT_TIMEOUT', 5., parse_float)
+
+# Recording settings
+RECORD = environment_or_default('FRC_RECORD', False, parse_bool)
+RECORD_DIRECTORY = environment_or_default('FRC_RECORD_DIRECTORY', 'recordings', parse_str)
+RECORD_THUMBNAIL_RESOLUTION = environment_or_default('FRC_RECORD_THUMBNAIL_RESOLUTION', None, parse_tuple)
+RECORD_FRAME_INTERVAL = environment_or_default('FRC_RECORD_FRAME_INTERVAL', 1, parse_int)
 
 # CAM0 settings
 CAM0_ID = environment_or_default('FRC_CAM0_ID', 0, parse_int)
@@ -40,9 +57,19 @@ CAM0_RESOLUTION = environment_or_default('FRC_CAM0_RESOLUTION', (1600, 1304), pa
 CAM0_PROCESSING_RESOLUTION = environment_or_default('FRC_CAM0_PROCESSING_RESOLUTION', CAM0_RESOLUTION, parse_tuple)
 CAM0_STREAM_RESOLUTION = environment_or_default('FRC_CAM0_STREAM_RESOLUTION', CAM0_PROCESSING_RESOLUTION, parse_tuple)
 CAM0_FPS = environment_or_default('FRC_CAM0_FPS', 60, parse_int)
+CAM0_STREAM_FPS = environment_or_default('FRC_CAM0_STREAM_FPS', CAM0_FPS, parse_int)
+CAM0_STREAM_QUALITY = environment_or_default('FRC_CAM0_STREAM_QUALITY', 80, parse_int)
 CAM0_FLIP = environment_or_default('FRC_CAM0_FLIP', None, parse_int)
+CAM0_FOURCC = environment_or_default('FRC_CAM0_FOURCC', None, parse_str)
 CAM0_CALIBRATION_FILE = environment_or_default('FRC_CAM0_CALIBRATION_FILE', 'calibration_0.json', parse_str)
 CAM0_NAME = environment_or_default('FRC_CAM0_NAME', 'cam0', parse_str)
+CAM0_STREAM_PORT = environment_or_default('FRC_CAM0_STREAM_PORT', 5800, parse_int)
+CAM0_QUAD_DECIMATE = environment_or_default('FRC_CAM0_QUAD_DECIMATE', 2., parse_float)
+CAM0_QUAD_SIGMA = environment_or_default('FRC_CAM0_QUAD_SIGMA', 0., parse_float)
+CAM0_ADAPTIVE_DECIMATION = environment_or_default('FRC_CAM0_ADAPTIVE_DECIMATION', False, parse_bool)
+CAM0_MAX_QUAD_DECIMATE = environment_or_default('FRC_CAM0_MAX_QUAD_DECIMATE', 4., parse_float)
+CAM0_MIN_TAG_PIXELS = environment_or_default('FRC_CAM0_MIN_TAG_PIXELS', 24., parse_float)
+CAM0_DETECTION_BUDGET_MS = environment_or_default('FRC_CAM0_DETECTION_BUDGET_MS', None, parse_float)
 
 # CAM1 settings
 CAM1_ID = environment_or_default('FRC_CAM1_ID', 2, parse_int)
@@ -50,92 +77,230 @@ CAM1_RESOLUTION = environment_or_default('FRC_CAM1_RESOLUTION', (1600, 1304), pa
 CAM1_PROCESSING_RESOLUTION = environment_or_default('FRC_CAM1_PROCESSING_RESOLUTION', CAM1_RESOLUTION, parse_tuple)
 CAM1_STREAM_RESOLUTION = environment_or_default('FRC_CAM1_STREAM_RESOLUTION', CAM1_PROCESSING_RESOLUTION, parse_tuple)
 CAM1_FPS = environment_or_default('FRC_CAM1_FPS', 60, parse_int)
+CAM1_STREAM_FPS = environment_or_default('FRC_CAM1_STREAM_FPS', CAM1_FPS, parse_int)
+CAM1_STREAM_QUALITY = environment_or_default('FRC_CAM1_STREAM_QUALITY', 80, parse_int)
 CAM1_FLIP = environment_or_default('FRC_CAM1_FLIP', None, parse_int)
+CAM1_FOURCC = environment_or_default('FRC_CAM1_FOURCC', None, parse_str)
 CAM1_CALIBRATION_FILE = environment_or_default('FRC_CAM1_CALIBRATION_FILE', 'calibration_1.json', parse_str)
 CAM1_NAME = environment_or_default('FRC_CAM1_NAME', 'cam1', parse_str)
+CAM1_STREAM_PORT = environment_or_default('FRC_CAM1_STREAM_PORT', 5801, parse_int)
+CAM1_QUAD_DECIMATE = environment_or_default('FRC_CAM1_QUAD_DECIMATE', 2., parse_float)
+CAM1_QUAD_SIGMA = environment_or_default('FRC_CAM1_QUAD_SIGMA', 0., parse_float)
+CAM1_ADAPTIVE_DECIMATION = environment_or_default('FRC_CAM1_ADAPTIVE_DECIMATION', False, parse_bool)
+CAM1_MAX_QUAD_DECIMATE = environment_or_default('FRC_CAM1_MAX_QUAD_DECIMATE', 4., parse_float)
+CAM1_MIN_TAG_PIXELS = environment_or_default('FRC_CAM1_MIN_TAG_PIXELS', 24., parse_float)
+CAM1_DETECTION_BUDGET_MS = environment_or_default('FRC_CAM1_DETECTION_BUDGET_MS', None, parse_float)
 
 # NetworkTables settings
 NT_IDENTITY = environment_or_default('FRC_NT_IDENTITY', 'april-tags-detector', parse_str)
 NT_SERVER_ADDRESS = environment_or_default('FRC_NT_SERVER_ADDRESS', '10.31.17.2', parse_str)
+# The per tag entries of frctools are only for older robot code, the robot reads the detection packets
+NT_LEGACY_TAGS = environment_or_default('FRC_NT_LEGACY_TAGS', False, parse_bool)
 
 
-def main():
+def create_nt():
+    nt = ntcore.NetworkTableInstance.getDefault()
+    nt.startClient4(NT_IDENTITY)
+    nt.setServer(NT_SERVER_ADDRESS, ntcore.NetworkTableInstance.kDefaultPort4)
+
+    return nt
+
+
+class DetectionPublisher:
+    # Publishes the detections of a camera as soon as it processed a new frame
+    def __init__(self, nt, cam_ids):
+        self.__packet_nt = DetectionPacketPublisher(nt, cam_ids)
+        self.__perf_nt = PerfPublisher(nt, cam_ids)
+
+        # The publishing is timed here since it happens out of the detector
+        self.__publish_times = {cam_id: RollingStats() for cam_id in cam_ids}
+
+        # The per tag entries are only needed by the robot code still reading AprilTagsFieldPose, they hold the tags of every camera
+        self.__april_tags_nt = AprilTagsNetworkTable(22, nt) if NT_LEGACY_TAGS else None
+        self.__detections = {cam_id: [] for cam_id in cam_ids}
+
+    def publish(self, cam_id: int, frame_index: int, detection, perf_report: dict = None):
+        start_time = time.perf_counter()
+
+        # Every detection of the packet carries the capture time of its frame
+        self.__packet_nt.publish(cam_id, frame_index, detection)
+
+        if self.__april_tags_nt is not None:
+            self.__detections[cam_id] = detection
+            self.__april_tags_nt([(c, d) for c, cam_detection in self.__detections.items() for d in cam_detection])
+
+        self.__publish_times[cam_id].add(time.perf_counter() - start_time)
+
+        if perf_report is not None:
+            perf_report['stages']['publish'] = self.__publish_times[cam_id].summary()
+            self.__perf_nt.publish(cam_id, perf_report)
+
+
+def detector_kwargs(cam_id: int, nthreads: int = None):
+    quad_decimate, quad_sigma, adaptive_decimation, max_quad_decimate, min_tag_pixels, detection_budget_ms = (
+        (CAM0_QUAD_DECIMATE, CAM0_QUAD_SIGMA, CAM0_ADAPTIVE_DECIMATION, CAM0_MAX_QUAD_DECIMATE, CAM0_MIN_TAG_PIXELS, CAM0_DETECTION_BUDGET_MS),
+        (CAM1_QUAD_DECIMATE, CAM1_QUAD_SIGMA, CAM1_ADAPTIVE_DECIMATION, CAM1_MAX_QUAD_DECIMATE, CAM1_MIN_TAG_PIXELS, CAM1_DETECTION_BUDGET_MS),
+    )[cam_id]
+
+    kwargs = {
+        'tracking': TRACKING,
+        'tracking_full_scan_interval': TRACKING_FULL_SCAN_INTERVAL,
+        'undistort_mode': UNDISTORT_MODE,
+        'quad_decimate': quad_decimate,
+        'quad_sigma': quad_sigma,
+        'adaptive_decimation': adaptive_decimation,
+        'max_quad_decimate': max_quad_decimate,
+        'min_tag_pixels': min_tag_pixels,
+        'detection_budget': detection_budget_ms / 1000 if detection_budget_ms is not None else None,
+    }
+
+    nthreads = DETECTOR_THREADS if DETECTOR_THREADS is not None else nthreads
+    if nthreads is not None:
+        kwargs['nthreads'] = nthreads
+
+    return kwargs
+
+
+def recording_settings():
+    if not RECORD:
+        return None
+
+    return RecordingSettings(RECORD_DIRECTORY, RECORD_THUMBNAIL_RESOLUTION, RECORD_FRAME_INTERVAL)
+
+
+def main_sequential():
     # Create the camera
-    cam0 = USBCamera(CAM0_ID, CAM0_RESOLUTION, CAM0_FPS, CAM0_FLIP)
-    cam1 = USBCamera(CAM1_ID, CAM1_RESOLUTION, CAM1_FPS, CAM1_FLIP)
+    frame_condition = Condition()
+    cam0 = USBCamera(CAM0_ID, CAM0_RESOLUTION, CAM0_FPS, CAM0_FLIP, frame_condition=frame_condition, fourcc=CAM0_FOURCC)
+    cam1 = USBCamera(CAM1_ID, CAM1_RESOLUTION, CAM1_FPS, CAM1_FLIP, frame_condition=frame_condition, fourcc=CAM1_FOURCC)
 
     # Start the camera thread
     cam0.start()
     cam1.start()
 
-    # Wait until the camera read its first frame
-    cam0.wait_for_init()
-    cam1.wait_for_init()
+    # Wait until the camera read its first frame, a missing camera is picked up whenever it gets connected
+    for cam_id, cam in ((0, cam0), (1, cam1)):
+        if not cam.wait_for_init(CAMERA_INIT_TIMEOUT):
+            print(f'Camera {cam_id} is not connected, starting without it')
 
-    # Create the mjpeg streamer
-    streamer = MjpegStreamer(port=5800)
+    # Create the mjpeg streamer, both cameras are served on the port of the camera 0
+    streamer = MjpegStreamer(port=CAM0_STREAM_PORT, encoder_threads=STREAM_ENCODER_THREADS)
 
-    stream0_raw = streamer.create_stream(f'{CAM0_NAME}/raw', CAM0_FPS, CAM0_STREAM_RESOLUTION)
-    stream0_detection = streamer.create_stream(f'{CAM0_NAME}/detection', CAM0_FPS, CAM0_STREAM_RESOLUTION)
+    stream0_raw = streamer.create_stream(f'{CAM0_NAME}/raw', CAM0_STREAM_FPS, CAM0_STREAM_RESOLUTION, CAM0_STREAM_QUALITY)
+    stream0_detection = streamer.create_stream(f'{CAM0_NAME}/detection', CAM0_STREAM_FPS, CAM0_STREAM_RESOLUTION, CAM0_STREAM_QUALITY)
 
-    stream1_raw = streamer.create_stream(f'{CAM1_NAME}/raw', CAM1_FPS, CAM1_STREAM_RESOLUTION)
-    stream1_detection = streamer.create_stream(f'{CAM1_NAME}/detection', CAM1_FPS, CAM1_STREAM_RESOLUTION)
+    stream1_raw = streamer.create_stream(f'{CAM1_NAME}/raw', CAM1_STREAM_FPS, CAM1_STREAM_RESOLUTION, CAM1_STREAM_QUALITY)
+    stream1_detection = streamer.create_stream(f'{CAM1_NAME}/detection', CAM1_STREAM_FPS, CAM1_STREAM_RESOLUTION, CAM1_STREAM_QUALITY)
 
     streamer.start()
 
     # Create the April Tag Detector
-    detector0 = AprilTagDetector(stream0_raw, stream0_detection, CAM0_PROCESSING_RESOLUTION, CAM0_STREAM_RESOLUTION, CAM0_CALIBRATION_FILE)
-    detector1 = AprilTagDetector(stream1_raw, stream1_detection, CAM1_PROCESSING_RESOLUTION, CAM1_STREAM_RESOLUTION, CAM1_CALIBRATION_FILE)
+    detector0 = AprilTagDetector(stream0_raw, stream0_detection, CAM0_PROCESSING_RESOLUTION, CAM0_STREAM_RESOLUTION, CAM0_CALIBRATION_FILE,
+                                 stream_fps=CAM0_STREAM_FPS, frame_source=lambda: cam0.get_color_frame(STREAM_READER), **detector_kwargs(0))
+    detector1 = AprilTagDetector(stream1_raw, stream1_detection, CAM1_PROCESSING_RESOLUTION, CAM1_STREAM_RESOLUTION, CAM1_CALIBRATION_FILE,
+                                 stream_fps=CAM1_STREAM_FPS, frame_source=lambda: cam1.get_color_frame(STREAM_READER), **detector_kwargs(1))
 
     # Create the network table client
-    nt = ntcore.NetworkTableInstance.getDefault()
-    nt.startClient4(NT_IDENTITY)
-    nt.setServer(NT_SERVER_ADDRESS, ntcore.NetworkTableInstance.kDefaultPort4)
+    nt = create_nt()
+    publisher = DetectionPublisher(nt, (0, 1))
 
-    april_tags_nt = AprilTagsNetworkTable(22, nt)
+    # Record every camera to its own file
+    recording = recording_settings()
+    recorders = [create_recorder(recording, cam_id) if recording is not None else None for cam_id in (0, 1)]
+    for recorder in recorders:
+        if recorder is not None:
+            recorder.start()
 
-    # Initialize the last frame index
-    cam0_last_index = -1
-    cam1_last_index = -1
+    # Both cameras notify the same condition so a single wait covers them
+    cameras = ((0, cam0, detector0, PerfMonitor()), (1, cam1, detector1, PerfMonitor()))
+    last_indices = [-1, -1]
+
+    def has_new_frame():
+        return any(cam.frame_index > last_indices[cam_id] or not cam.is_running() for cam_id, cam, _, _ in cameras)
 
-    # Initialize the current detection
-    detection_0 = []
-    detection_1 = []
     while True:
-        # If any of the camera is not running close the program
+        # A camera reconnects by itself, it only stops running if its thread died
         # If it is running as a service act as a reboot
         if not cam0.is_running() or not cam1.is_running():
+            for recorder in recorders:
+                if recorder is not None:
+                    recorder.stop()
+
+            detector0.stop()
+            detector1.stop()
             cam0.stop()
             cam1.stop()
             break
 
-        new_frame = False
-
-        # Get the new frames for the cameras
-        frame0, frame0_index = cam0.get_frame()
-        frame1, frame1_index = cam1.get_frame()
-
-        # Process frame only if they are new
-        if frame0_index > cam0_last_index:
-            cam0_last_index = frame0_index
-            new_frame = True
-            detection_0 = detector0.detect(frame0, UNDISTORT_IMAGE)
-        if frame1_index > cam1_last_index:
-            cam1_last_index = frame1_index
-            new_frame = new_frame
-            detection_1 = detector1.detect(frame1, UNDISTORT_IMAGE)
-
-        # If any new frame has been processed update the NetworkTables
-        if new_frame:
-            all_detection = []
-            for d0 in detection_0:
-                all_detection.append((0, d0))
-            for d1 in detection_1:
-                all_detection.append((1, d1))
-
-            april_tags_nt(all_detection)
-        else: # Sleep a bit if there is no new frame
-            time.sleep(0.001)
+        # Wait for any camera to give a new frame
+        with frame_condition:
+            if not frame_condition.wait_for(has_new_frame, timeout=0.5):
+                continue
+
+        # Process and publish every camera that has a new frame, on its own
+        for cam_id, cam, detector, perf in cameras:
+            frame, frame_index = cam.get_frame()
+            if frame_index <= last_indices[cam_id]:
+                continue
+
+            last_indices[cam_id] = frame_index
+            frame_time = cam.get_frame_timestamp()
+            detection = detector.detect(frame, UNDISTORT_IMAGE, frame_time)
+
+            perf.record(detector.get_stage_times())
+            perf.record_frame(frame_index)
+
+            if recorders[cam_id] is not None:
+                recorders[cam_id].record(cam_id, frame_index, frame_time, frame, detection)
+
+            publisher.publish(cam_id, frame_index, detection, perf.report(cam.get_capture_intervals()))
+
+
+def main_pipelined():
+    settings = [
+        CameraSettings(0, CAM0_ID, CAM0_NAME, CAM0_RESOLUTION, CAM0_PROCESSING_RESOLUTION, CAM0_STREAM_RESOLUTION, CAM0_STREAM_FPS, CAM0_FPS, CAM0_FLIP, CAM0_CALIBRATION_FILE, CAM0_STREAM_PORT,
+                       CAM0_STREAM_QUALITY, STREAM_ENCODER_THREADS, CAM0_FOURCC, CAMERA_INIT_TIMEOUT),
+        CameraSettings(1, CAM1_ID, CAM1_NAME, CAM1_RESOLUTION, CAM1_PROCESSING_RESOLUTION, CAM1_STREAM_RESOLUTION, CAM1_STREAM_FPS, CAM1_FPS, CAM1_FLIP, CAM1_CALIBRATION_FILE, CAM1_STREAM_PORT,
+                       CAM1_STREAM_QUALITY, STREAM_ENCODER_THREADS, CAM1_FOURCC, CAMERA_INIT_TIMEOUT),
+    ]
+
+    # Split the cores between the workers so the detectors do not fight over them
+    nthreads = max(1, (os.cpu_count() or 1) // len(settings))
+
+    # Each camera and its detector run in their own process and push their results here
+    results = Queue()
+    pipelines = [CameraPipeline(s, results, UNDISTORT_IMAGE, recording_settings(), **detector_kwargs(s.cam_id, nthreads)) for s in settings]
+
+    # Start the workers before the network table client so it is not forked into them
+    for pipeline in pipelines:
+        pipeline.start()
+
+    # Create the network table client
+    nt = create_nt()
+    publisher = DetectionPublisher(nt, [s.cam_id for s in settings])
+
+    while True:
+        # If any of the worker is not running close the program
+        # If it is running as a service act as a reboot
+        if not all(p.is_running() for p in pipelines):
+            for pipeline in pipelines:
+                pipeline.stop()
+            break
+
+        # Wait for any camera to finish a detection
+        try:
+            cam_id, frame_index, frame_time, detection, perf_report = results.get(timeout=0.5)
+        except Empty:
+            continue
+
+        publisher.publish(cam_id, frame_index, detection, perf_report)
+
+
+def main():
+    if PIPELINED:
+        main_pipelined()
+    else:
+        main_sequential()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,17 @@
+from frc_apriltags import replay_detections
+
+import sys
+
+from main import create_nt, DetectionPublisher
+
+
+def main(paths, realtime: bool = True):
+    # Publish recorded detections as if they came from the cameras, one recording per camera, all of them replayed together
+    nt = create_nt()
+    publisher = DetectionPublisher(nt, (0, 1))
+
+    replay_detections(paths, publisher.publish, realtime)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
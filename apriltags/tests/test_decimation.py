@@ -0,0 +1,83 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from frc_apriltags import AdaptiveDecimation, DECIMATION_LEVELS
+
+
+def tag(size: float, x: float = 100., y: float = 100.):
+    # Square tag of size pixels per side
+    return SimpleNamespace(corners=np.array([[x, y], [x + size, y], [x + size, y + size], [x, y + size]]))
+
+
+def test_levels_capped_by_max_decimation():
+    assert AdaptiveDecimation(2.).levels == (1., 1.5, 2.)
+    assert AdaptiveDecimation(10.).levels == DECIMATION_LEVELS
+    assert AdaptiveDecimation(0.5).levels == (1.,)
+
+
+def test_search_without_budget_uses_configured_decimation():
+    decimation = AdaptiveDecimation(4., budget=None, search_decimation=3.)
+    assert decimation.get_decimation() == 3.
+
+    decimation.update([tag(24.)])
+    decimation.update([])
+    assert decimation.get_decimation() == 3.
+
+    # Never above the max decimation
+    assert AdaptiveDecimation(1.5, search_decimation=2.).get_decimation() == 1.5
+
+
+def test_smallest_tag_picks_the_decimation():
+    decimation = AdaptiveDecimation(4., min_tag_pixels=24.)
+
+    decimation.update([tag(200.)])
+    assert decimation.get_decimation() == 4.
+
+    decimation.update([tag(60.)])
+    assert decimation.get_decimation() == 2.
+
+    # A far tag needs the full resolution, whatever the size of the others
+    decimation.update([tag(200.), tag(30.)])
+    assert decimation.get_decimation() == 1.
+
+    decimation.update([tag(10.)])
+    assert decimation.get_decimation() == 1.
+
+
+def test_search_within_budget():
+    decimation = AdaptiveDecimation(4., budget=0.02)
+
+    # Nothing measured yet, the first search is at full resolution
+    assert decimation.get_decimation() == 1.
+
+    # 50 ms at full resolution, the time is estimated from the number of decimated pixels
+    decimation.record_time(1., 0.05)
+    decimation.update([])
+    assert decimation.get_decimation() == 2.
+
+    # Measured times win over the estimate
+    decimation.record_time(1.5, 0.01)
+    decimation.update([])
+    assert decimation.get_decimation() == 1.5
+
+
+def test_search_over_budget_uses_max_decimation():
+    decimation = AdaptiveDecimation(4., budget=0.001)
+
+    decimation.record_time(4., 0.01)
+    decimation.update([])
+    assert decimation.get_decimation() == 4.
+
+
+def test_record_time_is_smoothed():
+    decimation = AdaptiveDecimation(4., budget=0.04)
+
+    decimation.record_time(2., 0.02)
+    decimation.update([])
+    assert decimation.get_decimation() == 1.5
+
+    # A single slow frame only moves the average a bit, the next level still fits in the budget
+    decimation.record_time(2., 0.06)
+    decimation.update([])
+    assert decimation.get_decimation() == 2.
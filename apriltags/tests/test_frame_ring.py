@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+
+from frc_apriltags import FrameRing
+
+
+@pytest.fixture
+def ring():
+    ring = FrameRing((4, 6), slots=4, readers=2)
+    yield ring
+    ring.close()
+
+
+def write(ring: FrameRing, seq: int, timestamp_ns: int = 0):
+    frame = ring.begin_write()
+    frame[:] = seq % 256
+    ring.end_write(seq, timestamp_ns)
+
+
+def test_empty(ring):
+    assert ring.acquire(0) == (None, -1)
+    assert ring.latest_seq() == -1
+    assert ring.pinned_timestamp(0) == -1.
+
+
+def test_acquire_latest(ring):
+    for seq in range(3):
+        write(ring, seq, seq * 1_000_000_000)
+
+    frame, seq = ring.acquire(0)
+    assert seq == 2
+    assert (frame == 2).all()
+    assert ring.latest_seq() == 2
+    assert ring.pinned_timestamp(0) == 2.
+
+
+def test_pinned_frame_is_never_written(ring):
+    write(ring, 0)
+    frame, seq = ring.acquire(0)
+
+    # The writer goes around the ring many times while the reader holds its frame
+    for seq in range(1, 50):
+        write(ring, seq)
+        assert (frame == 0).all()
+
+    # The other reader still gets the latest frame
+    latest, latest_seq = ring.acquire(1)
+    assert latest_seq == 49
+    assert (latest == 49).all()
+    assert ring.pinned_slot(0) != ring.pinned_slot(1)
+
+    # Once released, the slot goes back in the rotation
+    ring.release(0)
+    assert ring.pinned_slot(0) == -1
+    for seq in range(50, 50 + ring.slots):
+        write(ring, seq)
+    assert (frame != 0).any()
+
+
+def test_write_skips_latest_and_pins(ring):
+    write(ring, 0)
+    ring.acquire(0)
+    write(ring, 1)
+    ring.acquire(1)
+
+    # Both readers pin a slot and the latest is one of them, the two free slots are used in turn
+    slots = set()
+    for seq in range(2, 10):
+        ring.begin_write()
+        assert ring.write_slot not in (ring.pinned_slot(0), ring.pinned_slot(1))
+        slots.add(ring.write_slot)
+        ring.end_write(seq)
+
+    assert len(slots) == 2
+
+
+def test_attach_shares_frames():
+    ring = FrameRing((4, 6, 2), slots=5, readers=3)
+    try:
+        attached = FrameRing.attach(ring.name)
+        try:
+            assert attached.shape == (4, 6, 2)
+            assert attached.slots == 5
+            assert attached.readers == 3
+
+            write(ring, 7, 3_000_000_000)
+            frame, seq = attached.acquire(2)
+            assert seq == 7
+            assert (frame == 7).all()
+            assert attached.pinned_timestamp(2) == 3.
+        finally:
+            attached.close()
+    finally:
+        ring.close()
+
+
+def test_reset(ring):
+    write(ring, 0)
+    ring.reset()
+
+    assert ring.acquire(0) == (None, -1)
+    assert ring.latest_seq() == -1
+
+
+def test_too_few_slots():
+    with pytest.raises(ValueError):
+        FrameRing((4, 6), slots=3, readers=2)
+
+
+def test_frames_are_views_of_the_ring(ring):
+    write(ring, 5)
+    first, _ = ring.acquire(0)
+    second, _ = ring.acquire(0)
+
+    # Nothing is copied when acquiring the same frame again
+    assert np.shares_memory(first, second)
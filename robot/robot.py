@@ -6,14 +6,59 @@ from frctools.frcmath import Vector2, SlewRateLimiter
 from frctools.input import Input, XboxControllerInput, PowerTransform
 from frctools.vision.apriltags import AprilTagsReefscapeField
 
-from robot2025 import Climber, Conveyor, CoralOuttake, Elevator, Yeeter, RobotController
+from robot2025 import Climber, Conveyor, CoralOuttake, Elevator, Yeeter, RobotController, SparkFlexPositionLoop, LoopProfiler, Telemetry, SensorSnapshot
 from robot2025.autonomous import SimpleForward, SingleCoral, MultiCoral
 
 from wpilib import DutyCycleEncoder, ADIS16448_IMU, SPI, DigitalInput
 
 
+# Height change of the elevator for one rotation of its motor, the position loop runs on the SPARK Flex once it is measured
+ELEVATOR_HEIGHT_PER_MOTOR_ROTATION = None
+
+# Time every coroutine step, component update and dashboard property, published under /profiler
+LOOP_PROFILER = True
+
+# Component properties sampled and sent to the dashboard only when they change, at this period in seconds
+TELEMETRY = True
+TELEMETRY_PERIOD = 0.1
+
+# Smallest change of a property sent to the dashboard, in the units of the property, so the encoder noise is not sent every period
+TELEMETRY_DEADBANDS = {
+    'Elevator': {
+        'height': 0.0005,
+        'height_raw': 0.0005,
+        'error': 0.0005,
+        'true_error': 0.0005,
+        'smooth_error': 0.0005,
+        'setpoint_height': 0.0005,
+        'setpoint_velocity': 0.005,
+    },
+    'Climber': {
+        'angle': 0.002,
+    },
+}
+
+# Encoders, proximity sensors, limit switches and the heading read by the components once at the start of every loop
+# The swerve modules and SwerveDrive still read their steering encoders and the IMU directly
+SENSOR_SNAPSHOT = True
+
+
 class Robot(RobotBase):
+    __profiler: LoopProfiler = None
+    __telemetry: Telemetry = None
+    __sensors: SensorSnapshot = None
+
     def robotInit(self):
+        if LOOP_PROFILER:
+            self.__profiler = LoopProfiler()
+            self.__profiler.install()
+
+        if TELEMETRY:
+            self.__telemetry = Telemetry(period=TELEMETRY_PERIOD)
+
+        if SENSOR_SNAPSHOT:
+            self.__sensors = SensorSnapshot()
+
         super().robotInit()
 
         Input.add_axis('horizontal',
@@ -89,22 +134,27 @@ class Robot(RobotBase):
         swerve.set_cosine_compensation(True)
         self.add_component('Swerve', swerve)
 
-        climber = Climber(WPI_CANSparkMax(14, True, False, True), Encoder(DutyCycleEncoder(9), 0.64, False), DigitalInput(7))
+        climber = Climber(WPI_CANSparkMax(14, True, False, True), Encoder(DutyCycleEncoder(9), 0.64, False), DigitalInput(7), sensors=self.__sensors)
         self.add_component('Climber', climber)
 
-        conveyor = Conveyor(WPI_CANSparkMax(11, True, True), DigitalInput(4))
+        conveyor = Conveyor(WPI_CANSparkMax(11, True, True), DigitalInput(4), sensors=self.__sensors)
         self.add_component('Conveyor', conveyor)
 
-        coral_outtake = CoralOuttake(WPI_CANSparkMax(10, True, True), DigitalInput(5))
+        coral_outtake = CoralOuttake(WPI_CANSparkMax(10, True, True), DigitalInput(5), sensors=self.__sensors)
         self.add_component('CoralOuttake', coral_outtake)
 
-        elevator = Elevator(WPI_CANSparkFlex(12, True, True), Encoder(DutyCycleEncoder(6), 0.6, False), PID(9, 0, 0, 0.015, integral_range=(-0.5, 0.5)), top_limit_switch=DigitalInput(8))
+        if ELEVATOR_HEIGHT_PER_MOTOR_ROTATION is not None:
+            elevator_motor = SparkFlexPositionLoop(12, ELEVATOR_HEIGHT_PER_MOTOR_ROTATION, inverted=True)
+        else:
+            elevator_motor = WPI_CANSparkFlex(12, True, True)
+
+        elevator = Elevator(elevator_motor, Encoder(DutyCycleEncoder(6), 0.6, False), PID(9, 0, 0, 0.015, integral_range=(-0.5, 0.5)), top_limit_switch=DigitalInput(8), sensors=self.__sensors)
         self.add_component('Elevator', elevator)
 
-        #yeeter = Yeeter(WPI_CANSparkMax(15, True, True), Encoder(DutyCycleEncoder(8), 0.75, False))
+        #yeeter = Yeeter(WPI_CANSparkMax(15, True, True), Encoder(DutyCycleEncoder(8), 0.75, False), sensors=self.__sensors)
         #self.add_component('Yeeter', yeeter)
 
-        controller = RobotController()
+        controller = RobotController(sensors=self.__sensors)
         self.add_component('RobotController', controller)
 
         led = LED(0, 10)
@@ -125,11 +175,47 @@ class Robot(RobotBase):
         multi_coral = MultiCoral(False)
         self.add_auto('Multi_Coral_Right', multi_coral)
 
+    def add_component(self, name: str, component):
+        if self.__profiler is not None:
+            self.__profiler.profile_component(name, component)
+
+        if self.__telemetry is not None:
+            self.__telemetry.add_component(name, component, TELEMETRY_DEADBANDS.get(name))
+
+        super().add_component(name, component)
+
     def disabledExit(self):
         super().disabledExit()
 
         # Refresh the alliance for the april tags
         AprilTagsReefscapeField.refresh_alliance()
 
+    def __refresh_sensors__(self):
+        if self.__sensors is not None:
+            self.__sensors.refresh()
+
+    # Every loop runs the periodic of its mode before robotPeriodic, so the sensors are read at the start of the mode periodic
+    def disabledPeriodic(self):
+        self.__refresh_sensors__()
+        super().disabledPeriodic()
+
+    def autonomousPeriodic(self):
+        self.__refresh_sensors__()
+        super().autonomousPeriodic()
+
+    def teleopPeriodic(self):
+        self.__refresh_sensors__()
+        super().teleopPeriodic()
+
+    def testPeriodic(self):
+        self.__refresh_sensors__()
+        super().testPeriodic()
+
     def robotPeriodic(self):
         super().robotPeriodic()
+
+        if self.__profiler is not None:
+            self.__profiler.publish()
+
+        if self.__telemetry is not None:
+            self.__telemetry.update()
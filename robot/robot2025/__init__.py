@@ -2,7 +2,15 @@ from .climber import Climber
 from .conveyor import Conveyor
 from .coral_outtake import CoralOuttake
 from .elevator import Elevator
+from .motion_profile import TrapezoidProfile, ElevatorFeedforward, ProfileState
+from .spark_position import SparkFlexPositionLoop
+from .loop_profiler import LoopProfiler
+from .telemetry import Telemetry
+from .sensor_snapshot import SensorSnapshot
 from .yeeter import Yeeter
+from .pose_history import PoseHistory
+from .pose_estimator import PoseEstimator
+from .vision_packet import DetectionPacketReader, DetectionFrame, TagDetection
 from .controller import RobotController
 
 from . import driver_station
@@ -13,7 +21,19 @@ __all__ = [
     'Conveyor',
     'CoralOuttake',
     'Elevator',
+    'TrapezoidProfile',
+    'ElevatorFeedforward',
+    'ProfileState',
+    'SparkFlexPositionLoop',
+    'LoopProfiler',
+    'Telemetry',
+    'SensorSnapshot',
     'Yeeter',
+    'PoseHistory',
+    'PoseEstimator',
+    'DetectionPacketReader',
+    'DetectionFrame',
+    'TagDetection',
     'RobotController',
     'driver_station',
 ]
@@ -40,7 +40,7 @@ class MultiCoral(AutonomousSequence):
     def align_on_tag(self, tag, position, cam_id: int, feeding: bool = False):
         yield from ()
 
-        if not tag.is_detected:
+        if not self.__controller.is_tag_detected(tag):
             raise NoTagException()
 
         self.__controller.custom_align(tag, cam_id, position)
@@ -67,7 +67,7 @@ class MultiCoral(AutonomousSequence):
         self.__intake_input.override(True)
         yield from self.__controller.elevator_at_height_block()
 
-        if not tag.is_detected:
+        if not self.__controller.is_tag_detected(tag):
             raise NoTagException()
 
         self.__controller.custom_align(tag, 0, self.__controller.get_reef_target(is_left))
@@ -114,12 +114,12 @@ class MultiCoral(AutonomousSequence):
 
             self.__rotation_input.override(-0.06 * ratio)
 
-            if tag.is_detected:
+            if self.__controller.is_tag_detected(tag):
                 break
 
             yield None
 
-        while not tag.is_detected:
+        while not self.__controller.is_tag_detected(tag):
             yield None
 
     def loop(self):
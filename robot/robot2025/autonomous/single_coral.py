@@ -37,7 +37,7 @@ class SingleCoral(AutonomousSequence):
         yield from self.__controller.elevator_at_height_block()
 
         tag = AprilTagsReefscapeField.get_reef().f
-        if not tag.is_detected:
+        if not self.__controller.is_tag_detected(tag):
             print('Not detected :(')
             return
 
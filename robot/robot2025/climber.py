@@ -8,22 +8,29 @@ from wpilib import DigitalInput
 
 import wpiutil
 
+from .telemetry import read_only
+from .sensor_snapshot import SensorSnapshot, SensorReading, sensor_reading
+
 
 class Climber(Component):
     __angle_motor = None
     __angle_encoder: Encoder
     __prox: DigitalInput
+    __angle: SensorReading
+    __has_cage: SensorReading
 
     __speed: float = 0.
 
     __control_coroutine = None
 
-    def __init__(self, angle_motor: WPI_CANSparkMax, angle_encoder: Encoder, prox: DigitalInput):
+    def __init__(self, angle_motor: WPI_CANSparkMax, angle_encoder: Encoder, prox: DigitalInput, sensors: SensorSnapshot = None):
         super().__init__()
 
         self.__angle_motor = angle_motor
         self.__angle_encoder = angle_encoder
         self.__prox = prox
+        self.__angle = sensor_reading(angle_encoder.get, sensors)
+        self.__has_cage = sensor_reading(prox.get, sensors)
 
     def init(self):
         super().init()
@@ -47,7 +54,7 @@ class Climber(Component):
             yield None
 
     def get_current_angle(self) -> float:
-        return self.__angle_encoder.get()
+        return self.__angle.get()
 
     def set_speed(self, speed: float):
         self.__speed = speed
@@ -56,7 +63,7 @@ class Climber(Component):
         return self.__speed
 
     def has_cage(self):
-        return not self.__prox.get()
+        return not self.__has_cage.get()
 
     #def set_up(self):
     #    self.set_target_angle(0.273)
@@ -74,6 +81,6 @@ class Climber(Component):
         self.set_speed(0)
 
     def initSendable(self, builder: wpiutil.SendableBuilder):
-        builder.addDoubleProperty('angle', self.get_current_angle, lambda v: None)
-        builder.addDoubleProperty('speed', self.get_speed, lambda v: None)
-        builder.addBooleanProperty('has_cage', self.has_cage, lambda v: None)
+        builder.addDoubleProperty('angle', self.get_current_angle, read_only)
+        builder.addDoubleProperty('speed', self.get_speed, read_only)
+        builder.addBooleanProperty('has_cage', self.has_cage, read_only)
@@ -12,15 +12,28 @@ from .coral_outtake import CoralOuttake
 from .elevator import Elevator
 from .yeeter import Yeeter
 from .driver_station import ReefSelector
+from .pose_history import PoseHistory
+from .vision_packet import DetectionPacketReader
+from .pose_estimator import PoseEstimator, CAMERA_DEPTH_SCALE, camera_to_robot, robot_to_camera, rotation
+from .sensor_snapshot import SensorSnapshot, SensorReading, sensor_reading
 
 from enum import Enum
 from typing import List
 
+import wpilib
+
 
 CORAL_STATION_TARGET = Vector2(0, 0.54)
 REEF_LEFT_TARGET = Vector2(0.19, 0.435)
 REEF_RIGHT_TARGET = Vector2(-0.14, 0.435)
 
+# Vision frames older than this are used as is
+MAX_VISION_LATENCY = 0.5
+# A bit more than two seconds of poses at the robot loop rate
+POSE_HISTORY_CAPACITY = 128
+
+# IMU heading of the robot squarely facing every tag, used by the alignment
+# They assume the IMU reads 0 facing the reef tag 10 or 21 of the alliance, which the recalibrate button sets
 TARGET_ANGLES = {}
 
 
@@ -44,10 +57,6 @@ add_angle_pair(REFERENCE + 2.182, (1, 13))
 add_angle_pair(REFERENCE + 4.102, (2, 12))
 
 
-def tags_from_cam(tags: List[AprilTagsFieldPose], cam_id: int):
-    return [t for t in tags if t.nt.get_cam_id() == cam_id and t.is_detected]
-
-
 def power_transform(val, exp):
     return math.copysign(math.pow(min(abs(val), 1), exp), val)
 
@@ -102,6 +111,14 @@ class RobotController(Component):
     __is_climbing = False
     __swerve_speed = 1.
 
+    __pose_history: PoseHistory = None
+    __pose_estimator: PoseEstimator = None
+    __detection_reader: DetectionPacketReader = None
+    __field_position: Vector2 = None
+
+    __sensors: SensorSnapshot = None
+    __heading: SensorReading = None
+
     __ready_to_feed_event: ConcurrentEvent
     __coral_in_intake_event: ConcurrentEvent
     __coral_in_elevator_event: ConcurrentEvent
@@ -109,9 +126,11 @@ class RobotController(Component):
     __coral_shot_event: ConcurrentEvent
     __robot_aligned_event: ConcurrentEvent
 
-    def __init__(self):
+    def __init__(self, sensors: SensorSnapshot = None):
         super().__init__()
 
+        self.__sensors = sensors
+
         self.__ready_to_feed_event = ConcurrentEvent()
         self.__coral_in_intake_event = ConcurrentEvent()
         self.__coral_in_elevator_event = ConcurrentEvent()
@@ -119,10 +138,20 @@ class RobotController(Component):
         self.__coral_shot_event = ConcurrentEvent()
         self.__robot_aligned_event = ConcurrentEvent()
 
+        # Pose of the robot over time, to know where the robot was when a vision frame was captured
+        self.__pose_history = PoseHistory(POSE_HISTORY_CAPACITY)
+
+        # Field position of the robot, fused from every visible tag of both cameras
+        self.__pose_estimator = PoseEstimator()
+        self.__detection_reader = DetectionPacketReader()
+        self.__field_position = Vector2(0, 0)
+
     def init(self):
         super().__init__()
 
         self.__swerve = self.robot['Swerve']
+        if self.__heading is None:
+            self.__heading = sensor_reading(self.__swerve.get_heading, self.__sensors)
         self.__climber = self.robot['Climber']
         self.__conveyor = self.robot['Conveyor']
         self.__coral_outtake = self.robot['CoralOuttake']
@@ -156,6 +185,12 @@ class RobotController(Component):
         self.__led.set_color((255, 255, 0), 2)
 
     def update(self):
+        now = wpilib.Timer.getFPGATimestamp()
+        heading = self.__heading.get()
+
+        self.__update_pose_estimator__(now, heading)
+        self.__pose_history.append(now, self.__field_position.x, self.__field_position.y, heading)
+
         self.__coral_logic_loop = Timer.start_coroutine_if_stopped(self.__coral_logic_loop__, self.__coral_logic_loop, CoroutineOrder.EARLY, ignore_stop_all=True)
         self.__align_logic_loop = Timer.start_coroutine_if_stopped(self.__align_logic_loop__, self.__align_logic_loop, CoroutineOrder.EARLY)
         self.__climb_logic_loop = Timer.start_coroutine_if_stopped(self.__climb_logic_loop__, self.__climb_logic_loop, CoroutineOrder.EARLY)
@@ -231,9 +266,79 @@ class RobotController(Component):
     def robot_aligned_block(self):
         return self.__robot_aligned_event.create_block()
 
+    def get_pose_history(self) -> PoseHistory:
+        return self.__pose_history
+
+    def get_pose_estimator(self) -> PoseEstimator:
+        return self.__pose_estimator
+
+    def get_detection_reader(self) -> DetectionPacketReader:
+        return self.__detection_reader
+
+    def get_tag_detection(self, tag_id: int, cam_id: int):
+        # The tag in the last frame of the camera, the whole frame comes from one packet so its tags are never mixed between frames
+        frame = self.__detection_reader.get_frame(cam_id)
+        if wpilib.Timer.getFPGATimestamp() - frame.received_time > MAX_VISION_LATENCY:
+            return None
+
+        return frame.get(tag_id)
+
+    def is_tag_detected(self, tag: AprilTagsFieldPose, cam_id: int = None) -> bool:
+        cam_ids = self.__detection_reader.get_cam_ids() if cam_id is None else (cam_id,)
+        return any(self.get_tag_detection(tag.id, c) is not None for c in cam_ids)
+
+    def __tags_from_cam__(self, tags: List[AprilTagsFieldPose], cam_id: int):
+        return [t for t in tags if self.get_tag_detection(t.id, cam_id) is not None]
+
+    def __update_pose_estimator__(self, now: float, heading: float):
+        self.__pose_estimator.predict(now)
+
+        # Every camera sends a whole frame at once, only when it processed a new one
+        for frame in self.__detection_reader.update():
+            for detection in frame.detections:
+                capture_time = detection.timestamp
+                latency = now - capture_time
+                if capture_time < 0 or latency < 0 or latency > MAX_VISION_LATENCY:
+                    continue
+
+                capture_pose = self.__pose_history.sample(capture_time)
+                capture_heading = capture_pose[2] if capture_pose is not None else heading
+
+                # The tags are only positions on the field once the heading of the robot on the field is known
+                if not self.__pose_estimator.has_heading_reference():
+                    self.__pose_estimator.observe_heading(detection.tag_id, detection.pose_t, detection.pose_R, frame.cam_id, capture_heading)
+                    continue
+
+                self.__pose_estimator.update_tag(detection.tag_id, detection.x, detection.z, frame.cam_id, capture_heading, latency, now)
+
+        position = self.__pose_estimator.get_position()
+        self.__field_position = Vector2(position[0], position[1])
+
+    def __compensate_latency__(self, position: Vector2, capture_time: float, cam_id: int) -> Vector2:
+        latency = wpilib.Timer.getFPGATimestamp() - capture_time
+        if capture_time < 0 or latency < 0 or latency > MAX_VISION_LATENCY:
+            return position
+
+        capture_pose = self.__pose_history.sample(capture_time)
+        if capture_pose is None:
+            return position
+
+        capture_x, capture_y, capture_heading = capture_pose
+
+        # The tag did not move on the field, so bring it in the field frame at the capture pose
+        # then back in the robot frame at the current pose
+        field_offset = rotation(self.__pose_estimator.field_heading(capture_heading)) @ camera_to_robot(position.x, position.y, cam_id)
+        field_offset[0] -= self.__field_position.x - capture_x
+        field_offset[1] -= self.__field_position.y - capture_y
+
+        x, z = robot_to_camera(rotation(-self.__pose_estimator.field_heading(self.__heading.get())) @ field_offset, cam_id)
+        return Vector2(x, z)
+
     def __evaluate_reef_tag_score__(self, tag: AprilTagsFieldPose):
-        distance = tag.relative_position.magnitude
-        angle = abs(delta_angle(self.__swerve.get_heading(), TARGET_ANGLES[tag.id]))
+        # Only called on the tags seen by the camera 0
+        detection = self.get_tag_detection(tag.id, 0)
+        distance = math.hypot(detection.x, detection.z)
+        angle = abs(delta_angle(self.__heading.get(), TARGET_ANGLES[tag.id]))
 
         return (distance * math.sin(angle)) + 0.75 * angle
 
@@ -259,6 +364,7 @@ class RobotController(Component):
 
             self.__coral_in_intake_event.set()
             self.__swerve.set_local_offset(math.pi)
+            self.__heading.invalidate()
             self.__conveyor.feed_coral(0)
 
             yield from self.__elevator.wait_for_height()
@@ -300,6 +406,8 @@ class RobotController(Component):
 
     def __align_logic_loop__(self):
         selected_tag = None
+        selected_cam_id = -1
+        last_detection = None
         target_pos = None
         rotation_offset = 0.
 
@@ -328,26 +436,29 @@ class RobotController(Component):
                 self.__target_error = None
 
                 if self.__align_tag is not None:
-                    if self.__align_tag.is_detected and self.__align_tag.nt.get_cam_id() == self.__align_cam_id:
+                    if self.get_tag_detection(self.__align_tag.id, self.__align_cam_id) is not None:
                         selected_tag = self.__align_tag
+                        selected_cam_id = self.__align_cam_id
                         rotation_offset = math.pi if self.__align_cam_id == 0 else 0
                         target_pos = self.__align_position
                 elif self.__align_target == AlignTarget.CORAL_STATION:
                     # Get all the detected coral station tag from the cam with id 1
-                    tags = tags_from_cam(AprilTagsReefscapeField.get_coral_station().all, 1)
+                    tags = self.__tags_from_cam__(AprilTagsReefscapeField.get_coral_station().all, 1)
                     if len(tags) > 0:
                         selected_tag = tags[0]
+                        selected_cam_id = 1
                         rotation_offset = 0.
                         target_pos = CORAL_STATION_TARGET
                 elif self.__align_target == AlignTarget.REEF:
                     # Get all the detected reef tag from the cam with id 0
-                    tags = tags_from_cam(AprilTagsReefscapeField.get_reef().all, 0)
+                    tags = self.__tags_from_cam__(AprilTagsReefscapeField.get_reef().all, 0)
                     if len(tags) > 0:
                         # Select the closest tag if multiple tags are detected
                         # selected_tag = min(tags, key=lambda k: k.relative_position.magnitude)
                         # selected_tag = min(tags,
                         #                   key=lambda k: (k.center / Vector2(800., 652) - Vector2(0.5, 0.5)).magnitude)
                         selected_tag = min(tags, key=self.__evaluate_reef_tag_score__)
+                        selected_cam_id = 0
                         rotation_offset = math.pi
 
                         # Align on the selected side of the reef
@@ -357,16 +468,29 @@ class RobotController(Component):
                             target_pos = REEF_RIGHT_TARGET
                 elif self.__align_target == AlignTarget.CUSTOM:
                     # Check if the tag is detected by the correct camera
-                    if self.__align_tag.is_detected and self.__align_tag.nt.get_cam_id() == self.__align_cam_id:
+                    if self.get_tag_detection(self.__align_tag.id, self.__align_cam_id) is not None:
                         selected_tag = self.__align_tag
+                        selected_cam_id = self.__align_cam_id
                         rotation_offset = math.pi if self.__align_cam_id == 0 else 0
                         target_pos = self.__align_position
 
             if selected_tag is not None:
-                if selected_tag.is_detected:
+                # Servo on the fused pose when available, it survives the selected tag flickering out
+                fused = self.__pose_estimator.is_valid(wpilib.Timer.getFPGATimestamp())
+
+                detection = self.get_tag_detection(selected_tag.id, selected_cam_id)
+                if detection is not None:
+                    last_detection = detection
+
+                if detection is not None or fused:
                     last_seen = Timer.get_current_time()
 
-                position = Vector2(selected_tag.relative_position.x, selected_tag.relative_position.z * 0.866)
+                if fused:
+                    position = Vector2(*self.__pose_estimator.tag_in_camera(selected_tag.id, self.__heading.get(), selected_cam_id))
+                else:
+                    # Position and capture time come from the same packet
+                    position = Vector2(last_detection.x, last_detection.z * CAMERA_DEPTH_SCALE)
+                    position = self.__compensate_latency__(position, last_detection.timestamp, selected_cam_id)
                 tag_angle = TARGET_ANGLES[selected_tag.id]
 
                 if self.__target_position is None:
@@ -378,7 +502,7 @@ class RobotController(Component):
                 #else:
                 #    self.__target_position = self.__target_position * 0.95 + position * 0.05
 
-                error_angle = delta_angle(self.__swerve.get_heading(), tag_angle)
+                error_angle = delta_angle(self.__heading.get(), tag_angle)
                 error_position = position - self.__target_position
 
                 real_error_position = position - target_pos
@@ -406,7 +530,7 @@ class RobotController(Component):
                 translation.y = math.copysign(max(min_y, abs(translation.y)), translation.y)
 
                 # Convert translation from local to world coordinate system
-                translation = translation.rotate(self.__swerve.get_heading() + rotation_offset - error_angle)
+                translation = translation.rotate(self.__heading.get() + rotation_offset - error_angle)
 
                 # Apply commands to swerve drive
                 self.__vertical_input.override(translation.x / self.__swerve_speed)
@@ -484,3 +608,5 @@ class RobotController(Component):
             if Timer.get_elapsed(start_time) >= 0.5:
                 print('Recalibrating')
                 self.__swerve.set_current_heading(0)
+                self.__heading.invalidate()
+                self.__pose_estimator.reset_heading_reference()
@@ -4,19 +4,24 @@ from wpilib import DigitalInput
 
 import wpiutil
 
+from .telemetry import read_only
+from .sensor_snapshot import SensorSnapshot, SensorReading, sensor_reading
+
 
 class Conveyor(Component):
     __motor: WPI_CANSparkMax
     __prox: DigitalInput
+    __prox_reading: SensorReading
 
-    def __init__(self, motor: WPI_CANSparkMax, prox: DigitalInput):
+    def __init__(self, motor: WPI_CANSparkMax, prox: DigitalInput, sensors: SensorSnapshot = None):
         super().__init__()
 
         self.__motor = motor
         self.__prox = prox
+        self.__prox_reading = sensor_reading(prox.get, sensors)
 
     def has_coral(self):
-        return not self.__prox.get()
+        return not self.__prox_reading.get()
 
     def wait_for_coral(self):
         yield from ()
@@ -35,4 +40,4 @@ class Conveyor(Component):
         self.__motor.set(0)
 
     def initSendable(self, builder: wpiutil.SendableBuilder):
-        builder.addBooleanProperty('has_coral', self.has_coral, lambda v: None)
+        builder.addBooleanProperty('has_coral', self.has_coral, read_only)
@@ -1,5 +1,3 @@
-import math
-
 from frctools import Component, Timer, CoroutineOrder, WPI_CANSparkFlex
 from frctools.sensor import Encoder
 from frctools.controll import PID, LeakyIntegrator
@@ -9,6 +7,11 @@ from wpilib import DigitalInput, SmartDashboard
 
 import wpiutil
 
+from .motion_profile import TrapezoidProfile, ElevatorFeedforward
+from .spark_position import SparkFlexPositionLoop
+from .telemetry import read_only
+from .sensor_snapshot import SensorSnapshot, SensorReading, sensor_reading
+
 FEEDING_HEIGHT = 0.042
 STAGES_HEIGHT = [
     0.221,
@@ -17,19 +20,50 @@ STAGES_HEIGHT = [
     0.95,
 ]
 
+# Limits of the motion profile, in height units per second
+MAX_VELOCITY = 1.5
+MAX_ACCELERATION = 4.
+
+# Feed-forward gains, the feed-forward is in motor output (-1 to 1) like the output of the PID it is added to
+# The height is in the units of the elevator encoder, the same as STAGES_HEIGHT
+# The gravity gain is the middle of the old constant feed-forward (1 up, -0.5 down), the others are to be characterized
+FEEDFORWARD_KS = 0.02  # motor output
+FEEDFORWARD_KG = 0.25  # motor output
+FEEDFORWARD_KV = 0.5  # motor output per height unit per second
+FEEDFORWARD_KA = 0.05  # motor output per height unit per second squared
+
+# Smoothing of the error used to know when the elevator is at its target, so the encoder noise does not make it flicker
+ERROR_LAMBDA = 0.85
+
+# Gains of the position loop when it runs on the motor controller, in motor output per height unit like the python PID
+ONBOARD_KP = 9.
+ONBOARD_KI = 0.
+ONBOARD_KD = 0.
+ONBOARD_TOLERANCE = 0.0025
+
+# Soft limits of the onboard loop until a limit switch gives the real end of the travel
+REVERSE_SOFT_LIMIT = 0.
+FORWARD_SOFT_LIMIT = max(STAGES_HEIGHT) + 0.02
+
 
 class Elevator(Component):
     __motor: WPI_CANSparkFlex = None
     __encoder: Encoder = None
     __controller: PID = None
+    __profile: TrapezoidProfile = None
+    __feedforward: ElevatorFeedforward = None
+    __onboard_loop: SparkFlexPositionLoop = None
     __top_limit_switch: DigitalInput = None
     __bottom_limit_switch: DigitalInput = None
+    __height: SensorReading = None
+    __top_limit: SensorReading = None
+    __bottom_limit: SensorReading = None
 
     __target_height: float = 0.
-    __target_height_smooth: float = 0.
-    __target_leaky: LeakyIntegrator = LeakyIntegrator()
-    __error_leaky: LeakyIntegrator = LeakyIntegrator()
-    __error_moving_average: float = 0.
+    __profile_start_time: float = 0.
+    __setpoint = None
+    __error_leaky: LeakyIntegrator = None
+    __error_lambda: float = ERROR_LAMBDA
 
     __control_coroutine = None
 
@@ -40,59 +74,98 @@ class Elevator(Component):
                  elevator_encoder: Encoder,
                  controller: PID,
                  top_limit_switch: DigitalInput = None,
-                 bottom_limit_switch: DigitalInput = None):
+                 bottom_limit_switch: DigitalInput = None,
+                 profile: TrapezoidProfile = None,
+                 feedforward: ElevatorFeedforward = None,
+                 sensors: SensorSnapshot = None):
         super().__init__()
 
         self.__motor = elevator_motor
         self.__encoder = elevator_encoder
         self.__controller = controller
+        self.__profile = TrapezoidProfile(MAX_VELOCITY, MAX_ACCELERATION) if profile is None else profile
+        self.__feedforward = ElevatorFeedforward(FEEDFORWARD_KS, FEEDFORWARD_KG, FEEDFORWARD_KV, FEEDFORWARD_KA) if feedforward is None else feedforward
         self.__top_limit_switch = top_limit_switch
         self.__bottom_limit_switch = bottom_limit_switch
+        self.__height = sensor_reading(self.__encoder.get, sensors)
+        self.__top_limit = sensor_reading(top_limit_switch.get, sensors) if top_limit_switch is not None else None
+        self.__bottom_limit = sensor_reading(bottom_limit_switch.get, sensors) if bottom_limit_switch is not None else None
+        self.__error_leaky = LeakyIntegrator()
+
+        # A motor running its own position loop only gets the target, the python PID is left out
+        self.__onboard_loop = elevator_motor if isinstance(elevator_motor, SparkFlexPositionLoop) else None
+        self.__forward_limit = FORWARD_SOFT_LIMIT
+        if self.__onboard_loop is not None:
+            self.__configure_onboard_loop__()
 
         self.__control_coroutine = None
 
         SmartDashboard.putData('Elevator/pid', self.__controller)
 
-        self.__target_lambda = 0.9
-        self.__error_lambda = 0.85
-
     def init(self):
         if not self.__first_run:
             self.__target_height = self.get_current_height()
-            self.__target_leaky.current = self.__target_height
             self.__first_run = True
 
+        # The elevator may have moved while disabled, restart the profile from where it really is
+        self.__plan_profile__(self.get_current_height(), 0.)
         self.__error_leaky.current = abs(self.true_error())
 
-    def update(self):
-        self.__target_leaky.evaluate(self.__target_height, self.__target_lambda)
-        self.__error_leaky.evaluate(abs(self.true_error()), self.__error_lambda)
+        if self.__onboard_loop is not None:
+            self.__onboard_loop.seed_position(self.get_current_height())
+            self.__onboard_loop.reset_reference()
 
+    def update(self):
         self.__control_coroutine = Timer.start_coroutine_if_stopped(self.__control_loop__, self.__control_coroutine, CoroutineOrder.LATE)
 
+    def __plan_profile__(self, height: float, velocity: float):
+        self.__profile.plan(height, velocity, self.__target_height)
+        self.__profile_start_time = Timer.get_current_time()
+        self.__setpoint = self.__profile.sample(0.)
+
+    def __profile_time__(self) -> float:
+        return Timer.get_elapsed(self.__profile_start_time)
+
+    def __configure_onboard_loop__(self):
+        self.__onboard_loop.configure(ONBOARD_KP, ONBOARD_KI, ONBOARD_KD,
+                                      self.__profile.max_velocity, self.__profile.max_acceleration, ONBOARD_TOLERANCE,
+                                      REVERSE_SOFT_LIMIT, self.__forward_limit)
+
+    def __update_onboard_loop__(self):
+        # The limit switch is wired to the roboRIO, the top of the travel it finds becomes the soft limit of the motor
+        if self.get_top_limit() and self.__onboard_loop.get_position() < self.__forward_limit:
+            self.__forward_limit = self.__onboard_loop.get_position()
+            self.__onboard_loop.set_forward_limit(self.__forward_limit)
+
+        # The motor runs the same profile, python keeps its own copy to know when the move is done
+        self.__onboard_loop.set_position(self.__target_height, self.__feedforward.kg)
+
     def __control_loop__(self):
         while True:
-            if not self.is_at_target():
-                error = self.error()
-                error_sign = math.copysign(1, error)
-                if error_sign == 1:
-                    ff = 1
-                else:
-                    ff = -0.5
-
-                out = self.__controller.evaluate(error, ff)
-
-                min_val = -1
-                max_val = 1
-                if self.get_top_limit():
-                    max_val = 0
-                if self.get_bottom_limit():
-                    min_val = 0
-
-                self.__motor.set(clamp(out, min_val, max_val))
-            else:
+            self.__setpoint = self.__profile.sample(self.__profile_time__())
+            self.__error_leaky.evaluate(abs(self.true_error()), self.__error_lambda)
+
+            if self.__onboard_loop is not None:
+                self.__update_onboard_loop__()
+                yield None
+                continue
+
+            # Follow the setpoint of the profile, the feed-forward does most of the work and the PID only corrects the error
+            if self.__profile.is_finished(self.__profile_time__()) and self.is_at_target():
                 self.__controller.reset_integral()
-                self.__motor.set(0)
+
+            # Both the feed-forward and the PID are in motor output, the feed-forward is added to the PID as is
+            ff = self.__feedforward.calculate(self.__setpoint.velocity, self.__setpoint.acceleration)
+            out = self.__controller.evaluate(self.error(), ff)
+
+            min_val = -1
+            max_val = 1
+            if self.get_top_limit():
+                max_val = 0
+            if self.get_bottom_limit():
+                min_val = 0
+
+            self.__motor.set(clamp(out, min_val, max_val))
 
             yield None
 
@@ -113,17 +186,24 @@ class Elevator(Component):
         self.set_target_height(STAGES_HEIGHT[stage])
 
     def set_target_height(self, height: float):
+        # The target is set on every loop by the controller, only a new target starts a new profile
+        if self.__setpoint is not None and approximately(height, self.__target_height, 1e-6):
+            return
+
         self.__target_height = height
-        self.__error_leaky.current = self.error()
+
+        # Start from the current setpoint so the motor output does not jump in the middle of a move
+        if self.__setpoint is not None:
+            self.__plan_profile__(self.__setpoint.position, self.__setpoint.velocity)
 
     def get_current_height(self) -> float:
-        return self.__encoder.get()
+        return self.__height.get()
 
     def hold_height(self):
         self.set_target_height(self.get_current_height())
 
     def is_at_target(self, tolerance: float = 0.0025) -> bool:
-        return approximately(self.__error_leaky.current, 0, tolerance)
+        return self.__profile.is_finished(self.__profile_time__()) and approximately(self.__error_leaky.current, 0, tolerance)
 
     def wait_for_height(self, tolerance: float = 0.0025):
         yield from ()
@@ -131,33 +211,51 @@ class Elevator(Component):
             yield None
 
     def error(self) -> float:
-        return self.__target_leaky.current - self.get_current_height()
+        setpoint = self.__target_height if self.__setpoint is None else self.__setpoint.position
+        return setpoint - self.get_current_height()
 
     def true_error(self) -> float:
         return self.__target_height - self.get_current_height()
 
     def get_top_limit(self) -> bool:
-        return self.__top_limit_switch is not None and self.__top_limit_switch.get()
+        return self.__top_limit is not None and self.__top_limit.get()
 
     def get_bottom_limit(self) -> bool:
-        return self.__bottom_limit_switch is not None and self.__bottom_limit_switch.get()
+        return self.__bottom_limit is not None and self.__bottom_limit.get()
 
-    def __set_target_lambda__(self, l: float):
-        self.__target_lambda = l
+    def get_setpoint(self):
+        return self.__setpoint
 
     def __set_error_lambda__(self, l: float):
         self.__error_lambda = l
 
+    def __set_max_velocity__(self, v: float):
+        self.__profile.max_velocity = v
+        if self.__onboard_loop is not None:
+            self.__configure_onboard_loop__()
+
+    def __set_max_acceleration__(self, a: float):
+        self.__profile.max_acceleration = a
+        if self.__onboard_loop is not None:
+            self.__configure_onboard_loop__()
+
     def initSendable(self, builder: wpiutil.SendableBuilder):
-        builder.addDoubleProperty('height', self.get_current_height, lambda v: None)
-        builder.addDoubleProperty('height_raw', self.__encoder.get_raw, lambda v: None)
+        builder.addDoubleProperty('height', self.get_current_height, read_only)
+        builder.addDoubleProperty('height_raw', self.__encoder.get_raw, read_only)
         builder.addDoubleProperty('target_height', lambda: self.__target_height, self.set_target_height)
-        builder.addDoubleProperty('error', self.error, lambda v: None)
-        builder.addDoubleProperty('true_error', self.true_error, lambda v: None)
-        builder.addDoubleProperty('smooth_error', lambda: self.__error_leaky.current, lambda v: None)
-        builder.addBooleanProperty('top_limit', self.get_top_limit, lambda v: None)
-        builder.addBooleanProperty('bottom_limit', self.get_bottom_limit, lambda v: None)
-        builder.addBooleanProperty('at_height', self.is_at_target, lambda v: None)
-
-        builder.addDoubleProperty('target_lambda', lambda: self.__target_lambda, self.__set_target_lambda__)
+        builder.addDoubleProperty('error', self.error, read_only)
+        builder.addDoubleProperty('true_error', self.true_error, read_only)
+        builder.addDoubleProperty('setpoint_height', lambda: self.__setpoint.position if self.__setpoint is not None else self.__target_height, read_only)
+        builder.addDoubleProperty('setpoint_velocity', lambda: self.__setpoint.velocity if self.__setpoint is not None else 0., read_only)
+        builder.addBooleanProperty('top_limit', self.get_top_limit, read_only)
+        builder.addBooleanProperty('bottom_limit', self.get_bottom_limit, read_only)
+        builder.addBooleanProperty('at_height', self.is_at_target, read_only)
+        builder.addDoubleProperty('smooth_error', lambda: self.__error_leaky.current, read_only)
         builder.addDoubleProperty('error_lambda', lambda: self.__error_lambda, self.__set_error_lambda__)
+
+        builder.addDoubleProperty('max_velocity', lambda: self.__profile.max_velocity, self.__set_max_velocity__)
+        builder.addDoubleProperty('max_acceleration', lambda: self.__profile.max_acceleration, self.__set_max_acceleration__)
+        builder.addDoubleProperty('ks', lambda: self.__feedforward.ks, lambda v: setattr(self.__feedforward, 'ks', v))
+        builder.addDoubleProperty('kg', lambda: self.__feedforward.kg, lambda v: setattr(self.__feedforward, 'kg', v))
+        builder.addDoubleProperty('kv', lambda: self.__feedforward.kv, lambda v: setattr(self.__feedforward, 'kv', v))
+        builder.addDoubleProperty('ka', lambda: self.__feedforward.ka, lambda v: setattr(self.__feedforward, 'ka', v))
@@ -0,0 +1,182 @@
+import inspect
+import time
+
+import numpy as np
+
+from frctools import Timer
+from ntcore import NetworkTableInstance
+
+
+# Samples kept for every measured function
+PROFILE_CAPACITY = 256
+# Only the slowest functions by p99 are published
+PROFILE_TOP_COUNT = 10
+PROFILE_PERIOD = 1.
+PROFILE_TABLE = '/profiler'
+
+# Group of the coroutines started without an order
+DEFAULT_GROUP = 'DEFAULT'
+# Parameter of Timer.start_coroutine_if_stopped giving the CoroutineOrder of a coroutine
+ORDER_PARAMETER = 'order'
+
+
+class TimingRing:
+    # Last durations of a function in a fixed ring, in seconds, only summarized when published
+    def __init__(self, capacity: int = PROFILE_CAPACITY):
+        self.__samples = np.zeros(capacity, dtype=np.float64)
+        self.__index = 0
+        self.__count = 0
+
+    def add(self, elapsed: float):
+        self.__samples[self.__index] = elapsed
+        self.__index = (self.__index + 1) % len(self.__samples)
+        self.__count = min(self.__count + 1, len(self.__samples))
+
+    def summary(self):
+        # p50, p99 and max in milliseconds
+        if self.__count == 0:
+            return 0., 0., 0.
+
+        samples = self.__samples[:self.__count]
+        p50, p99 = np.percentile(samples, (50, 99))
+        return float(p50) * 1000, float(p99) * 1000, float(samples.max()) * 1000
+
+
+class ProfiledBuilder:
+    # Stands in for the SendableBuilder of a component so every property getter is measured
+    def __init__(self, builder, profiler: 'LoopProfiler', prefix: str):
+        self.__builder = builder
+        self.__profiler = profiler
+        self.__prefix = prefix
+
+    def __getattr__(self, name: str):
+        method = getattr(self.__builder, name)
+        if not (name.startswith('add') and name.endswith('Property')):
+            return method
+
+        def add_property(key, getter, *args, **kwargs):
+            if getter is not None:
+                getter = self.__profiler.profile_function(f'{self.__prefix}.{key}', 'property', getter)
+            return method(key, getter, *args, **kwargs)
+
+        return add_property
+
+
+class LoopProfiler:
+    # Wall time of every coroutine step, Component.update and dashboard property getter
+    # A measure is two clock reads and a ring write, so it stays enabled in matches
+    def __init__(self, nt: NetworkTableInstance = None, top_count: int = PROFILE_TOP_COUNT, period: float = PROFILE_PERIOD):
+        nt = NetworkTableInstance.getDefault() if nt is None else nt
+
+        self.__table = nt.getTable(PROFILE_TABLE)
+        self.__top_count = top_count
+        self.__period = period
+        self.__last_publish = -period
+
+        self.__rings = {}
+
+    def record(self, name: str, group: str, elapsed: float):
+        # A function started under different orders is measured separately in each of them
+        key = (name, group)
+        ring = self.__rings.get(key)
+        if ring is None:
+            ring = TimingRing()
+            self.__rings[key] = ring
+
+        ring.add(elapsed)
+
+    def profile_function(self, name: str, group: str, fn):
+        def profiled(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(name, group, time.perf_counter() - start)
+
+        return profiled
+
+    def profile_generator(self, name: str, group: str, generator):
+        # Runs the generator one step at a time and measures every step, the values sent and thrown in go through
+        step = generator.send
+        value = None
+        while True:
+            start = time.perf_counter()
+            try:
+                result = step(value)
+            except StopIteration as e:
+                return e.value
+            finally:
+                self.record(name, group, time.perf_counter() - start)
+
+            try:
+                value = yield result
+                step = generator.send
+            except GeneratorExit:
+                generator.close()
+                raise
+            except BaseException as e:
+                value = e
+                step = generator.throw
+
+    def install(self):
+        # Every coroutine started through the Timer gets its steps measured, grouped by their CoroutineOrder
+        # The order is found by the name of its parameter, without it the coroutines are still measured but all grouped as default
+        start_coroutine_if_stopped = Timer.start_coroutine_if_stopped
+        parameters = inspect.signature(start_coroutine_if_stopped).parameters
+        if ORDER_PARAMETER in parameters:
+            order_index = list(parameters).index(ORDER_PARAMETER)
+            order_default = parameters[ORDER_PARAMETER].default
+        else:
+            print(f'Warning: Timer.start_coroutine_if_stopped has no {ORDER_PARAMETER} parameter, the coroutines are grouped as {DEFAULT_GROUP}')
+            order_index = None
+            order_default = None
+
+        profiler = self
+
+        def profiled_start(fn, *args, **kwargs):
+            if order_index is None:
+                order = None
+            elif ORDER_PARAMETER in kwargs:
+                order = kwargs[ORDER_PARAMETER]
+            elif len(args) >= order_index:
+                order = args[order_index - 1]
+            else:
+                order = order_default
+
+            group = DEFAULT_GROUP if order is None or order is inspect.Parameter.empty else getattr(order, 'name', str(order))
+            name = getattr(fn, '__qualname__', repr(fn))
+
+            def profiled_coroutine(*fn_args, **fn_kwargs):
+                return (yield from profiler.profile_generator(name, group, fn(*fn_args, **fn_kwargs)))
+
+            return start_coroutine_if_stopped(profiled_coroutine, *args, **kwargs)
+
+        Timer.start_coroutine_if_stopped = staticmethod(profiled_start)
+
+    def profile_component(self, name: str, component):
+        # Must be done before the component is sent to the dashboard so its properties are measured
+        component.update = self.profile_function(f'{name}.update', 'update', component.update)
+
+        init_sendable = component.initSendable
+        component.initSendable = lambda builder: init_sendable(ProfiledBuilder(builder, self, name))
+
+    def get_summary(self):
+        # (name, group, p50, p99, max) of every measured function, the slowest first
+        summary = [(name, group) + ring.summary() for (name, group), ring in self.__rings.items()]
+        summary.sort(key=lambda entry: entry[3], reverse=True)
+
+        return summary
+
+    def publish(self):
+        now = time.monotonic()
+        if now - self.__last_publish < self.__period:
+            return
+        self.__last_publish = now
+
+        top = self.get_summary()[:self.__top_count]
+
+        self.__table.putStringArray('names', [entry[0] for entry in top])
+        self.__table.putStringArray('groups', [entry[1] for entry in top])
+        self.__table.putNumberArray('p50_ms', [entry[2] for entry in top])
+        self.__table.putNumberArray('p99_ms', [entry[3] for entry in top])
+        self.__table.putNumberArray('max_ms', [entry[4] for entry in top])
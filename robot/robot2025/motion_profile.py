@@ -0,0 +1,114 @@
+import math
+
+from typing import NamedTuple
+
+
+class ProfileState(NamedTuple):
+    position: float
+    velocity: float
+    acceleration: float
+
+
+class TrapezoidProfile:
+    # Time parameterized move to a goal with a velocity and an acceleration limit
+    # A profile can start at any velocity, so a new goal can be set in the middle of a move without a jump of the setpoint
+    def __init__(self, max_velocity: float, max_acceleration: float):
+        self.max_velocity = max_velocity
+        self.max_acceleration = max_acceleration
+
+        # Segments of constant acceleration: start time, position, velocity and acceleration
+        self.__segments = []
+        self.__duration = 0.
+        self.__goal = 0.
+
+    @property
+    def goal(self) -> float:
+        return self.__goal
+
+    @property
+    def duration(self) -> float:
+        return self.__duration
+
+    def is_finished(self, t: float) -> bool:
+        return t >= self.__duration
+
+    def plan(self, position: float, velocity: float, goal: float):
+        self.__goal = goal
+        self.__segments = []
+        self.__duration = 0.
+
+        self.__plan__(position, velocity, goal)
+
+    def __add_segment__(self, position: float, velocity: float, duration: float, acceleration: float):
+        # Returns the state at the end of the segment
+        if duration > 0:
+            self.__segments.append((self.__duration, position, velocity, acceleration))
+            self.__duration += duration
+
+        return position + velocity * duration + 0.5 * acceleration * duration ** 2, velocity + acceleration * duration
+
+    def __plan__(self, position: float, velocity: float, goal: float):
+        a = self.max_acceleration
+        v_max = self.max_velocity
+
+        # Work with a positive move, the segments are flipped back when added
+        direction = math.copysign(1., goal - position if goal != position else -velocity)
+        distance = (goal - position) * direction
+        v = velocity * direction
+
+        # Moving away from the goal, stop first
+        if v < 0:
+            position, velocity = self.__add_segment__(position, velocity, -v / a, a * direction)
+            distance = (goal - position) * direction
+            v = 0.
+
+        # Too fast to stop at the goal, stop past it then come back
+        if v * v / (2 * a) > distance:
+            position, velocity = self.__add_segment__(position, velocity, v / a, -a * direction)
+            if position != goal:
+                self.__plan__(position, 0., goal)
+            return
+
+        if v > v_max:
+            # Slow down to the max velocity, the goal is still far enough to stop from there
+            position, velocity = self.__add_segment__(position, velocity, (v - v_max) / a, -a * direction)
+            distance = (goal - position) * direction
+            v = v_max
+
+        # Peak velocity of a triangle profile, capped into a trapezoid
+        v_peak = min(math.sqrt(a * distance + v * v / 2), v_max)
+        accel_distance = (v_peak * v_peak - v * v) / (2 * a)
+        decel_distance = v_peak * v_peak / (2 * a)
+        cruise_time = max(0., distance - accel_distance - decel_distance) / v_peak if v_peak > 0 else 0.
+
+        position, velocity = self.__add_segment__(position, velocity, (v_peak - v) / a, a * direction)
+        position, velocity = self.__add_segment__(position, velocity, cruise_time, 0.)
+        self.__add_segment__(position, velocity, v_peak / a, -a * direction)
+
+    def sample(self, t: float) -> ProfileState:
+        if t >= self.__duration or len(self.__segments) == 0:
+            return ProfileState(self.__goal, 0., 0.)
+
+        # At most a handful of segments
+        start_time, position, velocity, acceleration = self.__segments[0]
+        for segment in self.__segments:
+            if segment[0] > t:
+                break
+            start_time, position, velocity, acceleration = segment
+
+        dt = max(0., t - start_time)
+        return ProfileState(position + velocity * dt + 0.5 * acceleration * dt * dt, velocity + acceleration * dt, acceleration)
+
+
+class ElevatorFeedforward:
+    # Motor output needed to follow a setpoint: static friction, gravity, velocity and acceleration terms
+    # The gains are in motor output (-1 to 1) per unit of the elevator height
+    def __init__(self, ks: float, kg: float, kv: float, ka: float = 0.):
+        self.ks = ks
+        self.kg = kg
+        self.kv = kv
+        self.ka = ka
+
+    def calculate(self, velocity: float, acceleration: float = 0.) -> float:
+        static = math.copysign(self.ks, velocity) if velocity != 0 else 0.
+        return static + self.kg + self.kv * velocity + self.ka * acceleration
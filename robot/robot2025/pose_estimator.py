@@ -0,0 +1,207 @@
+import math
+
+import numpy as np
+
+from robotpy_apriltag import AprilTagFieldLayout, AprilTagField
+
+
+# Yaw of every camera on the robot, 0 is looking forward
+CAMERA_YAWS = {
+    0: math.pi,
+    1: 0.,
+}
+# The cameras are tilted, this brings their depth back to the floor plane
+CAMERA_DEPTH_SCALE = 0.866
+
+# Measurement noise (m) of a tag, grows with its distance
+LATERAL_NOISE = (0.01, 0.02)
+DEPTH_NOISE = (0.02, 0.05)
+
+# Process noise of the constant velocity model (m/s^2)
+ACCELERATION_NOISE = 3.
+# Velocity decay (1/s) so the prediction does not drift away without vision
+VELOCITY_DECAY = 2.
+
+# Chi-square gate with 2 degrees of freedom at 99%
+OUTLIER_GATE = 9.21
+
+# The estimate is only trusted for this long without vision
+VALID_TIME = 1.
+
+# Tag observations averaged into the IMU to field heading offset before the tags are used as position measurements
+HEADING_REFERENCE_SAMPLES = 10
+# Only the tags seen this close (m) give their orientation, farther ones are too noisy
+HEADING_REFERENCE_DISTANCE = 2.
+
+
+def rotation(angle: float) -> np.ndarray:
+    c = math.cos(angle)
+    s = math.sin(angle)
+    return np.array([[c, -s], [s, c]], dtype=np.float64)
+
+
+def wrap_angle(angle: float) -> float:
+    return (angle + math.pi) % (2 * math.pi) - math.pi
+
+
+def camera_to_robot(x: float, z: float, cam_id: int) -> np.ndarray:
+    # Camera x is to the right and z is forward, the robot frame has x forward and y to the left
+    yaw = CAMERA_YAWS[cam_id]
+    forward = np.array([math.cos(yaw), math.sin(yaw)])
+    right = np.array([math.sin(yaw), -math.cos(yaw)])
+
+    return forward * z + right * x
+
+
+def robot_to_camera(p: np.ndarray, cam_id: int):
+    yaw = CAMERA_YAWS[cam_id]
+    z = p[0] * math.cos(yaw) + p[1] * math.sin(yaw)
+    x = p[0] * math.sin(yaw) - p[1] * math.cos(yaw)
+
+    return x, z
+
+
+class PoseEstimator:
+    # Kalman filter of the robot position on the field (state: x, y, vx, vy)
+    # The heading comes from the IMU and every visible tag of every camera is a position measurement
+    # Nothing else is fused, between two tags the position only follows the constant velocity model
+    # The IMU to field heading offset is measured from the orientation of the tags seen by the cameras
+    def __init__(self, field: AprilTagField = AprilTagField.k2025ReefscapeWelded):
+        layout = AprilTagFieldLayout.loadField(field)
+
+        self.__tags = {}
+        for tag in layout.getTags():
+            self.__tags[tag.ID] = (np.array([tag.pose.X(), tag.pose.Y()], dtype=np.float64), tag.pose.rotation().Z())
+
+        self.__state = np.zeros(4, dtype=np.float64)
+        self.__covariance = np.diag([100., 100., 1., 1.])
+
+        self.__heading_offset = 0.
+        self.__heading_samples = np.zeros(2, dtype=np.float64)
+        self.__heading_sample_count = 0
+        self.__last_time = None
+        self.__last_update = -math.inf
+
+    def reset(self):
+        self.__state[:] = 0
+        self.__covariance = np.diag([100., 100., 1., 1.])
+        self.__last_update = -math.inf
+
+    def reset_heading_reference(self):
+        # The IMU heading changed base, the offset has to be measured again
+        self.__heading_samples[:] = 0
+        self.__heading_sample_count = 0
+
+    def has_heading_reference(self) -> bool:
+        return self.__heading_sample_count >= HEADING_REFERENCE_SAMPLES
+
+    def observe_heading(self, tag_id: int, pose_t: np.ndarray, pose_R: np.ndarray, cam_id: int, capture_heading: float) -> bool:
+        # The tag z axis points into the tag, its yaw in the camera gives the field heading of the camera
+        if self.has_heading_reference() or tag_id not in self.__tags or cam_id not in CAMERA_YAWS:
+            return False
+        if not np.all(np.isfinite(pose_R)) or float(np.linalg.norm(pose_t)) > HEADING_REFERENCE_DISTANCE:
+            return False
+
+        _, tag_yaw = self.__tags[tag_id]
+        tag_in_camera = math.atan2(float(pose_R[0, 2]), float(pose_R[2, 2]))
+        offset = tag_yaw + math.pi + tag_in_camera - CAMERA_YAWS[cam_id] - capture_heading
+
+        # Averaged on the circle so offsets around +-pi do not cancel out
+        self.__heading_samples += (math.cos(offset), math.sin(offset))
+        self.__heading_sample_count += 1
+        self.__heading_offset = math.atan2(self.__heading_samples[1], self.__heading_samples[0])
+
+        return True
+
+    def field_heading(self, heading: float) -> float:
+        return heading + self.__heading_offset
+
+    def is_valid(self, now: float) -> bool:
+        return now - self.__last_update <= VALID_TIME
+
+    def get_position(self) -> np.ndarray:
+        return self.__state[:2].copy()
+
+    def get_velocity(self) -> np.ndarray:
+        return self.__state[2:].copy()
+
+    def predict(self, now: float):
+        if self.__last_time is None:
+            self.__last_time = now
+            return
+
+        dt = now - self.__last_time
+        self.__last_time = now
+        if dt <= 0:
+            return
+
+        decay = math.exp(-VELOCITY_DECAY * dt)
+        f = np.array([
+            [1, 0, dt, 0],
+            [0, 1, 0, dt],
+            [0, 0, decay, 0],
+            [0, 0, 0, decay]
+        ], dtype=np.float64)
+
+        # Discrete white noise acceleration
+        q_pos = dt ** 4 / 4
+        q_cross = dt ** 3 / 2
+        q_vel = dt ** 2
+        q = np.array([
+            [q_pos, 0, q_cross, 0],
+            [0, q_pos, 0, q_cross],
+            [q_cross, 0, q_vel, 0],
+            [0, q_cross, 0, q_vel]
+        ], dtype=np.float64) * ACCELERATION_NOISE ** 2
+
+        self.__state = f @ self.__state
+        self.__covariance = f @ self.__covariance @ f.T + q
+
+    def update_tag(self, tag_id: int, x: float, z: float, cam_id: int, capture_heading: float, latency: float, now: float) -> bool:
+        if tag_id not in self.__tags or cam_id not in CAMERA_YAWS:
+            return False
+
+        tag_position, _ = self.__tags[tag_id]
+
+        # Measured tag position in the robot frame at capture time
+        measurement = camera_to_robot(x, z * CAMERA_DEPTH_SCALE, cam_id)
+        distance = float(np.linalg.norm(measurement))
+
+        # Expected measurement from the state, moved back to where the robot was at capture time
+        to_robot = rotation(-self.field_heading(capture_heading))
+        capture_position = self.__state[:2] - self.__state[2:] * latency
+        expected = to_robot @ (tag_position - capture_position)
+
+        h = np.zeros((2, 4), dtype=np.float64)
+        h[:, :2] = -to_robot
+        h[:, 2:] = to_robot * latency
+
+        # The noise is larger along the camera axis than across it
+        yaw = CAMERA_YAWS[cam_id]
+        axes = rotation(yaw)
+        lateral = LATERAL_NOISE[0] + LATERAL_NOISE[1] * distance
+        depth = DEPTH_NOISE[0] + DEPTH_NOISE[1] * distance
+        r = axes @ np.diag([depth ** 2, lateral ** 2]) @ axes.T
+
+        innovation = measurement - expected
+        s = h @ self.__covariance @ h.T + r
+        s_inv = np.linalg.inv(s)
+
+        # Reject the outliers unless the estimate was never initialized
+        if self.is_valid(now) and innovation @ s_inv @ innovation > OUTLIER_GATE:
+            return False
+
+        k = self.__covariance @ h.T @ s_inv
+        self.__state = self.__state + k @ innovation
+        self.__covariance = (np.eye(4) - k @ h) @ self.__covariance
+
+        self.__last_update = now
+        return True
+
+    def tag_in_camera(self, tag_id: int, heading: float, cam_id: int):
+        # Where the tag should be seen by the camera from the estimated pose, with the depth scaled like the measurements
+        tag_position, _ = self.__tags[tag_id]
+        p = rotation(-self.field_heading(heading)) @ (tag_position - self.__state[:2])
+        x, z = robot_to_camera(p, cam_id)
+
+        return x, z
@@ -0,0 +1,88 @@
+import math
+
+import numpy as np
+
+
+def __wrap_angle__(angle: float) -> float:
+    return (angle + math.pi) % (2 * math.pi) - math.pi
+
+
+class PoseHistory:
+    # Fixed capacity history of the robot pose, stored in parallel arrays used as a ring buffer
+    # Samples must be appended in increasing time order
+    def __init__(self, capacity: int = 128):
+        self.__capacity = capacity
+
+        self.__time = np.zeros(capacity, dtype=np.float64)
+        self.__x = np.zeros(capacity, dtype=np.float64)
+        self.__y = np.zeros(capacity, dtype=np.float64)
+        self.__heading = np.zeros(capacity, dtype=np.float64)
+
+        self.__start = 0
+        self.__count = 0
+
+    def __len__(self) -> int:
+        return self.__count
+
+    def clear(self):
+        self.__start = 0
+        self.__count = 0
+
+    def append(self, timestamp: float, x: float, y: float, heading: float):
+        if self.__count < self.__capacity:
+            index = (self.__start + self.__count) % self.__capacity
+            self.__count += 1
+        else:
+            # Overwrite the oldest sample
+            index = self.__start
+            self.__start = (self.__start + 1) % self.__capacity
+
+        self.__time[index] = timestamp
+        self.__x[index] = x
+        self.__y[index] = y
+        self.__heading[index] = heading
+
+    def oldest_time(self) -> float:
+        return float(self.__time[self.__start]) if self.__count > 0 else math.inf
+
+    def latest_time(self) -> float:
+        return float(self.__time[(self.__start + self.__count - 1) % self.__capacity]) if self.__count > 0 else -math.inf
+
+    def __physical__(self, i: int) -> int:
+        return (self.__start + i) % self.__capacity
+
+    def __search__(self, timestamp: float) -> int:
+        # Binary search of the first sample at or after the timestamp, in logical order
+        low = 0
+        high = self.__count
+        while low < high:
+            mid = (low + high) // 2
+            if self.__time[self.__physical__(mid)] < timestamp:
+                low = mid + 1
+            else:
+                high = mid
+
+        return low
+
+    def sample(self, timestamp: float):
+        # Interpolated (x, y, heading) at the timestamp, None if it is outside of the history
+        if self.__count == 0 or timestamp < self.oldest_time() or timestamp > self.latest_time():
+            return None
+
+        i = self.__search__(timestamp)
+        after = self.__physical__(i)
+        if i == 0 or self.__time[after] == timestamp:
+            return float(self.__x[after]), float(self.__y[after]), float(self.__heading[after])
+
+        before = self.__physical__(i - 1)
+        t0 = self.__time[before]
+        t1 = self.__time[after]
+        ratio = (timestamp - t0) / (t1 - t0)
+
+        x = self.__x[before] + (self.__x[after] - self.__x[before]) * ratio
+        y = self.__y[before] + (self.__y[after] - self.__y[before]) * ratio
+
+        # Interpolate the heading on the shortest path between the two samples
+        heading = self.__heading[before] + __wrap_angle__(self.__heading[after] - self.__heading[before]) * ratio
+
+        return float(x), float(y), float(heading)
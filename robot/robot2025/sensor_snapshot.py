@@ -0,0 +1,45 @@
+class SensorReading:
+    # Value of a sensor, read once per loop when it belongs to a snapshot and every time without one
+    # A component writing to the sensor invalidates the reading so the next get reads the sensor again
+    def __init__(self, read, cached: bool = False):
+        self.__read = read
+        self.__cached = cached
+        self.__value = None
+        self.__valid = False
+
+    def refresh(self):
+        self.__value = self.__read()
+        self.__valid = True
+
+    def invalidate(self):
+        self.__valid = False
+
+    def get(self):
+        if not self.__cached:
+            return self.__read()
+
+        if not self.__valid:
+            self.refresh()
+
+        return self.__value
+
+
+class SensorSnapshot:
+    # Every registered sensor read once at the start of the loop, so every component sees the same values during the loop
+    def __init__(self):
+        self.__readings = []
+
+    def add(self, read) -> SensorReading:
+        reading = SensorReading(read, cached=True)
+        self.__readings.append(reading)
+
+        return reading
+
+    def refresh(self):
+        for reading in self.__readings:
+            reading.refresh()
+
+
+def sensor_reading(read, sensors: SensorSnapshot = None) -> SensorReading:
+    # The sensor is read directly when the robot has no snapshot
+    return SensorReading(read) if sensors is None else sensors.add(read)
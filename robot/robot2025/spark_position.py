@@ -0,0 +1,63 @@
+import rev
+
+
+class SparkFlexPositionLoop:
+    # SPARK Flex running the position loop of a mechanism on its own controller at 1 kHz, along a MAXMotion profile
+    # The positions are in mechanism units through the conversion factor and the velocities in units per second
+    # Only the changes of the reference are sent over the CAN bus
+    def __init__(self, can_id: int, units_per_rotation: float, inverted: bool = False, brake: bool = True):
+        self.__motor = rev.SparkFlex(can_id, rev.SparkLowLevel.MotorType.kBrushless)
+        self.__encoder = self.__motor.getEncoder()
+        self.__controller = self.__motor.getClosedLoopController()
+
+        self.__config = rev.SparkFlexConfig()
+        self.__config.inverted(inverted).setIdleMode(rev.SparkBaseConfig.IdleMode.kBrake if brake else rev.SparkBaseConfig.IdleMode.kCoast)
+        self.__config.encoder.positionConversionFactor(units_per_rotation).velocityConversionFactor(units_per_rotation / 60)
+
+        # The controller is reset once, nothing is persisted so the code stays the only source of the configuration
+        self.__motor.configure(self.__config, rev.SparkBase.ResetMode.kResetSafeParameters, rev.SparkBase.PersistMode.kNoPersistParameters)
+
+        self.__reference = None
+
+    def configure(self, kp: float, ki: float, kd: float, max_velocity: float, max_acceleration: float, tolerance: float, reverse_limit: float, forward_limit: float):
+        self.__config.closedLoop.pid(kp, ki, kd).outputRange(-1, 1)
+        self.__config.closedLoop.maxMotion.maxVelocity(max_velocity).maxAcceleration(max_acceleration).allowedClosedLoopError(tolerance)
+        self.__config.softLimit \
+            .reverseSoftLimit(reverse_limit).reverseSoftLimitEnabled(True) \
+            .forwardSoftLimit(forward_limit).forwardSoftLimitEnabled(True)
+
+        # Called again when the gains are tuned from the dashboard, only the new values are applied on top of the current ones
+        self.__motor.configure(self.__config, rev.SparkBase.ResetMode.kNoResetSafeParameters, rev.SparkBase.PersistMode.kNoPersistParameters)
+
+    def set_forward_limit(self, forward_limit: float):
+        self.__config.softLimit.forwardSoftLimit(forward_limit)
+
+        limit_config = rev.SparkFlexConfig()
+        limit_config.softLimit.forwardSoftLimit(forward_limit)
+        self.__motor.configure(limit_config, rev.SparkBase.ResetMode.kNoResetSafeParameters, rev.SparkBase.PersistMode.kNoPersistParameters)
+
+    def seed_position(self, position: float):
+        # The motor encoder is relative, it takes the position of an absolute sensor when the robot is enabled
+        self.__encoder.setPosition(position)
+
+    def get_position(self) -> float:
+        return self.__encoder.getPosition()
+
+    def get_velocity(self) -> float:
+        return self.__encoder.getVelocity()
+
+    def set_position(self, position: float, feedforward: float = 0.):
+        if self.__reference == (position, feedforward):
+            return
+
+        self.__reference = (position, feedforward)
+        self.__controller.setReference(position, rev.SparkLowLevel.ControlType.kMAXMotionPositionControl, rev.ClosedLoopSlot.kSlot0,
+                                       feedforward, rev.SparkClosedLoopController.ArbFFUnits.kPercentOut)
+
+    def reset_reference(self):
+        # The controller forgets its reference when the robot is disabled, the next one must be sent again
+        self.__reference = None
+
+    def set(self, value: float):
+        self.__reference = None
+        self.__motor.set(value)
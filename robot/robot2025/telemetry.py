@@ -0,0 +1,125 @@
+import math
+import time
+
+import numpy as np
+
+from ntcore import NetworkTableInstance, PubSubOptions
+
+
+TELEMETRY_PERIOD = 0.1
+TELEMETRY_TABLE = '/SmartDashboard'
+
+
+def read_only(value):
+    # Setter of the properties the dashboard cannot change, the builders of wpilib do not take None
+    pass
+
+
+class TelemetryBuilder:
+    # Collects the properties a component registers in initSendable instead of handing them to the dashboard
+    def __init__(self):
+        self.properties = []
+        self.unsupported = False
+
+    def addDoubleProperty(self, key: str, getter, setter):
+        self.properties.append((key, getter, setter, False))
+
+    def addBooleanProperty(self, key: str, getter, setter):
+        self.properties.append((key, getter, setter, True))
+
+    def __getattr__(self, name: str):
+        # Other property types stay on the dashboard, the rest of the builder does not matter to the telemetry
+        if name.startswith('add') and name.endswith('Property'):
+            self.unsupported = True
+
+        return lambda *args, **kwargs: None
+
+
+class Telemetry:
+    # Samples the properties of every component at a fixed rate and only publishes the ones that changed
+    # All the values live in one preallocated array, a property is sent when it moved by more than its deadband
+    def __init__(self, nt: NetworkTableInstance = None, period: float = TELEMETRY_PERIOD):
+        self.__nt = NetworkTableInstance.getDefault() if nt is None else nt
+        self.__table = self.__nt.getTable(TELEMETRY_TABLE)
+        self.__period = period
+        self.__last_update = -math.inf
+
+        self.__keys = {}
+        self.__getters = []
+        self.__publishers = []
+        self.__booleans = []
+        self.__settables = []
+
+        self.__values = np.zeros(0, dtype=np.float64)
+        self.__published = np.zeros(0, dtype=np.float64)
+        self.__deadbands = np.zeros(0, dtype=np.float64)
+        self.__sent = np.zeros(0, dtype=bool)
+
+    def add_component(self, name: str, component, deadbands: dict = None):
+        # The deadbands are by property key, the other properties are sent on every change
+        builder = TelemetryBuilder()
+        component.initSendable(builder)
+        if builder.unsupported:
+            return
+
+        table = self.__table.getSubTable(name)
+        for key, getter, setter, boolean in builder.properties:
+            topic = table.getBooleanTopic(key) if boolean else table.getDoubleTopic(key)
+            # Nothing written from the dashboard is read back for a read only property
+            if setter is None or setter is read_only:
+                publisher = topic.publish()
+            else:
+                # The values written from the dashboard come back through the entry, not the ones published here
+                publisher = topic.getEntry(False if boolean else 0., PubSubOptions(excludeSelf=True))
+                self.__settables.append((publisher, setter))
+
+            self.__keys[(name, key)] = len(self.__getters)
+            self.__getters.append(getter)
+            self.__publishers.append(publisher)
+            self.__booleans.append(boolean)
+
+        # Grown once per component at startup, never during the loop
+        added = len(self.__getters) - len(self.__values)
+        self.__values = np.zeros(len(self.__getters), dtype=np.float64)
+        self.__published = np.append(self.__published, np.zeros(added))
+        self.__deadbands = np.append(self.__deadbands, [0. if deadbands is None else deadbands.get(key, 0.) for key, _, _, _ in builder.properties])
+        self.__sent = np.append(self.__sent, np.zeros(added, dtype=bool))
+
+        # The dashboard no longer samples the component by itself
+        component.initSendable = lambda builder: None
+
+    def set_deadband(self, name: str, key: str, deadband: float):
+        self.__deadbands[self.__keys[(name, key)]] = deadband
+
+    def update(self):
+        now = time.monotonic()
+        if now - self.__last_update < self.__period:
+            return
+        self.__last_update = now
+
+        for entry, setter in self.__settables:
+            for value in entry.readQueue():
+                setter(value.value)
+
+        # Every getter is called once per period, however many clients watch the dashboard
+        values = self.__values
+        for i, getter in enumerate(self.__getters):
+            values[i] = getter()
+
+        # A NaN that was already sent is not a change
+        changed = ~(np.abs(values - self.__published) <= self.__deadbands)
+        changed &= ~(self.__sent & np.isnan(values) & np.isnan(self.__published))
+        changed |= ~self.__sent
+
+        indices = np.flatnonzero(changed)
+        if len(indices) == 0:
+            return
+
+        for i in indices:
+            self.__publishers[i].set(bool(values[i]) if self.__booleans[i] else float(values[i]))
+
+        self.__published[indices] = values[indices]
+        self.__sent[indices] = True
+
+        # Every change of the period goes out together
+        self.__nt.flush()
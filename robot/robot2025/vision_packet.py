@@ -0,0 +1,117 @@
+from typing import List, NamedTuple, Tuple
+
+import struct
+import numpy as np
+
+from ntcore import NetworkTableInstance, PubSubOptions
+
+
+# Layout of a detection packet, must match apriltags/frc_apriltags/packet.py
+PACKET_MAGIC = b'ATP2'
+PACKET_HEADER = struct.Struct('<4sIHB5x')
+PACKET_TOPIC = '/vision/cam{}/detections'
+# Packets kept between two robot loops, the cameras can send more than one per loop
+PACKET_QUEUE_SIZE = 8
+
+# Arrays following the header: timestamp, corners, pose_t, pose_R, tag id
+PACKET_FIELDS = (
+    ('<f8', ()),
+    ('<f4', (4, 2)),
+    ('<f4', (3,)),
+    ('<f4', (3, 3)),
+    ('<u2', ()),
+)
+PACKET_TAG_SIZE = sum(np.dtype(dtype).itemsize * int(np.prod(shape, dtype=np.int64)) for dtype, shape in PACKET_FIELDS)
+
+
+class TagDetection(NamedTuple):
+    tag_id: int
+    cam_id: int
+    timestamp: float
+    corners: np.ndarray
+    pose_t: np.ndarray
+    pose_R: np.ndarray
+
+    @property
+    def x(self) -> float:
+        return float(self.pose_t[0])
+
+    @property
+    def z(self) -> float:
+        return float(self.pose_t[2])
+
+
+class DetectionFrame(NamedTuple):
+    cam_id: int
+    sequence: int
+    detections: Tuple[TagDetection, ...]
+    # Robot time (s) the packet was received at, -1 for a frame that was never received
+    received_time: float = -1.
+
+    def get(self, tag_id: int):
+        for d in self.detections:
+            if d.tag_id == tag_id:
+                return d
+
+        return None
+
+
+def decode_packet(data: bytes):
+    if len(data) < PACKET_HEADER.size:
+        return None
+
+    magic, sequence, count, cam_id = PACKET_HEADER.unpack_from(data)
+    if magic != PACKET_MAGIC or len(data) != PACKET_HEADER.size + count * PACKET_TAG_SIZE:
+        return None
+
+    # Every array is a view in the packet, nothing is copied
+    offset = PACKET_HEADER.size
+    arrays = []
+    for dtype, shape in PACKET_FIELDS:
+        size = int(np.prod(shape, dtype=np.int64))
+        array = np.frombuffer(data, dtype=dtype, count=count * size, offset=offset).reshape((count,) + shape)
+        offset += array.nbytes
+        arrays.append(array)
+
+    timestamps, corners, pose_t, pose_R, tag_ids = arrays
+
+    detections = tuple(TagDetection(int(tag_ids[i]), cam_id, float(timestamps[i]), corners[i], pose_t[i], pose_R[i]) for i in range(count))
+    return DetectionFrame(cam_id, sequence, detections)
+
+
+class DetectionPacketReader:
+    # Decodes the detection packet of every camera, a whole frame is swapped at once so the tags are never mixed between frames
+    def __init__(self, nt: NetworkTableInstance = None, cam_ids=(0, 1)):
+        nt = NetworkTableInstance.getDefault() if nt is None else nt
+
+        options = PubSubOptions(pollStorage=PACKET_QUEUE_SIZE)
+        self.__subscribers = {cam_id: nt.getRawTopic(PACKET_TOPIC.format(cam_id)).subscribe('apriltags', b'', options) for cam_id in cam_ids}
+        self.__frames = {cam_id: DetectionFrame(cam_id, -1, ()) for cam_id in cam_ids}
+
+    def update(self) -> List[DetectionFrame]:
+        # Returns every frame received since the last update, of all the cameras in the order they were received
+        packets = []
+        for cam_id, subscriber in self.__subscribers.items():
+            packets.extend((packet.time, cam_id, packet.value) for packet in subscriber.readQueue())
+
+        packets.sort(key=lambda packet: packet[0])
+
+        new_frames = []
+        for received_time, cam_id, data in packets:
+            frame = decode_packet(data)
+            if frame is None or frame.cam_id != cam_id or frame.sequence == self.__frames[cam_id].sequence:
+                continue
+
+            # The NetworkTables time is in microseconds, on the robot it is the FPGA time
+            frame = frame._replace(received_time=received_time / 1e6)
+
+            self.__frames[cam_id] = frame
+            new_frames.append(frame)
+
+        return new_frames
+
+    def get_cam_ids(self):
+        return tuple(self.__frames)
+
+    def get_frame(self, cam_id: int) -> DetectionFrame:
+        return self.__frames[cam_id]
@@ -7,6 +7,9 @@ from frctools.frcmath import approximately
 
 import wpiutil
 
+from .telemetry import read_only
+from .sensor_snapshot import SensorSnapshot, SensorReading, sensor_reading
+
 
 BOTTOM_TARGET = 0.4
 TOP_TARGET = 0.71
@@ -16,16 +19,18 @@ TOP_TARGET = 0.71
 class Yeeter(Component):
     __motor: WPI_CANSparkMax
     __encoder: Encoder
+    __angle: SensorReading
 
     __target: float = 0
 
     __control_coroutine = None
 
-    def __init__(self, motor: WPI_CANSparkMax, encoder: Encoder):
+    def __init__(self, motor: WPI_CANSparkMax, encoder: Encoder, sensors: SensorSnapshot = None):
         super().__init__()
 
         self.__motor = motor
         self.__encoder = encoder
+        self.__angle = sensor_reading(encoder.get, sensors)
 
     def init(self):
         self.__target = self.get_angle()
@@ -43,7 +48,7 @@ class Yeeter(Component):
             yield None
 
     def get_angle(self) -> float:
-        return self.__encoder.get()
+        return self.__angle.get()
 
     def set_target(self, target: float):
         self.__target = target
@@ -67,6 +72,6 @@ class Yeeter(Component):
         yield from self.wait_for_target(0.03)
 
     def initSendable(self, builder: wpiutil.SendableBuilder):
-        builder.addDoubleProperty('angle', self.get_angle, lambda v: None)
-        builder.addDoubleProperty('error', self.error, lambda v: None)
-        builder.addBooleanProperty('at_target', self.is_at_target, lambda v: None)
+        builder.addDoubleProperty('angle', self.get_angle, read_only)
+        builder.addDoubleProperty('error', self.error, read_only)
+        builder.addBooleanProperty('at_target', self.is_at_target, read_only)
@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+from robot2025.motion_profile import TrapezoidProfile, ElevatorFeedforward
+
+
+CASES = 20000
+TOLERANCE = 1e-6
+
+
+def random_profile(rng: random.Random):
+    profile = TrapezoidProfile(rng.uniform(0.1, 3.), rng.uniform(0.5, 10.))
+
+    # Start faster than the max velocity and away from the goal in some of the cases
+    position = rng.uniform(-2., 2.)
+    velocity = rng.uniform(-2., 2.) * profile.max_velocity
+    goal = rng.choice((rng.uniform(-2., 2.), position))
+
+    return profile, position, velocity, goal
+
+
+def sample_times(profile: TrapezoidProfile, steps: int = 50):
+    return [profile.duration * i / steps for i in range(steps + 1)]
+
+
+def test_fuzz_ends_on_goal():
+    rng = random.Random(3117)
+
+    for _ in range(CASES):
+        profile, position, velocity, goal = random_profile(rng)
+        profile.plan(position, velocity, goal)
+
+        start = profile.sample(0.)
+        assert start.position == pytest.approx(position, abs=TOLERANCE)
+        assert start.velocity == pytest.approx(velocity, abs=TOLERANCE)
+
+        # Just before the end, so the state comes from the last segment and not from the finished profile
+        end = profile.sample(max(0., profile.duration - 1e-9))
+        assert end.position == pytest.approx(goal, abs=TOLERANCE)
+        assert end.velocity == pytest.approx(0., abs=TOLERANCE)
+
+        assert profile.is_finished(profile.duration)
+        assert profile.sample(profile.duration + 1.) == (goal, 0., 0.)
+
+
+def test_fuzz_stays_in_limits():
+    rng = random.Random(2025)
+
+    for _ in range(CASES // 10):
+        profile, position, velocity, goal = random_profile(rng)
+        profile.plan(position, velocity, goal)
+
+        # The velocity only goes over the limit while slowing down from a faster start
+        max_velocity = max(profile.max_velocity, abs(velocity)) + TOLERANCE
+
+        last_t = 0.
+        last = profile.sample(0.)
+        for t in sample_times(profile)[1:]:
+            state = profile.sample(t)
+            assert abs(state.velocity) <= max_velocity
+            assert abs(state.acceleration) <= profile.max_acceleration + TOLERANCE
+
+            # No jump of the setpoint between two samples
+            assert abs(state.position - last.position) <= max_velocity * (t - last_t) + TOLERANCE
+
+            last_t, last = t, state
+
+
+def test_replan_keeps_setpoint_continuous():
+    profile = TrapezoidProfile(1., 2.)
+    profile.plan(0., 0., 1.)
+
+    # A new goal in the middle of the move starts from the current setpoint
+    state = profile.sample(0.6)
+    profile.plan(state.position, state.velocity, -0.5)
+
+    replanned = profile.sample(0.)
+    assert replanned.position == pytest.approx(state.position)
+    assert replanned.velocity == pytest.approx(state.velocity)
+    assert profile.sample(profile.duration - 1e-9).position == pytest.approx(-0.5, abs=TOLERANCE)
+
+
+def test_feedforward():
+    feedforward = ElevatorFeedforward(0.01, 0.05, 0.4, 0.02)
+
+    assert feedforward.calculate(0.) == pytest.approx(0.05)
+    assert feedforward.calculate(1., 2.) == pytest.approx(0.01 + 0.05 + 0.4 + 0.04)
+    assert feedforward.calculate(-1.) == pytest.approx(-0.01 + 0.05 - 0.4)